@@ -5,6 +5,7 @@ Flask backend server for converting NPZ files to MP4 videos
 
 from flask import Flask, send_file, request, jsonify, Response
 from flask_cors import CORS
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 import numpy as np
 import cv2
 import os
@@ -14,9 +15,31 @@ import logging
 from datetime import datetime
 import base64
 from io import BytesIO
-import pandas as pd
-from typing import Dict, List, Union, Any
+from contextlib import closing
+from functools import partial
+from typing import Dict, List, Optional, Union, Any
 import json
+import time
+
+from frame_cache import FrameCache, NoFramesError, find_frames_key
+from frame_executor import FrameExecutor
+from blob_store import BLOB_KINDS, FRAME_LENGTH, BlobStore
+from exam_index import ExamIndex
+from file_index import SORT_FIELDS, FileIndex, InvalidCursor
+from frame_store import FrameStore, iter_npz_paths
+from jobs import JobManager, JobQueueFull
+from metrics import Metrics
+from npz_header import read_npz_headers
+from preprocess_pipeline import PreprocessPipeline
+from process_pool import (PoolBusy, ProcessPool, batches, encode_clip, encode_jpegs, follow_file,
+                          preprocess_frames, stream_clip, take_array)
+from npz_stream import clip_length, frame_chunks
+from renditions import PROFILES, RenditionManager, clip_dimensions, clip_to_bgr, frames_first, iter_bgr_frames
+from stream_engine import STREAM_BATCH_FRAMES, StreamEngine, jpeg_frame
+from struct_pred import EXTRACT_MODES, apply_field_plan, compile_field_plan
+from transcode_cache import TranscodeCache
+from video_encoder import PRESETS, EncoderError, EncoderRegistry
+from warmup import WarmupManager, WarmupQueueFull, exam_clip_paths
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -107,6 +130,9 @@ standardized_structure = {
     },
 }
 
+# standardized_structure flattened once into (category, field, keys, mode override) specs
+struct_pred_plan = compile_field_plan(standardized_structure)
+
 app = Flask(__name__)
 
 # Load environment variables (optional)
@@ -119,17 +145,204 @@ except Exception as e:  # ModuleNotFoundError or other
 
 # CORS configuration from environment
 cors_origins = os.environ.get('CORS_ORIGINS', '*')
+# Frame metadata headers must be readable by the frontend (e.g. X-Frame-Shape of raw frames)
+cors_expose_headers = ["X-Frame-Index", "X-Frame-Count", "X-Frame-Range", "X-Frame-Shape", "X-Frame-Dtype", "X-Frame-Mime",
+                       "Server-Timing"]
+cors_allow_headers = ["Content-Type", "X-Profile"]
 if cors_origins == '*':
-    CORS(app, origins="*", allow_headers=["Content-Type"], supports_credentials=True)
+    CORS(app, origins="*", allow_headers=cors_allow_headers, expose_headers=cors_expose_headers, supports_credentials=True)
 else:
     origins_list = [origin.strip() for origin in cors_origins.split(',')]
-    CORS(app, origins=origins_list, allow_headers=["Content-Type"], supports_credentials=True)
+    CORS(app, origins=origins_list, allow_headers=cors_allow_headers, expose_headers=cors_expose_headers, supports_credentials=True)
+
+# On-disk cache of encoded MP4s (TRANSCODE_CACHE_DIR / TRANSCODE_CACHE_MAX_BYTES)
+transcode_cache = TranscodeCache.from_env()
+
+# Decoded frame arrays shared by convert/preprocess/stream/inspect (FRAME_CACHE_MAX_BYTES)
+frame_cache = FrameCache.from_env()
+
+# Memory-mapped .npy sidecars, used instead of the NPZ once ingested (FRAME_STORE_DIR / FRAME_STORE_AUTO_INGEST)
+frame_store = FrameStore.from_env(frame_cache)
+
+# Thread pool for per-frame OpenCV work (FRAME_WORKERS / FRAME_MAX_IN_FLIGHT)
+frame_executor = FrameExecutor.from_env()
+
+# Worker processes for CPU-heavy request work: preprocess, MP4 and stream encoding
+# (PROCESS_POOL_WORKERS / PROCESS_POOL_MAX_QUEUE / PROCESS_POOL_ON_FULL / PROCESS_POOL_RETRY_AFTER)
+process_pool = ProcessPool.from_env()
+
+# MP4 encoders probed on first use; fastest working one per preset (VIDEO_ENCODER / VIDEO_PRESET / FFMPEG_BINARY)
+video_encoders = EncoderRegistry.from_env()
+
+# Rendition ladder (thumbnail / model / preview / full) stored in the transcode cache
+renditions = RenditionManager(transcode_cache, frame_store, video_encoders, frame_executor)
+
+# Browser cache lifetime of frames and MP4s; revalidated with their ETag afterwards
+HTTP_MAX_AGE_SECONDS = 300
+
+# Short-lived binary handles for /api/preprocess "transport": "binary" (BLOB_DIR / BLOB_TTL_SECONDS)
+blob_store = BlobStore.from_env()
+
+# exam_id index over the struct_pred DB JSON, reloaded when the file changes
+exam_index = ExamIndex(str(Path(__file__).resolve().parent.parent / 'public' / 'DB_json' / 'eval_result-attn-50-3_local.json'))
+
+# scandir listings for /api/list, reused until a directory's mtime changes
+file_index = FileIndex()
+
+# Low-priority background warm-up of study folders (WARMUP_WORKERS / WARMUP_MAX_QUEUE / WARMUP_PROFILES / WARMUP_NICE)
+warmup_manager = WarmupManager.from_env(renditions, frame_store)
+
+# Asynchronous convert/preprocess jobs on spawned worker processes (JOB_WORKERS / JOB_MAX_QUEUE / JOB_NOTIFY_URL)
+job_manager = JobManager.from_env(transcode_cache)
+
+# Paced, prefetching MJPEG streams encoded on the frame executor (STREAM_PREFETCH_FRAMES)
+stream_engine = StreamEngine.from_env(frame_executor)
+
+# Latency histograms per route and span, byte counters and cache gauges for /api/metrics
+metrics = Metrics()
+metrics.register_collector('transcode_cache', transcode_cache.stats,
+                           counters=('hits', 'misses', 'evictions', 'coalesced'))
+metrics.register_collector('frame_cache', frame_cache.stats, counters=('hits', 'misses', 'coalesced', 'evictions'))
+metrics.register_collector('frame_store', frame_store.stats,
+                           counters=('mmap_opens', 'fallbacks', 'streamed', 'ingested'))
+metrics.register_collector('blob_store', blob_store.stats, counters=('created', 'served', 'expired'))
+metrics.register_collector('renditions', renditions.stats, counters=('built', 'coalesced'))
+metrics.register_collector('file_index', file_index.stats,
+                           counters=('scans', 'dir_hits', 'header_reads', 'header_hits'))
+metrics.register_collector('warmup', warmup_manager.stats, counters=('completed', 'failed'))
+metrics.register_collector('jobs', job_manager.stats,
+                           counters=('submitted', 'coalesced', 'completed', 'failed', 'notify_errors'))
+metrics.register_collector('streams', stream_engine.stats, counters=('completed', 'disconnected'))
+metrics.register_collector('process_pool', process_pool.stats,
+                           counters=('completed', 'failed', 'rejected', 'inline'))
+
+@app.before_request
+def begin_request_metrics():
+    metrics.begin_request(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def end_request_metrics(response):
+    """Record latency and bytes; "X-Profile: 1" returns the request's spans in Server-Timing"""
+    profile = metrics.current()
+    if profile is None:
+        return response
+    if request.headers.get('X-Profile') == '1':
+        response.headers['Server-Timing'] = profile.server_timing()
+    if not response.is_streamed:
+        metrics.end_request(profile, request.method, response.status_code, request.content_length,
+                            response.content_length)
+        return response
+    # Streamed bodies (files, encodes, NDJSON) are sent after this hook: record them once the server closes them
+    bytes_out = response.content_length
+    if bytes_out is None:
+        response.response = metrics.count_stream(response.response, profile)
+    on_close = partial(metrics.end_streamed_request, profile, request.method, response.status_code,
+                       request.content_length, bytes_out, time.perf_counter())
+    if response.direct_passthrough:
+        _on_body_close(response.response, on_close)
+    else:
+        response.call_on_close(on_close)
+    return response
+
+def _on_body_close(body, callback):
+    """Run callback after the server closes a passthrough body (send_file's file wrapper).
+
+    Werkzeug hands such bodies to the server as they are, so call_on_close never
+    fires for them; replacing the body would lose the server's sendfile path.
+    """
+    close = getattr(body, 'close', None)
+
+    def closed():
+        try:
+            if close is not None:
+                close()
+        finally:
+            callback()
+    try:
+        body.close = closed
+    except AttributeError:
+        callback()
+
+def _clip_etag(st: os.stat_result, *parts) -> str:
+    """Validator for a derived response: changes with the NPZ's mtime/size and the request parameters"""
+    return '-'.join([f"{st.st_mtime_ns:x}", f"{st.st_size:x}"] + [str(p) for p in parts])
+
+def _not_modified(etag: str, st: os.stat_result):
+    """304 response if the client already holds this version, else None"""
+    if etag in request.if_none_match or (
+            not request.if_none_match and request.if_modified_since
+            and int(st.st_mtime) <= request.if_modified_since.timestamp()):
+        response = Response(status=304)
+        _set_cache_headers(response, etag, st)
+        return response
+    return None
+
+def _set_cache_headers(response: Response, etag: str, st: os.stat_result):
+    response.set_etag(etag)
+    response.last_modified = int(st.st_mtime)
+    # Patient images: cacheable by the browser only, never by shared proxies
+    response.cache_control.private = True
+    response.cache_control.max_age = HTTP_MAX_AGE_SECONDS
+
+def _send_cached_file(path: str, etag: str, st: os.stat_result, download_name: str, mimetype: str = 'video/mp4'):
+    """Serve a cached MP4 (or other cached artifact) with Range (206) and conditional (304) support"""
+    try:
+        response = send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=False,
+            download_name=download_name,
+            conditional=True,
+            etag=etag,
+            last_modified=int(st.st_mtime),
+            max_age=HTTP_MAX_AGE_SECONDS
+        )
+    except RequestedRangeNotSatisfiable as e:
+        # Raised by send_file; returned here so the routes' catch-all handlers do not turn it into a 500
+        return e.get_response()
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+def _is_partial_request() -> bool:
+    """True for a Range request other than the "bytes=0-" a video element sends first"""
+    byte_range = request.range
+    if byte_range is None or byte_range.units != 'bytes':
+        return False
+    return byte_range.ranges != [(0, None)]
+
+def _pool_busy(e: PoolBusy):
+    """503 for work the process pool has no room for, with the configured Retry-After"""
+    response = jsonify({"error": str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+def _publish_when_done(cache_key: str, tmp_path: str, future):
+    """Publish a worker's encode once it completes (the client that started it may be gone)"""
+    if future.cancelled() or future.exception() is not None:
+        transcode_cache.discard(tmp_path)
+    else:
+        transcode_cache.publish(cache_key, tmp_path)
 
 @app.route('/api/convert-npz', methods=['GET'])
 def convert_npz_to_mp4():
     """
     Convert NPZ file to MP4 video
-    Query parameter: path - Full path to the NPZ file
+    Query parameters:
+    - path: Full path to the NPZ file
+    - fps: frames per second of the encoded video (default: 20)
+    - preset: "fast", "balanced" or "quality" (default: VIDEO_PRESET)
+    - profile: "full" (default) or "preview" (small MP4 from the rendition ladder)
+
+    Encoded videos are kept in the transcode cache, so repeated requests for an
+    unchanged NPZ are served straight from disk without decoding or encoding.
+    With the ffmpeg encoder a cache miss is streamed as fragmented MP4 while it
+    is being encoded, and the same bytes are written to the cache.
+
+    The cache key doubles as the ETag: If-None-Match / If-Modified-Since are
+    answered with 304 before anything is encoded, and cached files are served
+    with byte ranges (206) so seeking does not re-encode. A seek that arrives
+    before the file is cached waits for the encode instead of streaming.
     """
     try:
         # Get the file path from query parameter
@@ -152,119 +365,148 @@ def convert_npz_to_mp4():
             return jsonify({"error": "File must be an NPZ file"}), 400
         
         try:
-            # Load NPZ file
+            fps = float(request.args.get('fps', 20.0))  # 20 FPS for echo videos
+        except ValueError:
+            return jsonify({"error": "Invalid 'fps' parameter"}), 400
+        if fps <= 0:
+            return jsonify({"error": "Invalid 'fps' parameter"}), 400
+        profile = request.args.get('profile', 'full')
+        if profile not in ('full', 'preview'):
+            return jsonify({"error": f"Unsupported profile '{profile}' for MP4, expected 'full' or 'preview'"}), 400
+        st = os.stat(npz_path)
+        if profile == 'preview':
+            preview_key = renditions.key_for(npz_path, 'preview', fps)
+            not_modified = _not_modified(preview_key, st)
+            if not_modified is not None:
+                return not_modified
+            with metrics.span('render'):
+                preview_path = renditions.get(npz_path, 'preview', fps)
+            return _send_cached_file(preview_path, preview_key, st,
+                                    f"{Path(npz_path).stem}.preview.mp4")
+        
+        try:
+            video_encoder = video_encoders.get(request.args.get('preset'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except EncoderError as e:
+            return jsonify({"error": str(e)}), 500
+        # Cached artifacts are keyed by encoder so switching backends or presets never serves a stale file
+        codec = video_encoder.name
+        
+        with metrics.span('key'):
+            cache_key = transcode_cache.make_key(npz_path, codec, fps)
+        not_modified = _not_modified(cache_key, st)
+        if not_modified is not None:
+            return not_modified
+        with metrics.span('key'):
+            cached_mp4_path = transcode_cache.get(cache_key)
+        temp_mp4_path = None
+        if not cached_mp4_path:
+            # Requests for a clip another request is already encoding wait for that encode
+            with metrics.span('wait'):
+                cached_mp4_path, temp_mp4_path = transcode_cache.claim(cache_key)
+        if cached_mp4_path:
+            logger.info(f"Serving cached MP4: {cached_mp4_path}")
+            return _send_cached_file(cached_mp4_path, cache_key, st, f"{Path(npz_path).stem}.mp4")
+        
+        try:
+            # Load NPZ frames (mmap sidecar, shared decoded-frame cache, or chunked reader for long clips)
             logger.info(f"Loading NPZ file: {npz_path}")
-            with np.load(npz_path) as data:
-                # Try different possible keys for frames
-                frames_key = None
-                possible_keys = ['frames', 'video', 'data', 'array', 'arr_0']
-                
-                for key in possible_keys:
-                    if key in data.files:
-                        frames_key = key
-                        break
-                
-                # If no standard key found, use the first available key
-                if frames_key is None and len(data.files) > 0:
-                    frames_key = data.files[0]
-                    logger.info(f"Using first available key: {frames_key}")
-                
-                if frames_key is None:
-                    logger.error("No data found in NPZ file")
-                    return jsonify({"error": "No data found in NPZ file"}), 400
-                
-                frames = data[frames_key]
-                logger.info(f"Loaded frames with shape: {frames.shape}")
-                
-                # Validate frames shape
-                if frames.ndim < 3:
-                    logger.error(f"Invalid frames shape: {frames.shape}")
-                    return jsonify({"error": f"Invalid frames shape: {frames.shape}"}), 400
-                
-                # Handle different frame formats
-                if frames.ndim == 3:
-                    # Assume shape is (frames, height, width) - grayscale
-                    if frames.shape[0] > frames.shape[2]:
-                        # Probably (height, width, frames) - transpose
-                        frames = np.transpose(frames, (2, 0, 1))
-                    # Convert grayscale to BGR
-                    frames_bgr = np.stack([frames] * 3, axis=-1)
-                elif frames.ndim == 4:
-                    # Shape is (frames, height, width, channels)
-                    if frames.shape[-1] == 3:
-                        # RGB to BGR
-                        frames_bgr = frames[..., ::-1]
-                    elif frames.shape[-1] == 1:
-                        # Grayscale with channel dimension
-                        frames_bgr = np.repeat(frames, 3, axis=-1)
-                    else:
-                        frames_bgr = frames[..., :3]  # Take first 3 channels
-                else:
-                    logger.error(f"Unsupported frames dimensions: {frames.ndim}")
-                    return jsonify({"error": f"Unsupported frames dimensions: {frames.ndim}"}), 400
-                
-                # Normalize frames to 0-255 range if needed
-                if frames_bgr.dtype == np.float32 or frames_bgr.dtype == np.float64:
-                    if frames_bgr.max() <= 1.0:
-                        frames_bgr = (frames_bgr * 255).astype(np.uint8)
-                    else:
-                        frames_bgr = frames_bgr.astype(np.uint8)
-                elif frames_bgr.dtype != np.uint8:
-                    frames_bgr = frames_bgr.astype(np.uint8)
-                
-                # Create temporary MP4 file
-                temp_mp4 = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-                temp_mp4_path = temp_mp4.name
-                temp_mp4.close()
-                
-                logger.info(f"Creating MP4 at: {temp_mp4_path}")
-                
-                # Video writer settings
-                height, width = frames_bgr.shape[1:3]
-                fps = 20.0  # 20 FPS for echo videos
-                
-                # Use H.264 codec
-                fourcc = cv2.VideoWriter_fourcc(*'H264')
-                out = cv2.VideoWriter(temp_mp4_path, fourcc, fps, (width, height))
-                
-                if not out.isOpened():
-                    # Fallback to XVID if H264 fails
-                    logger.warning("H264 codec failed, trying XVID")
-                    fourcc = cv2.VideoWriter_fourcc(*'XVID')
-                    out = cv2.VideoWriter(temp_mp4_path, fourcc, fps, (width, height))
-                
-                if not out.isOpened():
-                    logger.error("Failed to open video writer")
-                    return jsonify({"error": "Failed to create video writer"}), 500
-                
-                # Write frames
-                logger.info(f"Writing {len(frames_bgr)} frames to video")
-                for i, frame in enumerate(frames_bgr):
-                    out.write(frame)
+            try:
+                with metrics.span('load'):
+                    frames, frames_key = frame_store.open_stream(npz_path)
+            except NoFramesError:
+                logger.error("No data found in NPZ file")
+                transcode_cache.discard(temp_mp4_path)
+                return jsonify({"error": "No data found in NPZ file"}), 400
+            logger.info(f"Loaded frames with shape: {frames.shape}")
+            
+            # Convert to uint8 BGR (frames, height, width, 3) one chunk at a time while encoding
+            try:
+                frame_count, height, width = clip_dimensions(frames)
+            except ValueError as e:
+                logger.error(str(e))
+                transcode_cache.discard(temp_mp4_path)
+                return jsonify({"error": str(e)}), 400
+            request_profile = metrics.current()
+            frames_bgr = metrics.timed_iter('transform', iter_bgr_frames(frames), request_profile)
+            
+            # Encode into the claimed temp file inside the cache, published once complete
+            logger.info(f"Encoding {frame_count} frames with {video_encoder.name} into {temp_mp4_path}")
+            
+            if video_encoder.streams and not _is_partial_request():
+                # Encode on a worker process into the cache file and send fragments as they land there
+                try:
+                    future = process_pool.submit(stream_clip, frames, video_encoder, fps, width, height, temp_mp4_path)
+                except PoolBusy as e:
+                    transcode_cache.discard(temp_mp4_path)
+                    return _pool_busy(e)
                 
-                out.release()
-                logger.info("Video creation completed")
+                def follow_mp4(tmp_path):
+                    completed = False
+                    try:
+                        for chunk in metrics.timed_iter('encode', follow_file(tmp_path, future), request_profile):
+                            yield chunk
+                        completed = True
+                        logger.info("Video creation completed")
+                    except Exception as e:
+                        # Encoder, pickling or pool failures (BrokenProcessPool) end the body early;
+                        # the failed future discards the temp file via _publish_when_done
+                        logger.error(f"Streaming encode failed: {e}", exc_info=not isinstance(e, EncoderError))
+                    finally:
+                        if completed:
+                            transcode_cache.publish(cache_key, tmp_path)
+                        else:
+                            # Disconnected (or failed): a running encode still completes into the cache
+                            future.add_done_callback(partial(_publish_when_done, cache_key, tmp_path))
                 
-                # Send file and clean up after response
-                def remove_file(response):
+                # Pool disabled or full with PROCESS_POOL_ON_FULL=inline: tee the encoder output in this process
+                def generate_mp4(tmp_path):
+                    published = False
                     try:
-                        os.remove(temp_mp4_path)
-                        logger.info(f"Cleaned up temporary file: {temp_mp4_path}")
+                        with open(tmp_path, 'wb') as f:
+                            chunks = video_encoder.stream(frames_bgr, fps, width, height)
+                            for chunk in metrics.timed_iter('encode', chunks, request_profile):
+                                f.write(chunk)
+                                yield chunk
+                        transcode_cache.publish(cache_key, tmp_path)
+                        published = True
+                        logger.info("Video creation completed")
                     except Exception as e:
-                        logger.error(f"Error removing temporary file: {e}")
-                    return response
+                        logger.error(f"Streaming encode failed: {e}", exc_info=not isinstance(e, EncoderError))
+                    finally:
+                        if not published:
+                            transcode_cache.discard(tmp_path)
                 
-                response = send_file(
-                    temp_mp4_path,
+                response = Response(
+                    follow_mp4(temp_mp4_path) if future is not None else generate_mp4(temp_mp4_path),
                     mimetype='video/mp4',
-                    as_attachment=False,
-                    download_name=f"{Path(npz_path).stem}.mp4"
+                    headers={'Content-Disposition': f'inline; filename="{Path(npz_path).stem}.mp4"'}
                 )
-                response.call_on_close(lambda: remove_file(response))
-                
+                _set_cache_headers(response, cache_key, st)
                 return response
+            
+            try:
+                with metrics.span('encode'):
+                    process_pool.run(encode_clip, frames, video_encoder, fps, width, height, temp_mp4_path,
+                                     local=lambda _: video_encoder.write_file(frames_bgr, fps, width, height,
+                                                                              temp_mp4_path))
+            except EncoderError as e:
+                logger.error(str(e))
+                transcode_cache.discard(temp_mp4_path)
+                return jsonify({"error": "Failed to create video writer"}), 500
+            except PoolBusy as e:
+                transcode_cache.discard(temp_mp4_path)
+                return _pool_busy(e)
+            logger.info("Video creation completed")
+            
+            mp4_path = transcode_cache.publish(cache_key, temp_mp4_path)
+            
+            return _send_cached_file(mp4_path, cache_key, st, f"{Path(npz_path).stem}.mp4")
                 
         except Exception as e:
+            if temp_mp4_path:
+                transcode_cache.discard(temp_mp4_path)
             logger.error(f"Error processing NPZ file: {str(e)}", exc_info=True)
             return jsonify({"error": f"Error processing NPZ file: {str(e)}"}), 500
             
@@ -278,9 +520,27 @@ def health_check():
     return jsonify({
         "status": "healthy",
         "opencv_version": cv2.__version__,
-        "numpy_version": np.__version__
+        "numpy_version": np.__version__,
+        "transcode_cache": transcode_cache.stats(),
+        "frame_cache": frame_cache.stats(),
+        "frame_store": frame_store.stats(),
+        "frame_executor": frame_executor.stats(),
+        "process_pool": process_pool.stats(),
+        "streams": stream_engine.stats(),
+        "exam_index": exam_index.stats(),
+        "blob_store": blob_store.stats(),
+        "video_encoders": video_encoders.stats(),
+        "renditions": renditions.stats(),
+        "file_index": file_index.stats(),
+        "warmup": {k: v for k, v in warmup_manager.stats().items() if k != "jobs"},
+        "jobs": {k: v for k, v in job_manager.stats().items() if k != "jobs"}
     }), 200
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request/span latency histograms, byte counters and cache gauges in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/echo', methods=['GET', 'POST'])
 def echo():
     """Simple echo endpoint for connectivity testing"""
@@ -306,56 +566,301 @@ def echo():
         logger.error(f"Echo error: {str(e)}", exc_info=True)
         return jsonify({"error": f"Echo error: {str(e)}"}), 500
 
+def _inspect_npz_file(npz_path: str):
+    """Build inspect-npz metadata for one file; returns (payload, http_status)."""
+    info = {
+        "path": npz_path,
+        "exists": os.path.exists(npz_path),
+        "is_npz": npz_path.lower().endswith('.npz')
+    }
+
+    if not info["exists"]:
+        return info | {"error": "File not found"}, 404
+
+    if not info["is_npz"]:
+        return info | {"error": "File must be an NPZ file"}, 400
+
+    try:
+        size_bytes = os.path.getsize(npz_path)
+    except Exception:
+        size_bytes = None
+
+    # Only the .npy headers and the zip directory are read - no array is decompressed
+    with metrics.span('load'):
+        keys, key_to_meta = read_npz_headers(npz_path)
+
+    return {
+        "status": "ok",
+        "path": os.path.abspath(npz_path),
+        "size_bytes": size_bytes,
+        "keys": keys,
+        "frames_key": find_frames_key(keys),
+        "meta": key_to_meta
+    }, 200
+
 @app.route('/api/inspect-npz', methods=['GET'])
 def inspect_npz():
-    """Inspect an NPZ file and return metadata (keys, shapes, dtypes)."""
+    """Inspect an NPZ file and return metadata (keys, shapes, dtypes, sizes)."""
     try:
         npz_path = request.args.get('path')
 
         if not npz_path:
             return jsonify({"error": "Missing 'path' parameter"}), 400
 
-        info = {
-            "path": npz_path,
-            "exists": os.path.exists(npz_path),
-            "is_npz": npz_path.lower().endswith('.npz')
-        }
+        payload, status = _inspect_npz_file(npz_path)
+        return jsonify(payload), status
+    except Exception as e:
+        logger.error(f"Inspect NPZ error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Inspect NPZ error: {str(e)}"}), 500
 
-        if not info["exists"]:
-            return jsonify(info | {"error": "File not found"}), 404
+@app.route('/api/inspect-npz/batch', methods=['POST'])
+def inspect_npz_batch():
+    """Inspect many NPZ files in one request.
 
-        if not info["is_npz"]:
-            return jsonify(info | {"error": "File must be an NPZ file"}), 400
+    POST Body (JSON):
+    {
+        "paths": ["path/to/a.npz", "path/to/b.npz", ...]
+    }
 
-        try:
-            size_bytes = os.path.getsize(npz_path)
-        except Exception:
-            size_bytes = None
-
-        with np.load(npz_path) as data:
-            keys = list(data.files)
-            key_to_meta = {}
-            for key in keys:
-                try:
-                    arr = data[key]
-                    key_to_meta[key] = {
-                        "shape": tuple(int(x) for x in arr.shape),
-                        "dtype": str(arr.dtype),
-                        "ndim": int(arr.ndim)
-                    }
-                except Exception as e:
-                    key_to_meta[key] = {"error": f"Failed to read: {str(e)}"}
+    Each result has the same shape as /api/inspect-npz plus its HTTP-equivalent "code".
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "Missing JSON data"}), 400
+
+        paths = data.get('paths')
+        if not isinstance(paths, list) or not paths:
+            return jsonify({"error": "Missing 'paths' list in request"}), 400
+
+        results = []
+        for npz_path in paths:
+            try:
+                payload, code = _inspect_npz_file(str(npz_path))
+            except Exception as e:
+                logger.error(f"Inspect NPZ error for {npz_path}: {str(e)}")
+                payload, code = {"path": npz_path, "error": f"Inspect NPZ error: {str(e)}"}, 500
+            results.append(payload | {"code": code})
 
         return jsonify({
             "status": "ok",
-            "path": os.path.abspath(npz_path),
-            "size_bytes": size_bytes,
-            "keys": keys,
-            "meta": key_to_meta
+            "count": len(results),
+            "failed": len([r for r in results if r["code"] != 200]),
+            "results": results
         }), 200
     except Exception as e:
-        logger.error(f"Inspect NPZ error: {str(e)}", exc_info=True)
-        return jsonify({"error": f"Inspect NPZ error: {str(e)}"}), 500
+        logger.error(f"Inspect NPZ batch error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Inspect NPZ batch error: {str(e)}"}), 500
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest_npz():
+    """Write memory-mappable .npy sidecars for NPZ files.
+
+    POST Body (JSON):
+    {
+        "paths": ["path/to/a.npz", ...],   // NPZ files and/or directories
+        "recursive": true,                 // descend into directories (default: true)
+        "force": false                     // rewrite sidecars that are already fresh
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "Missing JSON data"}), 400
+
+        targets = data.get('paths') or []
+        if isinstance(targets, str):
+            targets = [targets]
+        if not targets:
+            return jsonify({"error": "Missing 'paths' in request"}), 400
+
+        force = bool(data.get('force', False))
+        recursive = bool(data.get('recursive', True))
+
+        results = []
+        for npz_path in iter_npz_paths(targets, recursive=recursive):
+            try:
+                sidecar = frame_store.ingest(npz_path, force=force)
+                results.append({"path": npz_path, "sidecar": sidecar, "status": "ok"})
+            except Exception as e:
+                logger.error(f"Ingest failed for {npz_path}: {str(e)}")
+                results.append({"path": npz_path, "status": "error", "error": str(e)})
+
+        return jsonify({
+            "status": "ok",
+            "count": len(results),
+            "failed": len([r for r in results if r["status"] != "ok"]),
+            "results": results
+        }), 200
+    except Exception as e:
+        logger.error(f"Ingest error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Ingest error: {str(e)}"}), 500
+
+@app.route('/api/warmup', methods=['POST'])
+def start_warmup():
+    """Queue clips for background cache warm-up and return immediately.
+
+    POST Body (JSON):
+    {
+        "paths": ["26409027/2020-07-14", ...],   // NPZ files and/or folders
+        "root": "26409027",                      // with exam_ids/filter: study root holding <patient>/<date>/
+        "exam_ids": ["26409027__2020-07-14"],    // or "filter": {"patient_prefix": "264", "date": "2020-07"}
+        "profiles": ["thumbnail", "full"],       // renditions to build (default: WARMUP_PROFILES)
+        "fps": 20,                               // frame rate of the MP4 renditions
+        "recursive": true,
+        "ingest": true                           // also write frame store sidecars
+    }
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "Missing JSON data"}), 400
+
+        targets = data.get('paths') or []
+        if isinstance(targets, str):
+            targets = [targets]
+        root = data.get('root')
+        exam_ids = data.get('exam_ids')
+        if exam_ids is None and isinstance(data.get('filter'), dict):
+            exam_ids = exam_index.select(data['filter'].get('patient_prefix'), data['filter'].get('date'))
+        if exam_ids is not None:
+            targets = list(targets) + exam_clip_paths(exam_index, exam_ids, root)
+        elif root:
+            targets = list(targets) + [root]
+        if not targets:
+            return jsonify({"error": "Nothing to warm up: give 'paths', 'root', 'exam_ids' or 'filter'"}), 400
+
+        try:
+            fps = float(data.get('fps', 20.0))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid 'fps' parameter"}), 400
+        if fps <= 0:
+            return jsonify({"error": "Invalid 'fps' parameter"}), 400
+
+        try:
+            job = warmup_manager.submit(targets, data.get('profiles'), fps,
+                                        recursive=bool(data.get('recursive', True)),
+                                        ingest=bool(data.get('ingest', True)))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except WarmupQueueFull as e:
+            response = jsonify({"error": str(e)})
+            response.headers['Retry-After'] = '30'
+            return response, 503
+
+        return jsonify({"job": job.to_dict(), "queue_depth": warmup_manager.stats()["queue_depth"]}), 202
+    except FileNotFoundError as e:
+        return jsonify({"error": f"DB JSON not found: {str(e)}"}), 404
+    except Exception as e:
+        logger.error(f"Warm-up error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Warm-up error: {str(e)}"}), 500
+
+@app.route('/api/warmup', methods=['GET'])
+def warmup_status():
+    """Queue depth, worker activity and per-job progress of background warm-up"""
+    return jsonify(warmup_manager.stats()), 200
+
+@app.route('/api/warmup/<job_id>', methods=['GET'])
+def warmup_job_status(job_id):
+    job = warmup_manager.job(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown warm-up job: {job_id}"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue an MP4 conversion or preprocess-and-encode job and return its id immediately.
+
+    POST Body (JSON):
+    {
+        "kind": "convert",                  // "convert" (as /api/convert-npz) or "preprocess" (as /api/preprocess mp4_blob)
+        "path": "path/to/file.npz",
+        "fps": 20,                          // frame rate of the MP4 (preprocess: default options.fps)
+        "preset": "balanced",               // encoder preset (preprocess: default options.preset)
+        "options": {...}                    // preprocess only: the /api/preprocess options
+    }
+
+    A submission for an artifact that is already queued, being encoded or
+    cached returns the existing job ("coalesced": true). Poll
+    GET /api/jobs/<id> for state and progress, then fetch
+    GET /api/jobs/<id>/result for the MP4.
+    """
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({"error": "Missing JSON data"}), 400
+
+        kind = data.get('kind', 'convert')
+        npz_path = data.get('path')
+        if not npz_path:
+            return jsonify({"error": "Missing 'path' in request"}), 400
+        if not os.path.exists(npz_path):
+            return jsonify({"error": f"File not found: {npz_path}"}), 404
+        if not npz_path.lower().endswith('.npz'):
+            return jsonify({"error": "File must be an NPZ file"}), 400
+
+        options = data.get('options') or {}
+        if not isinstance(options, dict):
+            return jsonify({"error": "'options' must be an object"}), 400
+        try:
+            fps = float(data.get('fps', options.get('fps', 20.0)))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid 'fps' parameter"}), 400
+        if fps <= 0:
+            return jsonify({"error": "Invalid 'fps' parameter"}), 400
+        try:
+            video_encoder = video_encoders.get(data.get('preset', options.get('preset')))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except EncoderError as e:
+            return jsonify({"error": str(e)}), 500
+
+        try:
+            job, created = job_manager.submit(kind, npz_path, video_encoder, fps, options)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except JobQueueFull as e:
+            response = jsonify({"error": str(e)})
+            response.headers['Retry-After'] = '10'
+            return response, 503
+
+        response = jsonify({"job": job.to_dict(), "coalesced": not created,
+                            "status_url": f"/api/jobs/{job.id}", "result_url": f"/api/jobs/{job.id}/result"})
+        response.headers['Location'] = f"/api/jobs/{job.id}"
+        return response, 202
+    except Exception as e:
+        logger.error(f"Job submission error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Job submission error: {str(e)}"}), 500
+
+@app.route('/api/jobs', methods=['GET'])
+def jobs_status():
+    """Worker pool, queue and per-job state of asynchronous jobs"""
+    return jsonify(job_manager.stats()), 200
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.job(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """The finished job's MP4, served from the transcode cache (Range and conditional requests supported)"""
+    job = job_manager.job(job_id)
+    if job is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    if job.state == "failed":
+        return jsonify({"error": f"Job failed: {job.error}", "job": job.to_dict()}), 500
+    if job.state != "done":
+        response = jsonify({"error": f"Job is {job.state}", "job": job.to_dict()})
+        response.headers['Retry-After'] = '1'
+        return response, 409
+    mp4_path = transcode_cache.get(job.key)
+    if mp4_path is None:
+        return jsonify({"error": "Job result was evicted from the cache; submit the job again"}), 410
+    suffix = '.preprocessed.mp4' if job.kind == 'preprocess' else '.mp4'
+    return _send_cached_file(mp4_path, job.key, os.stat(mp4_path), f"{Path(job.path).stem}{suffix}")
 
 @app.route('/api/list', methods=['GET'])
 def list_files():
@@ -365,7 +870,11 @@ def list_files():
       - root: directory to list
       - ext: comma-separated extensions without dot (default: npz,mp4)
       - recursive: true/false (default: false)
-      - limit: max number of results (default: 200)
+      - limit: max number of results per page (default: 200)
+      - sort: name | mtime | size (default: name)
+      - order: asc | desc (default: asc)
+      - cursor: next_cursor of the previous page
+      - headers: true to add frame count and resolution of NPZ files
     """
     try:
         root = request.args.get('root')
@@ -385,140 +894,32 @@ def list_files():
             limit = int(request.args.get('limit', '200'))
         except ValueError:
             limit = 200
+        sort = request.args.get('sort', 'name')
+        if sort not in SORT_FIELDS:
+            return jsonify({"error": f"Invalid 'sort' parameter, expected one of {list(SORT_FIELDS)}"}), 400
+        descending = request.args.get('order', 'asc').lower() == 'desc'
 
-        results = []
-        if recursive:
-            for dirpath, _, filenames in os.walk(root):
-                for fname in filenames:
-                    if allowed_exts and fname.lower().split('.')[-1] not in allowed_exts:
-                        continue
-                    full = os.path.join(dirpath, fname)
-                    results.append(full)
-                    if len(results) >= limit:
-                        break
-                if len(results) >= limit:
-                    break
-        else:
-            for fname in os.listdir(root):
-                full = os.path.join(root, fname)
-                if os.path.isfile(full):
-                    if allowed_exts and fname.lower().split('.')[-1] not in allowed_exts:
-                        continue
-                    results.append(full)
-                    if len(results) >= limit:
-                        break
+        try:
+            page = file_index.list(root, allowed_exts, recursive=recursive, sort=sort, descending=descending,
+                                   cursor=request.args.get('cursor'), limit=limit,
+                                   headers=request.args.get('headers', 'false').lower() == 'true')
+        except InvalidCursor as e:
+            return jsonify({"error": str(e)}), 400
 
         return jsonify({
             "status": "ok",
             "root": root,
-            "count": len(results),
-            "files": results
+            "count": len(page["entries"]),
+            "total": page["total"],
+            "files": [entry["path"] for entry in page["entries"]],
+            "entries": page["entries"],
+            "next_cursor": page["next_cursor"]
         }), 200
     except Exception as e:
         logger.error(f"List files error: {str(e)}", exc_info=True)
         return jsonify({"error": f"List files error: {str(e)}"}), 500
 
 # Helper functions for struct_pred generation (ported from sample12.py)
-def _flatten_specs(struct: dict) -> pd.DataFrame:
-    """Convert standardized_structure to DataFrame format"""
-    rows = []
-    for cat, spec in struct.items():
-        if isinstance(spec, list):      # classification (top-level)
-            rows.append({"Category": cat,
-                         "Field": cat,
-                         "Type": ", ".join(spec),
-                         "Value": None})
-        elif isinstance(spec, dict):    # nested fields
-            for field, typ in spec.items():
-                rows.append({"Category": cat,
-                             "Field": field,
-                             "Type": ", ".join(typ) if isinstance(typ, list) else "float",
-                             "Value": None})
-    return pd.DataFrame(rows)
-
-def _extract_value(val, mode: str):
-    """Extract value based on mode from potentially nested dict structure"""
-    if not isinstance(val, dict):
-        return val
-    
-    if mode in ("pred", "pred_label"):
-        return val.get("pred_label", None)
-    if mode in ("true", "true_label"):
-        return val.get("true_label", None)
-    if mode in ("pred_label", "true_label", "pred", "true", "prob"):
-        return val.get(mode)
-    return None
-
-def _fill_from_sample(df: pd.DataFrame, sample: dict, mode: str) -> pd.DataFrame:
-    """Fill DataFrame with values from sample data based on mode"""
-    out = df.copy()
-    for i, row in out.iterrows():
-        k1 = row["Field"]
-        k2 = f'{row["Category"]}//{row["Field"]}'
-        raw_val = sample.get(k1, sample.get(k2, None))
-        
-        # Special handling for certain fields
-        if (row["Category"].lower() == "cardiomyopathy" and
-            row["Field"] == "cardiomyopathy_type"):
-            out.at[i, "Value"] = _extract_value(raw_val, "true_label")
-        elif (row["Category"].lower() == "lv_geometry" and
-              row["Field"] == "lvh_presence"):
-            out.at[i, "Value"] = _extract_value(raw_val, "true_label")
-        else:
-            out.at[i, "Value"] = _extract_value(raw_val, mode)
-    return out
-
-def _df_to_nested_dict(df: pd.DataFrame) -> dict:
-    """Convert DataFrame to nested dictionary structure"""
-    result: Dict[str, Dict[str, Union[str, float, int]]] = {}
-    for _, r in df.iterrows():
-        if r["Value"] in (None, "", np.nan):
-            continue
-        cat, field, val = r["Category"], r["Field"], r["Value"]
-        result.setdefault(cat, {})[field] = val
-    return result
-
-def _load_db_backend(db_json_path: str) -> List[dict]:
-    """Load and process DB JSON file (simplified version without streamlit dependencies)"""
-    try:
-        with open(db_json_path, 'r') as f:
-            raw = json.load(f)
-        
-        # Flatten groups similar to original but simplified
-        groups: List[List[dict]] = []
-        if isinstance(raw, dict):
-            for v in raw.values():
-                groups.append(v if isinstance(v, list) else [v])
-        else:
-            groups.append(raw)
-        
-        out = []
-        for grp in groups:
-            for e in grp:
-                vids = e["video_npz"]
-                metas = e.get("meta_json")
-                
-                # Convert to lists
-                vids = [vids] if isinstance(vids, (str, Path)) else vids
-                metas = [metas] if isinstance(metas, (str, Path)) or metas is None else metas
-                if metas is None: 
-                    metas = [None] * len(vids)
-                
-                for vid_str, meta_str in zip(vids, metas):
-                    # Path conversion (adjust as needed for your environment)
-                    vid_path = str(vid_str).replace("/mnt", "//10.10.10.10/NAS02").replace("/", "\\")
-                    meta_path = str(meta_str).replace("/mnt", "//10.10.10.10/NAS02").replace("/", "\\") if meta_str else None
-                    
-                    new_entry = e.copy()
-                    new_entry["video_npz"] = vid_path
-                    new_entry["meta_json"] = meta_path
-                    out.append(new_entry)
-        
-        return out
-    except Exception as e:
-        logger.error(f"Error loading DB file: {str(e)}")
-        raise
-
 def _fetch_preds_backend(entry: dict) -> dict:
     """Fetch predictions from entry (simplified - just returns the entry as-is)"""
     return entry
@@ -542,13 +943,7 @@ def generate_struct_pred():
         if not data:
             return jsonify({"error": "Missing JSON data"}), 400
         
-        # Resolve DB JSON path relative to project root, allow env override
-        db_json_path_env = os.environ.get('REACT_APP_DB_JSON_PATH')
-
-        project_root = Path(__file__).resolve().parent.parent
-        print(project_root)
-        
-        db_json_path = str(project_root / 'public' / 'DB_json' / 'eval_result-attn-50-3_local.json')
+        db_json_path = exam_index.db_json_path
         exam_id = data.get('exam_id')
         mode = data.get('mode', 'pred_label')
         
@@ -563,32 +958,21 @@ def generate_struct_pred():
         if not os.path.exists(db_json_path):
             return jsonify({"error": f"DB file not found: {db_json_path}"}), 404
         
-        db_entries = _load_db_backend(db_json_path)
-        logger.info(f"Loaded {len(db_entries)} entries from DB")
-        
-        # Step 2: Find entry by exam_id
-        entry = None
-        for e in db_entries:
-            if e.get("exam_id") == exam_id:
-                entry = e
-                break
-        
-        if entry is None:
+        # Step 2: Find entry by exam_id (index is rebuilt only when the DB file changes)
+        with metrics.span('key'):
+            exam_entries = exam_index.get(exam_id)
+        if not exam_entries:
             return jsonify({"error": f"Exam ID '{exam_id}' not found in DB"}), 404
+        entry = exam_entries[0]
         
-        logger.info(f"Found entry for exam_id: {exam_id}")
+        logger.info(f"Found {len(exam_entries)} entries for exam_id: {exam_id}")
         
         # Step 3: Fetch predictions (_fetch_preds equivalent)
         preds = _fetch_preds_backend(entry)
         
-        # Step 4: Create analysis DataFrame
-        analysis_df = _flatten_specs(standardized_structure)
-        
-        # Step 5: Fill from sample (_fill_from_sample)
-        filled_df = _fill_from_sample(analysis_df, preds, mode)
-        
-        # Step 6: Convert to nested dict (_df_to_nested_dict)
-        struct_pred = _df_to_nested_dict(filled_df)
+        # Step 4: Fill the precompiled field plan and nest it by category
+        with metrics.span('transform'):
+            struct_pred, filled_fields = apply_field_plan(struct_pred_plan, preds, mode)
         
         # Prepare response
         response_data = {
@@ -596,10 +980,13 @@ def generate_struct_pred():
             "exam_id": exam_id,
             "mode": mode,
             "struct_pred": struct_pred,
-            "total_fields": len(filled_df),
-            "filled_fields": len([v for v in filled_df["Value"] if v is not None and v != ""]),
+            "total_fields": len(struct_pred_plan),
+            "filled_fields": filled_fields,
             "processing_info": {
-                "db_entries_count": len(db_entries),
+                "db_entries_count": exam_index.entries_count,
+                "exam_entries_count": len(exam_entries),
+                "index_size": len(exam_index),
+                "index_load_time_ms": exam_index.load_time_ms,
                 "entry_found": True,
                 "prediction_keys": list(preds.keys()) if isinstance(preds, dict) else "entry_as_dict"
             }
@@ -612,6 +999,336 @@ def generate_struct_pred():
         logger.error(f"Error generating struct_pred: {str(e)}", exc_info=True)
         return jsonify({"error": f"Error generating struct_pred: {str(e)}"}), 500
 
+def _batch_struct_pred_item(exam_id: str, mode: str) -> dict:
+    """struct_pred for one exam of a batch, or an error item with its status code"""
+    with metrics.span('key'):
+        exam_entries = exam_index.get(exam_id) if isinstance(exam_id, str) else None
+    if not exam_entries:
+        return {"exam_id": exam_id, "error": f"Exam ID '{exam_id}' not found in DB", "code": 404}
+    preds = _fetch_preds_backend(exam_entries[0])
+    with metrics.span('transform'):
+        struct_pred, filled_fields = apply_field_plan(struct_pred_plan, preds, mode)
+    return {
+        "exam_id": exam_id,
+        "status": "ok",
+        "code": 200,
+        "struct_pred": struct_pred,
+        "total_fields": len(struct_pred_plan),
+        "filled_fields": filled_fields,
+        "exam_entries_count": len(exam_entries)
+    }
+
+@app.route('/api/generate-struct-pred/batch', methods=['POST'])
+def generate_struct_pred_batch():
+    """
+    Generate structured predictions for a whole worklist in one request.
+    
+    POST Body (JSON):
+    {
+        "exam_ids": ["12345__2020-07-14", ...],              // explicit list, or
+        "filter": {"patient_prefix": "123", "date": "2020-07"},  // prefix match on "<patient>__<date>"
+        "mode": "pred_label",                                 // pred_label, pred, true_label, true, prob
+        "stream": false                                       // true: NDJSON, one line per exam
+    }
+    
+    Exams missing from the DB are reported per item ("code": 404) instead of failing the batch.
+    With "stream": true (or Accept: application/x-ndjson) each result is written as soon
+    as it is built, followed by a {"done": true, ...} summary line.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({"error": "Missing JSON data"}), 400
+        
+        mode = data.get('mode', 'pred_label')
+        if mode not in EXTRACT_MODES:
+            return jsonify({"error": f"Unsupported mode '{mode}', expected one of {list(EXTRACT_MODES)}"}), 400
+        
+        if not os.path.exists(exam_index.db_json_path):
+            return jsonify({"error": f"DB file not found: {exam_index.db_json_path}"}), 404
+        
+        exam_ids = data.get('exam_ids')
+        filters = data.get('filter')
+        if exam_ids is not None:
+            if not isinstance(exam_ids, list):
+                return jsonify({"error": "'exam_ids' must be a list"}), 400
+        elif isinstance(filters, dict) and (filters.get('patient_prefix') or filters.get('date')):
+            exam_ids = exam_index.select(filters.get('patient_prefix'), filters.get('date'))
+        else:
+            return jsonify({"error": "Provide 'exam_ids' or a 'filter' with 'patient_prefix' and/or 'date'"}), 400
+        
+        stream = bool(data.get('stream')) or 'application/x-ndjson' in request.headers.get('Accept', '')
+        logger.info(f"Generating struct_pred batch for {len(exam_ids)} exams (mode={mode}, stream={stream})")
+        
+        if stream:
+            def generate_lines():
+                found = 0
+                t0 = time.perf_counter()
+                for exam_id in exam_ids:
+                    item = _batch_struct_pred_item(exam_id, mode)
+                    found += item["code"] == 200
+                    yield json.dumps(item) + "\n"
+                yield json.dumps({
+                    "done": True,
+                    "mode": mode,
+                    "count": len(exam_ids),
+                    "found": found,
+                    "duration_ms": round((time.perf_counter() - t0) * 1000.0, 3)
+                }) + "\n"
+            
+            return Response(generate_lines(), mimetype='application/x-ndjson',
+                            headers={'Cache-Control': 'no-cache'})
+        
+        t0 = time.perf_counter()
+        results = [_batch_struct_pred_item(exam_id, mode) for exam_id in exam_ids]
+        return jsonify({
+            "status": "ok",
+            "mode": mode,
+            "count": len(results),
+            "found": sum(1 for r in results if r["code"] == 200),
+            "results": results,
+            "processing_info": {
+                "db_entries_count": exam_index.entries_count,
+                "index_size": len(exam_index),
+                "index_load_time_ms": exam_index.load_time_ms,
+                "duration_ms": round((time.perf_counter() - t0) * 1000.0, 3)
+            }
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error generating struct_pred batch: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Error generating struct_pred batch: {str(e)}"}), 500
+
+def _frame_bundle_info(handle: str, mime: str, frame_count: int, bundle_bytes: int) -> dict:
+    """Response fields describing a length-prefixed frame bundle in the blob store"""
+    return {
+        "frames_url": f"/api/blob/{handle}",
+        "frame_count": frame_count,
+        "frame_mime": mime,
+        "frame_encoding": "uint32be-length-prefixed",
+        "bundle_bytes": bundle_bytes
+    }
+
+@app.route('/api/blob/<handle>', methods=['GET'])
+def get_blob(handle):
+    """Raw bytes of a short-lived /api/preprocess result (frame bundle or MP4)"""
+    path = blob_store.path_for(handle)
+    if path is None:
+        return jsonify({"error": "Unknown or expired blob handle"}), 404
+    response = send_file(path, mimetype=BlobStore.mimetype_for(handle), conditional=True,
+                         max_age=blob_store.ttl_seconds)
+    # Patient images: cacheable by the browser only, never by shared proxies
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+@app.route('/api/rendition', methods=['GET'])
+def get_rendition():
+    """
+    Serve a precomputed rendition of an NPZ clip, building it on first access.
+    Query parameters:
+    - path: NPZ file path
+    - profile: "thumbnail" (JPEG strip), "model" (224x224 uint8 .npy), "preview" or "full" (MP4)
+    - fps: frame rate of the MP4 profiles (default: 20)
+    """
+    try:
+        npz_path = request.args.get('path')
+        if not npz_path or not os.path.exists(npz_path) or not npz_path.lower().endswith('.npz'):
+            return jsonify({"error": "Invalid NPZ file path"}), 400
+        profile = request.args.get('profile', 'thumbnail')
+        if profile not in PROFILES:
+            return jsonify({"error": f"Unknown profile '{profile}', expected one of {list(PROFILES)}"}), 400
+        try:
+            fps = float(request.args.get('fps', 20.0))
+        except ValueError:
+            return jsonify({"error": "Invalid 'fps' parameter"}), 400
+        if fps <= 0:
+            return jsonify({"error": "Invalid 'fps' parameter"}), 400
+        
+        # The cache key changes with the NPZ and the encoder, so it doubles as the ETag
+        st = os.stat(npz_path)
+        rendition_key = renditions.key_for(npz_path, profile, fps)
+        not_modified = _not_modified(rendition_key, st)
+        if not_modified is not None:
+            return not_modified
+        
+        try:
+            with metrics.span('render'):
+                rendition_path = renditions.get(npz_path, profile, fps)
+        except NoFramesError:
+            return jsonify({"error": "No data found in NPZ file"}), 400
+        
+        return _send_cached_file(rendition_path, rendition_key, st,
+                                 f"{Path(npz_path).stem}.{profile}{PROFILES[profile].suffix}",
+                                 PROFILES[profile].mimetype)
+    except Exception as e:
+        logger.error(f"Rendition error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Rendition error: {str(e)}"}), 500
+
+FRAME_FORMATS = {'jpeg': ('.jpg', 'image/jpeg'), 'png': ('.png', 'image/png'), 'raw': (None, 'application/octet-stream')}
+
+def _frame_request_options():
+    """(format, quality, resize) from the query string; raises ValueError for bad values"""
+    output_format = request.args.get('format', 'jpeg').lower()
+    if output_format not in FRAME_FORMATS:
+        raise ValueError(f"Unknown format '{output_format}', expected one of {list(FRAME_FORMATS)}")
+    quality = int(request.args.get('quality', 85))
+    if not 1 <= quality <= 100:
+        raise ValueError("quality must be between 1 and 100")
+    resize = None
+    if request.args.get('resize'):
+        width, height = map(int, request.args['resize'].lower().split('x'))
+        if width <= 0 or height <= 0:
+            raise ValueError("resize must be WIDTHxHEIGHT with positive sizes")
+        resize = (width, height)
+    return output_format, quality, resize
+
+def _frame_renderer(frames: np.ndarray, output_format: str, quality: int, resize, unit_range: Optional[bool]):
+    """index -> bytes of that frame: encoded image, or the stored pixels for "raw".
+    unit_range is frame_store.unit_range() of the whole clip, so floats scale as in its MP4."""
+    clip = frames_first(frames)
+    if output_format == 'raw':
+        return lambda i: np.ascontiguousarray(clip[i]).tobytes()
+    ext = FRAME_FORMATS[output_format][0]
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if output_format == 'jpeg' else []
+
+    def render(i):
+        frame = clip_to_bgr(frames, [i], unit_range)[0]
+        if resize:
+            frame = cv2.resize(frame, resize, interpolation=cv2.INTER_AREA)
+        success, buffer = cv2.imencode(ext, frame, params)
+        if not success:
+            raise RuntimeError(f"Failed to encode frame {i}")
+        return buffer.tobytes()
+    return render
+
+@app.route('/api/frame', methods=['GET'])
+def get_frame():
+    """
+    A single frame of an NPZ clip.
+    Query parameters:
+    - path: NPZ file path
+    - index: frame index (0-based)
+    - format: "jpeg" (default), "png" or "raw" (stored dtype, C order; shape in X-Frame-Shape)
+    - quality: JPEG quality 1-100 (default: 85)
+    - resize: "widthxheight" for jpeg/png
+    """
+    try:
+        npz_path = request.args.get('path')
+        if not npz_path or not os.path.exists(npz_path) or not npz_path.lower().endswith('.npz'):
+            return jsonify({"error": "Invalid NPZ file path"}), 400
+        try:
+            index = int(request.args.get('index', 0))
+            output_format, quality, resize = _frame_request_options()
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+        
+        st = os.stat(npz_path)
+        etag = _clip_etag(st, index, output_format, quality, request.args.get('resize', ''))
+        not_modified = _not_modified(etag, st)
+        if not_modified is not None:
+            return not_modified
+        
+        try:
+            with metrics.span('load'):
+                frames, _ = frame_store.open(npz_path)
+        except NoFramesError:
+            return jsonify({"error": "No data found in NPZ file"}), 400
+        total = len(frames_first(frames))
+        if not 0 <= index < total:
+            return jsonify({"error": f"Frame index {index} out of range (0-{total - 1})"}), 400
+        
+        with metrics.span('load'):
+            unit_range = frame_store.unit_range(npz_path, frames) if output_format != 'raw' else None
+        with metrics.span('encode'):
+            data = _frame_renderer(frames, output_format, quality, resize, unit_range)(index)
+        response = Response(data, mimetype=FRAME_FORMATS[output_format][1])
+        response.headers['X-Frame-Index'] = str(index)
+        response.headers['X-Frame-Count'] = str(total)
+        if output_format == 'raw':
+            response.headers['X-Frame-Shape'] = ','.join(map(str, frames_first(frames).shape[1:]))
+            response.headers['X-Frame-Dtype'] = str(frames.dtype)
+        _set_cache_headers(response, etag, st)
+        return response
+    except Exception as e:
+        logger.error(f"Frame error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Frame error: {str(e)}"}), 500
+
+@app.route('/api/frames', methods=['GET'])
+def get_frames():
+    """
+    A range of frames of an NPZ clip, frames start, start+step, ... < end.
+    Query parameters:
+    - path: NPZ file path
+    - start: first frame (default: 0)
+    - end: stop before this frame (default: frame count)
+    - step: stride (default: 1)
+    - format / quality / resize: as /api/frame
+
+    jpeg/png return a bundle of length-prefixed images (same layout as /api/blob
+    frame bundles); raw returns the frames' pixels back to back.
+    """
+    try:
+        npz_path = request.args.get('path')
+        if not npz_path or not os.path.exists(npz_path) or not npz_path.lower().endswith('.npz'):
+            return jsonify({"error": "Invalid NPZ file path"}), 400
+        try:
+            start = int(request.args.get('start', 0))
+            end = int(request.args['end']) if request.args.get('end') else None
+            step = int(request.args.get('step', 1))
+            output_format, quality, resize = _frame_request_options()
+        except ValueError as e:
+            return jsonify({"error": f"Invalid parameter: {str(e)}"}), 400
+        if step < 1:
+            return jsonify({"error": "step must be at least 1"}), 400
+        
+        st = os.stat(npz_path)
+        etag = _clip_etag(st, start, end if end is not None else '', step, output_format, quality,
+                          request.args.get('resize', ''))
+        not_modified = _not_modified(etag, st)
+        if not_modified is not None:
+            return not_modified
+        
+        try:
+            with metrics.span('load'):
+                frames, _ = frame_store.open(npz_path)
+        except NoFramesError:
+            return jsonify({"error": "No data found in NPZ file"}), 400
+        total = len(frames_first(frames))
+        end = total if end is None else end
+        if not 0 <= start < end <= total:
+            return jsonify({"error": f"Invalid frame range {start}-{end} for {total} frames"}), 400
+        indices = range(start, end, step)
+        
+        with metrics.span('load'):
+            unit_range = frame_store.unit_range(npz_path, frames) if output_format != 'raw' else None
+        render = _frame_renderer(frames, output_format, quality, resize, unit_range)
+        request_profile = metrics.current()
+        
+        def generate():
+            results = metrics.timed_iter('encode', frame_executor.map(render, indices), request_profile)
+            with closing(results):
+                for data in results:
+                    if output_format == 'raw':
+                        yield data
+                    else:
+                        yield FRAME_LENGTH.pack(len(data)) + data
+        
+        mimetype = FRAME_FORMATS[output_format][1] if output_format == 'raw' else BLOB_KINDS['frames'][1]
+        response = Response(generate(), mimetype=mimetype)
+        response.headers['X-Frame-Count'] = str(len(indices))
+        response.headers['X-Frame-Range'] = f"{start}-{end}/{step}"
+        if output_format == 'raw':
+            response.headers['X-Frame-Shape'] = ','.join(map(str, frames_first(frames).shape[1:]))
+            response.headers['X-Frame-Dtype'] = str(frames.dtype)
+        else:
+            response.headers['X-Frame-Mime'] = FRAME_FORMATS[output_format][1]
+        _set_cache_headers(response, etag, st)
+        return response
+    except Exception as e:
+        logger.error(f"Frames error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Frames error: {str(e)}"}), 500
+
 @app.route('/api/preprocess', methods=['POST'])
 def preprocess_data():
     """Preprocess NPZ data for frontend video display.
@@ -629,9 +1346,16 @@ def preprocess_data():
             "downsample": 2,                // temporal downsampling factor
             "format": "video_frames",       // "video_frames", "mp4_blob", "stream_url"
             "fps": 20,                      // frames per second for video playback
-            "max_frames": 30                // maximum frames to return (for performance)
+            "max_frames": 30,               // maximum frames to return (for performance)
+            "transport": "json",            // "json" (base64 data URIs) or "binary" (handles under /api/blob)
+            "preset": "balanced",           // mp4_blob encoder preset: "fast", "balanced", "quality"
+            "profile": "model"              // start from the cached 224x224 rendition instead of full-resolution frames
         }
     }
+    
+    With "transport": "binary" the JSON carries metadata only: video_frames/base64 return
+    "frames_url", a bundle of uint32 big-endian length-prefixed images, and mp4_blob returns
+    "video_url". Both are fetched as raw bytes and expire after BLOB_TTL_SECONDS.
     """
     try:
         data = request.get_json()
@@ -648,132 +1372,45 @@ def preprocess_data():
         options = data.get('options', {})
         logger.info(f"Preprocessing {npz_path} with options: {options}")
         
-        # Load NPZ file
-        with np.load(npz_path) as npz_data:
-            # Find frames key (same logic as convert endpoint)
-            frames_key = None
-            for key in ['frames', 'video', 'data', 'array', 'arr_0']:
-                if key in npz_data.files:
-                    frames_key = key
-                    break
-            if frames_key is None and len(npz_data.files) > 0:
-                frames_key = npz_data.files[0]
-            
-            if frames_key is None:
-                return jsonify({"error": "No data found in NPZ file"}), 400
-            
-            frames = npz_data[frames_key].copy()
-            original_shape = frames.shape
-            logger.info(f"Loaded frames: {original_shape}, dtype: {frames.dtype}")
-        
-        # Apply preprocessing steps
-        processed_frames = frames
-        processing_log = []
-        
-        # 1. Frame range extraction
-        frame_range = options.get('frame_range')
-        if frame_range and len(frame_range) == 2:
-            start, end = max(0, frame_range[0]), min(len(processed_frames), frame_range[1])
-            processed_frames = processed_frames[start:end]
-            processing_log.append(f"Extracted frames {start}:{end}")
-        
-        # 2. Temporal downsampling
-        downsample = options.get('downsample', 1)
-        if downsample > 1:
-            processed_frames = processed_frames[::downsample]
-            processing_log.append(f"Downsampled by factor {downsample}")
-        
-        # 3. Ensure proper format (frames, height, width) or (frames, height, width, channels)
-        if processed_frames.ndim == 3:
-            # Assume (frames, height, width) - add channel dimension
-            processed_frames = np.expand_dims(processed_frames, axis=-1)
-        elif processed_frames.ndim == 4 and processed_frames.shape[0] < processed_frames.shape[-1]:
-            # Probably (height, width, channels, frames) - transpose
-            processed_frames = np.transpose(processed_frames, (3, 0, 1, 2))
-        
-        # 4. Resize frames
-        resize = options.get('resize')
-        if resize and len(resize) == 2:
-            width, height = resize
-            resized_frames = []
-            for frame in processed_frames:
-                if frame.shape[-1] == 1:  # Grayscale
-                    resized = cv2.resize(frame.squeeze(-1), (width, height))
-                    resized = np.expand_dims(resized, axis=-1)
-                else:  # Multi-channel
-                    resized = cv2.resize(frame, (width, height))
-                resized_frames.append(resized)
-            processed_frames = np.array(resized_frames)
-            processing_log.append(f"Resized to {width}x{height}")
-        
-        # 5. Normalize data types
-        if processed_frames.dtype != np.uint8:
-            if processed_frames.dtype in [np.float32, np.float64]:
-                if processed_frames.max() <= 1.0:
-                    processed_frames = (processed_frames * 255).astype(np.uint8)
-                else:
-                    processed_frames = np.clip(processed_frames, 0, 255).astype(np.uint8)
-            else:
-                processed_frames = processed_frames.astype(np.uint8)
-            processing_log.append("Converted to uint8")
-        
-        # 6. Contrast and brightness adjustment
-        contrast = options.get('contrast', 1.0)
-        brightness = options.get('brightness', 0.0)
-        if contrast != 1.0 or brightness != 0.0:
-            processed_frames = processed_frames.astype(np.float32)
-            processed_frames = processed_frames * contrast + brightness * 255
-            processed_frames = np.clip(processed_frames, 0, 255).astype(np.uint8)
-            processing_log.append(f"Adjusted contrast: {contrast}, brightness: {brightness}")
-        
-        # 7. Denoising
-        denoise = options.get('denoise')
-        if denoise:
-            denoised_frames = []
-            for frame in processed_frames:
-                if denoise == 'gaussian':
-                    denoised = cv2.GaussianBlur(frame, (5, 5), 0)
-                elif denoise == 'median':
-                    if frame.shape[-1] == 1:
-                        denoised = cv2.medianBlur(frame.squeeze(-1), 5)
-                        denoised = np.expand_dims(denoised, axis=-1)
-                    else:
-                        denoised = frame  # Median blur works on single channel
-                elif denoise == 'bilateral':
-                    if frame.shape[-1] == 1:
-                        denoised = cv2.bilateralFilter(frame.squeeze(-1), 9, 75, 75)
-                        denoised = np.expand_dims(denoised, axis=-1)
-                    else:
-                        denoised = cv2.bilateralFilter(frame, 9, 75, 75)
+        # Load NPZ frames (shared read-only array or memmap - slicing below reads only the selected frames;
+        # long uncached clips come back as a chunked reader and are processed chunk by chunk)
+        profile = options.get('profile')
+        if profile not in (None, 'model'):
+            return jsonify({"error": f"Unsupported profile '{profile}' for preprocessing, expected 'model'"}), 400
+        try:
+            with metrics.span('load'):
+                if profile == 'model':
+                    # Already resized and converted to uint8; an explicit "resize" still applies on top
+                    frames = renditions.frames(npz_path, 'model')
                 else:
-                    denoised = frame
-                denoised_frames.append(denoised)
-            processed_frames = np.array(denoised_frames)
-            processing_log.append(f"Applied {denoise} denoising")
-        
-        # 8. Normalization
-        normalize = options.get('normalize')
-        if normalize:
-            processed_frames_float = processed_frames.astype(np.float32)
-            if normalize == '0-1':
-                processed_frames_float = processed_frames_float / 255.0
-                processing_log.append("Normalized to [0, 1]")
-            elif normalize == 'z-score':
-                mean = np.mean(processed_frames_float)
-                std = np.std(processed_frames_float)
-                processed_frames_float = (processed_frames_float - mean) / (std + 1e-8)
-                processing_log.append(f"Z-score normalized (mean={mean:.2f}, std={std:.2f})")
-            elif normalize == 'minmax':
-                min_val, max_val = np.min(processed_frames_float), np.max(processed_frames_float)
-                processed_frames_float = (processed_frames_float - min_val) / (max_val - min_val + 1e-8)
-                processing_log.append(f"MinMax normalized (min={min_val:.2f}, max={max_val:.2f})")
-        else:
-            processed_frames_float = processed_frames.astype(np.float32)
+                    frames, frames_key = frame_store.open_stream(npz_path)
+        except NoFramesError:
+            return jsonify({"error": "No data found in NPZ file"}), 400
+        original_shape = frames.shape
+        logger.info(f"Loaded frames: {original_shape}, dtype: {frames.dtype}")
         
-        # Prepare response based on format
         output_format = options.get('format', 'video_frames')
         fps = options.get('fps', 20)
         max_frames = options.get('max_frames', 30)
+        transport = options.get('transport', 'json')
+        if transport not in ('json', 'binary'):
+            return jsonify({"error": f"Unsupported transport '{transport}', expected 'json' or 'binary'"}), 400
+        
+        # Apply preprocessing steps (compiled stage chain, see preprocess_pipeline.py)
+        # Only the displayed frames are kept from a chunked run, except for the full-clip download
+        # Runs on a worker process; inline (on the frame executor) when the pool is disabled
+        pipeline = PreprocessPipeline.compile(options, executor=frame_executor)
+        keep = None if output_format == 'download_url' else max_frames
+        try:
+            with metrics.span('transform'):
+                result = process_pool.run(preprocess_frames, frames, options, keep,
+                                          local=partial(pipeline.run, keep=keep))
+                result.frames = take_array(result.frames)
+        except PoolBusy as e:
+            return _pool_busy(e)
+        processed_frames = result.frames
+        processed_shape = result.shape
+        processing_log = result.steps
         
         # Limit frames for performance
         display_frames = processed_frames[:min(max_frames, len(processed_frames))]
@@ -781,21 +1418,17 @@ def preprocess_data():
         response_data = {
             "status": "ok",
             "original_shape": original_shape,
-            "processed_shape": processed_frames.shape,
+            "processed_shape": processed_shape,
+            "source_profile": profile or "native",
             "processing_steps": processing_log,
             "video_info": {
-                "total_frames": len(processed_frames),
+                "total_frames": processed_shape[0],
                 "display_frames": len(display_frames),
                 "fps": fps,
-                "duration": len(processed_frames) / fps,
-                "resolution": f"{processed_frames.shape[2]}x{processed_frames.shape[1]}"
+                "duration": processed_shape[0] / fps,
+                "resolution": f"{processed_shape[2]}x{processed_shape[1]}"
             },
-            "stats": {
-                "min": float(np.min(processed_frames_float)),
-                "max": float(np.max(processed_frames_float)),
-                "mean": float(np.mean(processed_frames_float)),
-                "std": float(np.std(processed_frames_float))
-            }
+            "stats": result.stats
         }
         
         if output_format == 'video_frames':
@@ -803,7 +1436,7 @@ def preprocess_data():
             encoded_frames = []
             frame_timings = []  # 각 프레임의 타이밍 정보
             
-            for i, frame in enumerate(display_frames):
+            def encode_jpeg(frame):
                 # 그레이스케일 처리
                 if frame.shape[-1] == 1:
                     img = frame.squeeze(-1)
@@ -816,13 +1449,25 @@ def preprocess_data():
                         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
                 
                 # JPEG로 인코딩 (PNG보다 작은 사이즈)
-                is_success, buffer = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                if is_success:
-                    img_base64 = base64.b64encode(buffer).decode('utf-8')
-                    encoded_frames.append(f"data:image/jpeg;base64,{img_base64}")
-                    frame_timings.append(i / fps)  # 각 프레임의 시간 위치
+                return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            
+            # 프레임 병렬 인코딩 (순서 유지)
+            def jpeg_frames():
+                encoded = metrics.timed_iter('encode', frame_executor.map(encode_jpeg, display_frames))
+                for i, (is_success, buffer) in enumerate(encoded):
+                    if is_success:
+                        frame_timings.append(i / fps)  # 각 프레임의 시간 위치
+                        yield buffer.tobytes()
             
-            response_data["frames"] = encoded_frames
+            if transport == 'binary':
+                # 바이너리 번들로 저장하고 핸들만 반환
+                handle, frame_count, bundle_bytes = blob_store.put_frames(jpeg_frames())
+                response_data.update(_frame_bundle_info(handle, 'image/jpeg', frame_count, bundle_bytes))
+            else:
+                for jpeg in jpeg_frames():
+                    img_base64 = base64.b64encode(jpeg).decode('utf-8')
+                    encoded_frames.append(f"data:image/jpeg;base64,{img_base64}")
+                response_data["frames"] = encoded_frames
             response_data["frame_timings"] = frame_timings
             response_data["playback_info"] = {
                 "auto_play": True,
@@ -831,65 +1476,70 @@ def preprocess_data():
             }
         
         elif output_format == 'mp4_blob':
-            # MP4 blob 생성 (메모리 효율적)
-            temp_mp4 = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-            temp_mp4_path = temp_mp4.name
-            temp_mp4.close()
-            
-            # MP4 생성
+            # MP4 blob 생성 (ffmpeg 파이프는 임시 파일 없이 메모리로 인코딩)
+            preset = options.get('preset')
+            if preset is not None and preset not in PRESETS:
+                return jsonify({"error": f"Unknown preset '{preset}', expected one of {list(PRESETS)}"}), 400
+            video_encoder = video_encoders.get(preset)
             height, width = display_frames.shape[1:3]
-            fourcc = cv2.VideoWriter_fourcc(*'H264')
-            out = cv2.VideoWriter(temp_mp4_path, fourcc, fps, (width, height))
-            
-            for frame in display_frames:
-                if frame.shape[-1] == 1:
-                    # 그레이스케일을 BGR로 변환
-                    frame_bgr = cv2.cvtColor(frame.squeeze(-1), cv2.COLOR_GRAY2BGR)
-                else:
-                    frame_bgr = frame
-                out.write(frame_bgr)
-            
-            out.release()
-            
-            # 임시 파일 ID 생성
-            import uuid
-            temp_id = str(uuid.uuid4())
             
-            # 파일을 메모리에 로드하고 base64로 인코딩
-            with open(temp_mp4_path, 'rb') as f:
-                video_data = f.read()
-            
-            video_base64 = base64.b64encode(video_data).decode('utf-8')
-            response_data["video_blob"] = f"data:video/mp4;base64,{video_base64}"
+            def bgr_frames():
+                for frame in display_frames:
+                    if frame.shape[-1] == 1:
+                        # 그레이스케일을 BGR로 변환
+                        yield cv2.cvtColor(frame.squeeze(-1), cv2.COLOR_GRAY2BGR)
+                    else:
+                        yield frame
             
-            # 임시 파일 정리
-            os.remove(temp_mp4_path)
+            if transport == 'binary':
+                # blob 디렉터리에 직접 기록 (base64 없이 video_url로 전달)
+                handle, temp_mp4_path = blob_store.reserve('mp4')
+                try:
+                    with metrics.span('encode'):
+                        video_encoder.write_file(bgr_frames(), fps, width, height, temp_mp4_path)
+                except BaseException:
+                    blob_store.discard(temp_mp4_path)
+                    raise
+                response_data["video_url"] = f"/api/blob/{handle}"
+                response_data["video_bytes"] = blob_store.publish(handle, temp_mp4_path)
+                response_data["video_mime"] = "video/mp4"
+            else:
+                with metrics.span('encode'):
+                    video_data = video_encoder.encode(bgr_frames(), fps, width, height)
+                video_base64 = base64.b64encode(video_data).decode('utf-8')
+                response_data["video_blob"] = f"data:video/mp4;base64,{video_base64}"
+            response_data["video_encoder"] = video_encoder.name
             
         elif output_format == 'base64':
             # 기존 base64 방식 (호환성 유지)
             sample_frames = display_frames[:min(5, len(display_frames))]
             encoded_frames = []
             
-            for i, frame in enumerate(sample_frames):
+            def encode_png(frame):
                 if frame.shape[-1] == 1:
                     img = frame.squeeze(-1)
                 else:
                     img = frame
                     if img.shape[-1] == 3:
                         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                
-                is_success, buffer = cv2.imencode(".png", img)
-                if is_success:
-                    img_base64 = base64.b64encode(buffer).decode('utf-8')
-                    encoded_frames.append(f"data:image/png;base64,{img_base64}")
+                return cv2.imencode(".png", img)
             
-            response_data["frames"] = encoded_frames
-            response_data["total_frames"] = len(processed_frames)
+            encoded = metrics.timed_iter('encode', frame_executor.map(encode_png, sample_frames))
+            png_frames = (buffer.tobytes() for is_success, buffer in encoded if is_success)
+            if transport == 'binary':
+                handle, frame_count, bundle_bytes = blob_store.put_frames(png_frames)
+                response_data.update(_frame_bundle_info(handle, 'image/png', frame_count, bundle_bytes))
+            else:
+                for png in png_frames:
+                    img_base64 = base64.b64encode(png).decode('utf-8')
+                    encoded_frames.append(f"data:image/png;base64,{img_base64}")
+                response_data["frames"] = encoded_frames
+            response_data["total_frames"] = processed_shape[0]
         
         elif output_format == 'download_url':
             # Save processed data as NPZ and return download URL
             temp_npz = tempfile.NamedTemporaryFile(suffix='.npz', delete=False)
-            np.savez_compressed(temp_npz.name, frames=processed_frames_float)
+            np.savez_compressed(temp_npz.name, frames=result.to_float())
             temp_npz.close()
             
             # Note: In a real app, you'd need a file serving mechanism
@@ -911,6 +1561,8 @@ def stream_video():
     - fps: frames per second (default: 20)
     - resize: format "widthxheight" like "224x224"
     - quality: JPEG quality 1-100 (default: 85)
+    - pace: "false" to send frames as fast as they are encoded (default: paced to fps)
+    - profile: "model" to stream the cached 224x224 rendition instead of full-resolution frames
     """
     try:
         npz_path = request.args.get('path')
@@ -920,80 +1572,79 @@ def stream_video():
         fps = int(request.args.get('fps', 20))
         quality = int(request.args.get('quality', 85))
         resize_param = request.args.get('resize')  # "224x224" format
+        pace = request.args.get('pace', 'true').lower() != 'false'
+        profile = request.args.get('profile')
+        if fps <= 0:
+            return jsonify({"error": "fps must be positive"}), 400
+        if profile not in (None, 'model'):
+            return jsonify({"error": f"Unsupported profile '{profile}' for streaming, expected 'model'"}), 400
+        size = None
+        if resize_param:
+            try:
+                width, height = map(int, resize_param.split('x'))
+                size = (width, height)
+            except ValueError:
+                pass  # Skip resize if format is invalid
+        # Frames that no longer fit on the pool are encoded inline, but a new stream can still be turned away
+        if process_pool.saturated and process_pool.on_full == 'reject':
+            return _pool_busy(PoolBusy("Worker pool is busy, try again shortly", process_pool.retry_after))
         
         logger.info(f"Streaming video from: {npz_path} at {fps} FPS")
+        request_profile = metrics.current()
         
         def generate_frames():
             try:
-                with np.load(npz_path) as npz_data:
-                    # Find frames key
-                    frames_key = None
-                    for key in ['frames', 'video', 'data', 'array', 'arr_0']:
-                        if key in npz_data.files:
-                            frames_key = key
-                            break
-                    if frames_key is None and len(npz_data.files) > 0:
-                        frames_key = npz_data.files[0]
-                    
-                    if frames_key is None:
-                        yield b'--frame\r\nContent-Type: text/plain\r\n\r\nError: No data in NPZ\r\n'
-                        return
+                try:
+                    with metrics.span('load', request_profile):
+                        if profile == 'model':
+                            frames = renditions.frames(npz_path, 'model')
+                        else:
+                            frames, _ = frame_store.open_stream(npz_path)
+                except NoFramesError:
+                    yield b'--frame\r\nContent-Type: text/plain\r\n\r\nError: No data in NPZ\r\n'
+                    return
+                
+                if process_pool.enabled:
+                    # Batches of frames are JPEG-encoded on worker processes (in this thread if the pool is full)
+                    def render_batch(batch):
+                        with metrics.span('encode', request_profile):
+                            try:
+                                return process_pool.run(encode_jpegs, batch, quality, size, on_full='inline')
+                            except Exception as pool_error:
+                                # A dead worker (BrokenProcessPool) or pickling error must not end the stream
+                                logger.error(f"Worker failed to encode frames, encoding them here: {pool_error}")
+                                return encode_jpegs(('local', batch), quality, size)
                     
-                    frames = npz_data[frames_key]
+                    items = (batch for chunk in frame_chunks(frames) for batch in batches(chunk, STREAM_BATCH_FRAMES))
+                    stream = stream_engine.stream(npz_path, items, render_batch, fps, clip_length(frames),
+                                                  pace=pace, batched=True)
+                else:
+                    def render_frame(item):
+                        i, frame = item
+                        with metrics.span('encode', request_profile):
+                            try:
+                                return jpeg_frame(frame, quality, size)
+                            except Exception as frame_error:
+                                logger.error(f"Error processing frame {i}: {frame_error}")
+                                return None
                     
-                    # Process each frame
-                    for i, frame in enumerate(frames):
-                        try:
-                            # Ensure proper format
-                            if frame.ndim == 2:
-                                # Grayscale - convert to RGB
-                                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
-                            elif frame.ndim == 3:
-                                if frame.shape[-1] == 1:
-                                    frame_rgb = cv2.cvtColor(frame.squeeze(-1), cv2.COLOR_GRAY2RGB)
-                                elif frame.shape[-1] == 3:
-                                    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                                else:
-                                    frame_rgb = frame[:, :, :3]
-                            else:
-                                continue
-                            
-                            # Normalize to 0-255 if needed
-                            if frame_rgb.dtype != np.uint8:
-                                if frame_rgb.max() <= 1.0:
-                                    frame_rgb = (frame_rgb * 255).astype(np.uint8)
-                                else:
-                                    frame_rgb = np.clip(frame_rgb, 0, 255).astype(np.uint8)
-                            
-                            # Resize if requested
-                            if resize_param:
-                                try:
-                                    width, height = map(int, resize_param.split('x'))
-                                    frame_rgb = cv2.resize(frame_rgb, (width, height))
-                                except ValueError:
-                                    pass  # Skip resize if format is invalid
-                            
-                            # Encode to JPEG
-                            success, buffer = cv2.imencode('.jpg', frame_rgb, 
-                                                         [cv2.IMWRITE_JPEG_QUALITY, quality])
-                            
-                            if success:
-                                frame_data = buffer.tobytes()
-                                headers = (
-                                     b'--frame\r\n'
-                                     + b'Content-Type: image/jpeg\r\n'
-                                     + f'X-Frame-Index: {i}\r\n'.encode('ascii')
-                                     + f'X-Frame-Timestamp: {i/fps:.3f}\r\n'.encode('ascii')
-                                     + b'\r\n'
-                                 )
-                                yield headers + frame_data + b'\r\n'
-                            
-                            # Control frame rate with delay would be handled client-side
-                            
-                        except Exception as frame_error:
-                            logger.error(f"Error processing frame {i}: {frame_error}")
+                    # Frames are decoded a chunk at a time, encoded a few ahead on the frame executor and released at fps
+                    clip_frames = (frame for chunk in frame_chunks(frames) for frame in chunk)
+                    stream = stream_engine.stream(npz_path, enumerate(clip_frames), render_frame, fps,
+                                                  clip_length(frames), pace=pace)
+                with closing(stream):
+                    for i, frame_data in stream:
+                        if frame_data is None:
                             continue
-                            
+                        headers = (
+                             b'--frame\r\n'
+                             + b'Content-Type: image/jpeg\r\n'
+                             + f'X-Frame-Index: {i}\r\n'.encode('ascii')
+                             + f'X-Frame-Timestamp: {i/fps:.3f}\r\n'.encode('ascii')
+                             + b'\r\n'
+                         )
+                        yield headers + frame_data + b'\r\n'
+                    
             except Exception as e:
                 logger.error(f"Stream generation error: {e}")
                 yield b'--frame\r\nContent-Type: text/plain\r\n\r\nStream error\r\n'
@@ -1014,6 +1665,14 @@ def stream_video():
         logger.error(f"Stream video error: {str(e)}", exc_info=True)
         return jsonify({"error": f"Stream video error: {str(e)}"}), 500
 
+@app.route('/api/streams', methods=['GET'])
+def list_streams():
+    """Active video streams with frames sent and per-stream encode lag"""
+    return jsonify({
+        "streams": stream_engine.active_streams(),
+        **stream_engine.stats()
+    }), 200
+
 @app.errorhandler(404)
 def not_found(error):
     return jsonify({"error": "Endpoint not found"}), 404
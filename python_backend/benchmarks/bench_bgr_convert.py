@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Benchmark the per-frame BGR conversion kernel against the previous full-clip conversion
+
+The clip is written once as a raw .npy (like a frame store sidecar) and every
+case runs in a fresh process that memory-maps it, converts it to uint8 BGR and
+feeds the frames to a sink that does what the ffmpeg encoder does with them
+(make each frame contiguous, write its bytes to a pipe). The clip is read
+once beforehand so every case finds it in the page cache. Peak RSS is the
+child's lifetime peak, so the cases do not see each other's allocations; the
+memory-mapped source counts the same in both, and "overhead" is what the
+conversion adds on top of the interpreter and the clip itself.
+
+  legacy  the previous clip_to_bgr: np.stack / np.repeat / a reversed view,
+          then float scaling and casts on the whole clip
+  kernel  renditions.iter_bgr_frames: one reused BGR buffer per clip
+
+With --encode the frames go to the real encoder (VIDEO_PRESET) instead, which
+then dominates the time.
+
+Usage:
+    python benchmarks/bench_bgr_convert.py [--frames 1000] [--size 800x600] [--layouts gray rgb float]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bench_suite import max_rss_bytes  # noqa: E402
+from create_test_npz import generate_echo_frames  # noqa: E402
+
+LAYOUTS = ('gray', 'rgb', 'float')
+IMPLEMENTATIONS = ('legacy', 'kernel')
+
+
+def legacy_clip_to_bgr(frames):
+    """renditions.clip_to_bgr before the per-frame kernel (reference only)"""
+    if frames.ndim == 3 and frames.shape[0] > frames.shape[2]:
+        frames = np.transpose(frames, (2, 0, 1))
+    if frames.ndim == 3:
+        # Convert grayscale to BGR
+        frames_bgr = np.stack([frames] * 3, axis=-1)
+    elif frames.shape[-1] == 3:
+        # RGB to BGR
+        frames_bgr = frames[..., ::-1]
+    elif frames.shape[-1] == 1:
+        # Grayscale with channel dimension
+        frames_bgr = np.repeat(frames, 3, axis=-1)
+    else:
+        frames_bgr = frames[..., :3]  # Take first 3 channels
+
+    # Normalize frames to 0-255 range if needed
+    if frames_bgr.dtype == np.float32 or frames_bgr.dtype == np.float64:
+        if frames_bgr.max() <= 1.0:
+            frames_bgr = (frames_bgr * 255).astype(np.uint8)
+        else:
+            frames_bgr = frames_bgr.astype(np.uint8)
+    elif frames_bgr.dtype != np.uint8:
+        frames_bgr = frames_bgr.astype(np.uint8)
+    return frames_bgr
+
+
+def write_clip(path: str, layout: str, count: int, width: int, height: int):
+    """Synthetic echo clip as a raw .npy, written a block of frames at a time.
+
+    Gray clips get a channel axis: frames_first reads a 3D clip with more
+    frames than columns as (height, width, frames).
+    """
+    shape = (count, height, width, 3 if layout == 'rgb' else 1)
+    dtype = np.float32 if layout == 'float' else np.uint8
+    clip = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    block = 50
+    for start in range(0, count, block):
+        gray = generate_echo_frames(min(block, count - start), height, width, seed=start)
+        if layout == 'rgb':
+            # Color Doppler-like: gray B-mode with a red/blue jet overlaid on part of the frame
+            rgb = np.repeat(gray[..., np.newaxis], 3, axis=-1)
+            rgb[:, height // 3:height // 2, width // 3:width // 2, 0] = 220
+            rgb[:, height // 2:2 * height // 3, width // 3:width // 2, 2] = 200
+            clip[start:start + len(gray)] = rgb
+        elif layout == 'float':
+            clip[start:start + len(gray), ..., 0] = gray / np.float32(255.0)
+        else:
+            clip[start:start + len(gray), ..., 0] = gray
+    clip.flush()
+    del clip
+
+
+def peak_rss_bytes() -> int:
+    """Peak RSS of this process image: VmHWM where /proc has it, since ru_maxrss also counts the
+    parent's RSS at fork time, then bench_suite.max_rss_bytes"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return max_rss_bytes()
+
+
+def run_case(clip_path: str, implementation: str, encode: bool) -> dict:
+    """Convert and sink one clip in this process; returns timing and peak RSS"""
+    from renditions import clip_dimensions, iter_bgr_frames
+
+    frames = np.load(clip_path, mmap_mode='r')
+    count, height, width = clip_dimensions(frames)
+    baseline = peak_rss_bytes()
+    t0 = time.perf_counter()
+    if implementation == 'legacy':
+        frames_bgr = legacy_clip_to_bgr(frames)
+    else:
+        frames_bgr = iter_bgr_frames(frames)
+
+    if encode:
+        from video_encoder import EncoderRegistry
+        encoder = EncoderRegistry.from_env().get(None)
+        size = len(encoder.encode(frames_bgr, 20.0, width, height))
+    else:
+        size = 0
+        with open(os.devnull, 'wb') as sink:
+            for frame in frames_bgr:
+                data = memoryview(np.ascontiguousarray(frame, dtype=np.uint8)).cast('B')
+                sink.write(data)
+                size += len(data)
+    seconds = time.perf_counter() - t0
+    return {
+        "frames": count,
+        "seconds": round(seconds, 3),
+        "fps": round(count / seconds, 1) if seconds else 0.0,
+        "output_bytes": size,
+        "baseline_rss_mb": round(baseline / 1024 ** 2, 1),
+        "peak_rss_mb": round(peak_rss_bytes() / 1024 ** 2, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Full-clip vs. per-frame BGR conversion: time and peak RSS")
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--size', default='800x600', help="width x height")
+    parser.add_argument('--layouts', nargs='+', default=['gray', 'rgb'], choices=LAYOUTS,
+                        help="float clips make the legacy path hold ~3x the clip in float32")
+    parser.add_argument('--implementations', nargs='+', default=list(IMPLEMENTATIONS), choices=IMPLEMENTATIONS)
+    parser.add_argument('--encode', action='store_true', help="Feed the real MP4 encoder instead of a null sink")
+    parser.add_argument('--output', help="Write the results as JSON to this path")
+    parser.add_argument('--child', nargs=2, metavar=('CLIP', 'IMPLEMENTATION'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_case(args.child[0], args.child[1], args.encode)))
+        return 0
+
+    width, height = map(int, args.size.lower().split('x'))
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bench-bgr-') as tmp:
+        for layout in args.layouts:
+            clip_path = os.path.join(tmp, f"{layout}.npy")
+            print(f"Generating {args.frames}-frame {width}x{height} {layout} clip...")
+            write_clip(clip_path, layout, args.frames, width, height)
+            clip_mb = os.path.getsize(clip_path) / 1024 ** 2
+            with open(clip_path, 'rb') as f:
+                while f.read(64 * 1024 ** 2):
+                    pass
+            for implementation in args.implementations:
+                command = [sys.executable, os.path.abspath(__file__), '--child', clip_path, implementation]
+                if args.encode:
+                    command.append('--encode')
+                proc = subprocess.run(command, capture_output=True, text=True)
+                if proc.returncode != 0:
+                    error = (proc.stderr.strip().splitlines() or [f"exit code {proc.returncode}"])[-1]
+                    print(f"  {implementation:<7} failed: {error}")
+                    results.append({"layout": layout, "implementation": implementation, "error": error})
+                    continue
+                record = {"layout": layout, "implementation": implementation, "clip_mb": round(clip_mb, 1),
+                          **json.loads(proc.stdout.strip().splitlines()[-1])}
+                record["overhead_mb"] = round(record["peak_rss_mb"] - record["baseline_rss_mb"] - clip_mb, 1)
+                results.append(record)
+                print(f"  {implementation:<7} {record['seconds']:>8.2f} s {record['fps']:>8.1f} fps "
+                      f"peak RSS {record['peak_rss_mb']:>8.1f} MB (clip {clip_mb:.0f} MB, "
+                      f"overhead {record['overhead_mb']:.0f} MB)")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Benchmark the compiled preprocessing pipeline against the previous per-frame path
+
+Clips come from the same synthetic generator as create_test_npz.py. Each
+option set is run on 100-, 500- and 2000-frame clips by default.
+
+Usage:
+    python benchmarks/bench_preprocess.py [--frames 100 500 2000] [--size 256x256] [--repeat 3] [--workers 4]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_test_npz import generate_echo_frames  # noqa: E402
+from frame_executor import FrameExecutor  # noqa: E402
+from preprocess_pipeline import PreprocessPipeline  # noqa: E402
+
+OPTION_SETS = {
+    "resize": {"resize": [224, 224]},
+    "resize+contrast": {"resize": [224, 224], "contrast": 1.2, "brightness": 0.1},
+    "resize+gaussian+zscore": {"resize": [224, 224], "denoise": "gaussian", "normalize": "z-score"},
+    "contrast+median+0-1": {"contrast": 1.2, "brightness": 0.1, "denoise": "median", "normalize": "0-1"},
+    "resize+bilateral+minmax": {"resize": [224, 224], "denoise": "bilateral", "normalize": "minmax"},
+}
+
+
+def legacy_preprocess(frames, options):
+    """The /api/preprocess processing steps before the compiled pipeline (reference only)"""
+    processed_frames = frames.copy()
+
+    frame_range = options.get('frame_range')
+    if frame_range and len(frame_range) == 2:
+        start, end = max(0, frame_range[0]), min(len(processed_frames), frame_range[1])
+        processed_frames = processed_frames[start:end]
+
+    downsample = options.get('downsample', 1)
+    if downsample > 1:
+        processed_frames = processed_frames[::downsample]
+
+    if processed_frames.ndim == 3:
+        processed_frames = np.expand_dims(processed_frames, axis=-1)
+    elif processed_frames.ndim == 4 and processed_frames.shape[0] < processed_frames.shape[-1]:
+        processed_frames = np.transpose(processed_frames, (3, 0, 1, 2))
+
+    resize = options.get('resize')
+    if resize and len(resize) == 2:
+        width, height = resize
+        resized_frames = []
+        for frame in processed_frames:
+            if frame.shape[-1] == 1:
+                resized = cv2.resize(frame.squeeze(-1), (width, height))
+                resized = np.expand_dims(resized, axis=-1)
+            else:
+                resized = cv2.resize(frame, (width, height))
+            resized_frames.append(resized)
+        processed_frames = np.array(resized_frames)
+
+    if processed_frames.dtype != np.uint8:
+        if processed_frames.dtype in [np.float32, np.float64]:
+            if processed_frames.max() <= 1.0:
+                processed_frames = (processed_frames * 255).astype(np.uint8)
+            else:
+                processed_frames = np.clip(processed_frames, 0, 255).astype(np.uint8)
+        else:
+            processed_frames = processed_frames.astype(np.uint8)
+
+    contrast = options.get('contrast', 1.0)
+    brightness = options.get('brightness', 0.0)
+    if contrast != 1.0 or brightness != 0.0:
+        processed_frames = processed_frames.astype(np.float32)
+        processed_frames = processed_frames * contrast + brightness * 255
+        processed_frames = np.clip(processed_frames, 0, 255).astype(np.uint8)
+
+    denoise = options.get('denoise')
+    if denoise:
+        denoised_frames = []
+        for frame in processed_frames:
+            if denoise == 'gaussian':
+                denoised = cv2.GaussianBlur(frame, (5, 5), 0)
+            elif denoise == 'median':
+                if frame.shape[-1] == 1:
+                    denoised = cv2.medianBlur(frame.squeeze(-1), 5)
+                    denoised = np.expand_dims(denoised, axis=-1)
+                else:
+                    denoised = frame
+            elif denoise == 'bilateral':
+                if frame.shape[-1] == 1:
+                    denoised = cv2.bilateralFilter(frame.squeeze(-1), 9, 75, 75)
+                    denoised = np.expand_dims(denoised, axis=-1)
+                else:
+                    denoised = cv2.bilateralFilter(frame, 9, 75, 75)
+            else:
+                denoised = frame
+            denoised_frames.append(denoised)
+        processed_frames = np.array(denoised_frames)
+
+    normalize = options.get('normalize')
+    processed_frames_float = processed_frames.astype(np.float32)
+    if normalize == '0-1':
+        processed_frames_float = processed_frames_float / 255.0
+    elif normalize == 'z-score':
+        mean = np.mean(processed_frames_float)
+        std = np.std(processed_frames_float)
+        processed_frames_float = (processed_frames_float - mean) / (std + 1e-8)
+    elif normalize == 'minmax':
+        min_val, max_val = np.min(processed_frames_float), np.max(processed_frames_float)
+        processed_frames_float = (processed_frames_float - min_val) / (max_val - min_val + 1e-8)
+
+    stats = {
+        "min": float(np.min(processed_frames_float)),
+        "max": float(np.max(processed_frames_float)),
+        "mean": float(np.mean(processed_frames_float)),
+        "std": float(np.std(processed_frames_float)),
+    }
+    return processed_frames, stats
+
+
+def make_compiled_preprocess(executor):
+    def compiled_preprocess(frames, options):
+        result = PreprocessPipeline.compile(options, executor=executor).run(frames)
+        return result.frames, result.stats
+    return compiled_preprocess
+
+
+def best_of(fn, frames, options, repeat):
+    best = float('inf')
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(frames, options)
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, nargs='+', default=[100, 500, 2000])
+    parser.add_argument('--size', default='256x256', help="clip resolution WIDTHxHEIGHT")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=1, help="frame executor threads for the compiled path")
+    args = parser.parse_args(argv)
+    width, height = map(int, args.size.split('x'))
+    compiled_preprocess = make_compiled_preprocess(FrameExecutor(args.workers) if args.workers > 1 else None)
+
+    print(f"{'frames':>6}  {'options':<26} {'legacy ms':>10} {'compiled ms':>12} {'speedup':>8}  match")
+    for num_frames in args.frames:
+        clip = generate_echo_frames(num_frames, height, width, seed=0)
+        clip.flags.writeable = False  # as served from the frame cache
+        for name, options in OPTION_SETS.items():
+            legacy_s, (legacy_frames, legacy_stats) = best_of(legacy_preprocess, clip, options, args.repeat)
+            compiled_s, (compiled_frames, compiled_stats) = best_of(compiled_preprocess, clip, options, args.repeat)
+            # The legacy gaussian path drops the channel axis of grayscale clips; compare pixels only
+            same_pixels = np.array_equal(legacy_frames.reshape(compiled_frames.shape), compiled_frames)
+            same_stats = all(np.isclose(legacy_stats[k], compiled_stats[k], rtol=1e-4, atol=1e-4) for k in legacy_stats)
+            print(f"{num_frames:>6}  {name:<26} {legacy_s * 1000:>10.1f} {compiled_s * 1000:>12.1f} "
+                  f"{legacy_s / compiled_s:>7.2f}x  {'yes' if same_pixels and same_stats else 'NO'}")
+        del clip
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: struct_pred field plan vs the pandas DataFrame path
+
+Synthetic exam entries exercise every lookup rule (field key, "category//field"
+key, nested pred/true/prob dicts, plain values, empty strings, None and NaN).
+Per-request latency of the previous pandas implementation and the compiled
+plan is reported. Equivalence of the two is covered by
+tests/test_struct_pred.py against a fixture recorded from the pandas path;
+--record rewrites that fixture. Requires pandas (requirements-dev.txt).
+
+Usage:
+    python benchmarks/bench_struct_pred.py [--samples 200] [--repeat 2000]
+    python benchmarks/bench_struct_pred.py --record tests/fixtures/struct_pred_golden.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, Union
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import standardized_structure, struct_pred_plan  # noqa: E402
+from struct_pred import apply_field_plan  # noqa: E402
+
+MODES = ["pred_label", "pred", "true_label", "true", "prob", "unknown"]
+
+
+# -------------------------------------------------- previous implementation (reference only)
+
+def _flatten_specs(struct: dict) -> pd.DataFrame:
+    rows = []
+    for cat, spec in struct.items():
+        if isinstance(spec, list):
+            rows.append({"Category": cat, "Field": cat, "Type": ", ".join(spec), "Value": None})
+        elif isinstance(spec, dict):
+            for field, typ in spec.items():
+                rows.append({"Category": cat, "Field": field,
+                             "Type": ", ".join(typ) if isinstance(typ, list) else "float", "Value": None})
+    return pd.DataFrame(rows)
+
+
+def _extract_value(val, mode: str):
+    if not isinstance(val, dict):
+        return val
+    if mode in ("pred", "pred_label"):
+        return val.get("pred_label", None)
+    if mode in ("true", "true_label"):
+        return val.get("true_label", None)
+    if mode in ("pred_label", "true_label", "pred", "true", "prob"):
+        return val.get(mode)
+    return None
+
+
+def _fill_from_sample(df: pd.DataFrame, sample: dict, mode: str) -> pd.DataFrame:
+    out = df.copy()
+    for i, row in out.iterrows():
+        k1 = row["Field"]
+        k2 = f'{row["Category"]}//{row["Field"]}'
+        raw_val = sample.get(k1, sample.get(k2, None))
+        if row["Category"].lower() == "cardiomyopathy" and row["Field"] == "cardiomyopathy_type":
+            out.at[i, "Value"] = _extract_value(raw_val, "true_label")
+        elif row["Category"].lower() == "lv_geometry" and row["Field"] == "lvh_presence":
+            out.at[i, "Value"] = _extract_value(raw_val, "true_label")
+        else:
+            out.at[i, "Value"] = _extract_value(raw_val, mode)
+    return out
+
+
+def _df_to_nested_dict(df: pd.DataFrame) -> dict:
+    result: Dict[str, Dict[str, Union[str, float, int]]] = {}
+    for _, r in df.iterrows():
+        if r["Value"] in (None, "", np.nan):
+            continue
+        result.setdefault(r["Category"], {})[r["Field"]] = r["Value"]
+    return result
+
+
+def legacy_struct_pred(sample: dict, mode: str):
+    filled_df = _fill_from_sample(_flatten_specs(standardized_structure), sample, mode)
+    struct_pred = _df_to_nested_dict(filled_df)
+    filled = len([v for v in filled_df["Value"] if v is not None and v != ""])
+    return struct_pred, len(filled_df), filled
+
+
+def plan_struct_pred(sample: dict, mode: str):
+    struct_pred, filled = apply_field_plan(struct_pred_plan, sample, mode)
+    return struct_pred, len(struct_pred_plan), filled
+
+
+# -------------------------------------------------- synthetic entries
+
+def make_sample(rng: random.Random) -> dict:
+    sample = {"exam_id": f"{rng.randrange(10**7, 10**8)}__2020-07-14", "video_npz": "x.npz", "meta_json": None}
+    for cat, spec in standardized_structure.items():
+        fields = {cat: spec} if isinstance(spec, list) else spec
+        for field, typ in fields.items():
+            roll = rng.random()
+            if roll < 0.15:
+                continue  # missing
+            key = f"{cat}//{field}" if rng.random() < 0.3 else field
+            if roll < 0.2:
+                value = rng.choice([None, "", np.nan])
+            elif isinstance(typ, list):
+                value = {"pred_label": rng.choice(typ), "true_label": rng.choice(typ + [""]),
+                         "prob": round(rng.random(), 4)}
+                if rng.random() < 0.1:
+                    del value["true_label"]
+            elif rng.random() < 0.5:
+                value = round(rng.uniform(0, 100), 2)
+            else:
+                value = {"pred_label": round(rng.uniform(0, 100), 2), "true_label": round(rng.uniform(0, 100), 2)}
+            sample[key] = value
+    return sample
+
+
+def record(path: str, count: int = 24):
+    """Write synthetic entries and the pandas path's output for every mode to a JSON fixture"""
+    rng = random.Random(0)
+    # Round-trip first: the app reads entries from JSON, so NaN reaches it as a fresh float
+    samples = json.loads(json.dumps([make_sample(rng) for _ in range(count)]))
+    expected = [{mode: list(legacy_struct_pred(sample, mode)) for mode in MODES} for sample in samples]
+    with open(path, 'w') as f:
+        json.dump({"modes": MODES, "samples": samples, "expected": expected}, f, sort_keys=True)
+    print(f"recorded {len(samples)} entries x {len(MODES)} modes to {path}")
+
+
+def time_per_call(fn, samples, repeat):
+    t0 = time.perf_counter()
+    for i in range(repeat):
+        fn(samples[i % len(samples)], "pred_label")
+    return (time.perf_counter() - t0) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=2000, help="calls timed for the plan path (pandas gets 1/20)")
+    parser.add_argument('--record', metavar='PATH', help="write the golden fixture of tests/test_struct_pred.py and exit")
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record(args.record)
+        return 0
+
+    rng = random.Random(0)
+    samples = [make_sample(rng) for _ in range(args.samples)]
+
+    legacy_s = time_per_call(legacy_struct_pred, samples, max(1, args.repeat // 20))
+    plan_s = time_per_call(plan_struct_pred, samples, args.repeat)
+    print(f"{'path':<8} {'per request':>12}")
+    print(f"{'pandas':<8} {legacy_s * 1e6:>9.1f} us")
+    print(f"{'plan':<8} {plan_s * 1e6:>9.1f} us   ({legacy_s / plan_s:.0f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the conversion, preprocessing, streaming and struct_pred paths
+
+Synthetic clips are generated with the same generator as create_test_npz.py
+over a matrix of frame counts, resolutions, grayscale/RGB, uint8/float32 and
+compressed/uncompressed NPZ storage. Every request goes through Flask's test
+client against the real app, with the transcode cache, blob store and frame
+store pointed at a temp directory:
+
+  convert      /api/convert-npz cold (decode + encode, caches cleared) and cached
+  preprocess   /api/preprocess for every combination of the option axes below
+               on the first clip, and a base option set on every clip
+  stream       /api/stream-video throughput with pacing off
+  struct_pred  /api/generate-struct-pred and the batch endpoint on a synthetic DB
+
+Each case reports p50/p95/mean latency, frames/sec (frames handled per p50
+request) and the peak RSS sampled while it ran. Results are written as JSON;
+--compare prints the p50 change of every case against an earlier run.
+
+Usage:
+    python benchmarks/bench_suite.py [--frames 30 120] [--sizes 224x224 480x640] [--repeat 3]
+                                     [--quick] [--output results.json] [--compare baseline.json]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from create_test_npz import generate_echo_frames  # noqa: E402
+
+# Option axes of /api/preprocess; the full product runs on the first clip
+PREPROCESS_AXES = {
+    "resize": [None, [224, 224]],
+    "normalize": [None, "0-1", "z-score", "minmax"],
+    "denoise": [None, "gaussian", "median", "bilateral"],
+    "contrast": [1.0, 1.2],
+    "format": ["video_frames", "base64", "mp4_blob"],
+    "transport": ["json", "binary"],
+}
+QUICK_AXES = {
+    "resize": [None, [224, 224]],
+    "normalize": [None, "z-score"],
+    "denoise": [None, "gaussian"],
+    "format": ["video_frames", "mp4_blob"],
+    "transport": ["json", "binary"],
+}
+BASE_PREPROCESS = {"resize": [224, 224], "normalize": "0-1", "format": "video_frames", "transport": "binary"}
+MAX_FRAMES = 30
+STRUCT_PRED_EXAMS = 200
+
+
+# ------------------------------------------------------------------ measurement
+
+class RssSampler:
+    """Peak resident set size while the block runs, sampled every few milliseconds"""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current() -> int:
+        try:
+            import psutil  # type: ignore
+            return psutil.Process().memory_info().rss
+        except ImportError:
+            pass
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            return 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def max_rss_bytes() -> int:
+    """Lifetime peak RSS of this process (ru_maxrss is KiB on Linux, bytes on macOS; 0 if unavailable)"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def measure(name, group, fn, repeat, frames=None, setup=None, **info):
+    """Run fn() repeat times (after setup() each time); fn returns (status, bytes, frames or None)"""
+    latencies, statuses, size, handled = [], set(), 0, frames
+    with RssSampler() as rss:
+        for _ in range(repeat):
+            if setup:
+                setup()
+            t0 = time.perf_counter()
+            status, size, counted = fn()
+            latencies.append((time.perf_counter() - t0) * 1000.0)
+            statuses.add(status)
+            handled = counted if counted is not None else handled
+    p50 = float(np.percentile(latencies, 50))
+    record = {
+        "group": group,
+        "case": name,
+        **info,
+        "repeat": repeat,
+        "status": sorted(statuses),
+        "p50_ms": round(p50, 2),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        "mean_ms": round(float(np.mean(latencies)), 2),
+        "frames": handled,
+        "fps": round(handled / (p50 / 1000.0), 1) if handled and p50 else None,
+        "response_bytes": size,
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+    }
+    flag = "" if statuses == {200} else f"  status={sorted(statuses)}"
+    fps = f"{record['fps']:>9.1f}" if record["fps"] else f"{'-':>9}"
+    print(f"  {name:<72} p50 {record['p50_ms']:>9.1f} ms  p95 {record['p95_ms']:>9.1f} ms  "
+          f"{fps} fps  rss {record['peak_rss_mb']:>7.1f} MiB{flag}")
+    return record
+
+
+# ------------------------------------------------------------------ clips
+
+def make_clip(out_dir, num_frames, width, height, color, dtype, storage):
+    frames = generate_echo_frames(num_frames, height, width, seed=0)
+    if color == 'rgb':
+        # Tint the channels differently so RGB/BGR order matters
+        frames = np.stack([frames, (frames * 0.8).astype(np.uint8), (frames * 0.6).astype(np.uint8)], axis=-1)
+    if dtype == 'float32':
+        frames = frames.astype(np.float32) / 255.0
+    name = f"f{num_frames}_{width}x{height}_{color}_{dtype}_{storage}"
+    path = os.path.join(out_dir, name + '.npz')
+    (np.savez_compressed if storage == 'compressed' else np.savez)(path, frames=frames)
+    return {"name": name, "path": path, "frames": num_frames, "width": width, "height": height,
+            "color": color, "dtype": dtype, "storage": storage, "file_bytes": os.path.getsize(path)}
+
+
+def write_struct_pred_db(path, structure, num_exams):
+    rng = random.Random(0)
+    fields = []
+    for cat, spec in structure.items():
+        if isinstance(spec, list):
+            fields.append((cat, spec))
+        elif isinstance(spec, dict):
+            fields.extend((field, value if isinstance(value, list) else None) for field, value in spec.items())
+    db = {}
+    for i in range(num_exams):
+        entry = {"exam_id": f"{100000 + i}__2020-07-{1 + i % 28:02d}",
+                 "video_npz": [f"/mnt/bench/{i}_{v}.npz" for v in range(3)], "meta_json": None}
+        for field, choices in fields:
+            if choices:
+                entry[field] = {"pred_label": rng.choice(choices), "true_label": rng.choice(choices),
+                                "prob": round(rng.random(), 3)}
+            else:
+                entry[field] = {"pred_label": round(rng.uniform(0, 100), 1)}
+        db[f"g{i}"] = [entry]
+    with open(path, 'w') as f:
+        json.dump(db, f)
+    return sorted(e[0]["exam_id"] for e in db.values())
+
+
+# ------------------------------------------------------------------ cases
+
+def bench_convert(client, app_module, clip, repeat, results):
+    query = {"path": clip["path"]}
+
+    def clear():
+        # Drop the cached MP4 and decoded frames so every run decodes and encodes
+        key = app_module.transcode_cache.make_key(clip["path"], app_module.video_encoders.get(None).name, 20.0)
+        cached = app_module.transcode_cache.get(key)
+        if cached:
+            os.remove(cached)
+        app_module.frame_cache.invalidate(clip["path"])
+
+    def run():
+        resp = client.get('/api/convert-npz', query_string=query)
+        body = resp.get_data()
+        return resp.status_code, len(body), None
+
+    info = {"clip": clip["name"], "endpoint": "/api/convert-npz"}
+    results.append(measure(f"convert cold {clip['name']}", "convert", run, repeat, clip["frames"], clear, **info))
+    results.append(measure(f"convert cached {clip['name']}", "convert", run, repeat, clip["frames"], **info))
+
+
+def bench_preprocess(client, clip, options, repeat, results, label):
+    body = {"path": clip["path"], "options": dict(options, max_frames=MAX_FRAMES)}
+
+    def run():
+        resp = client.post('/api/preprocess', json=body)
+        raw = resp.get_data()
+        size = len(raw)
+        frames = None
+        if resp.status_code == 200:
+            data = json.loads(raw)
+            frames = data.get("processed_shape", [None])[0]
+            # Binary transport: the payload is only complete once the blob is fetched
+            for url_key in ("frames_url", "video_url"):
+                if data.get(url_key):
+                    size += len(client.get(data[url_key]).get_data())
+        return resp.status_code, size, frames
+
+    results.append(measure(f"preprocess {label} {clip['name']}", "preprocess", run, repeat,
+                           clip=clip["name"], endpoint="/api/preprocess", options=options))
+
+
+def bench_stream(client, clip, repeat, results):
+    query = {"path": clip["path"], "pace": "false"}
+
+    def run():
+        resp = client.get('/api/stream-video', query_string=query)
+        body = resp.get_data()
+        return resp.status_code, len(body), body.count(b'--frame\r\nContent-Type: image/jpeg')
+
+    results.append(measure(f"stream {clip['name']}", "stream", run, repeat,
+                           clip=clip["name"], endpoint="/api/stream-video"))
+
+
+def bench_struct_pred(client, exam_ids, repeat, results):
+    single = {"exam_id": exam_ids[0], "mode": "pred_label"}
+
+    def run_single():
+        resp = client.post('/api/generate-struct-pred', json=single)
+        return resp.status_code, len(resp.get_data()), None
+
+    def run_batch():
+        resp = client.post('/api/generate-struct-pred/batch', json={"exam_ids": exam_ids, "mode": "pred_label"})
+        return resp.status_code, len(resp.get_data()), None
+
+    results.append(measure("struct_pred single", "struct_pred", run_single, max(repeat, 20),
+                           endpoint="/api/generate-struct-pred"))
+    results.append(measure(f"struct_pred batch x{len(exam_ids)}", "struct_pred", run_batch, repeat,
+                           endpoint="/api/generate-struct-pred/batch"))
+
+
+# ------------------------------------------------------------------ report
+
+def environment_info(app_module):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    import cv2
+    return {
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "frame_workers": app_module.frame_executor.workers,
+        "video_encoders": app_module.video_encoders.stats()["selected"],
+    }
+
+
+def compare(baseline_path, results):
+    with open(baseline_path) as f:
+        baseline = {r["case"]: r for r in json.load(f)["results"]}
+    print(f"\nChange in p50 against {baseline_path} (ratio > 1 = slower)")
+    for record in results:
+        old = baseline.get(record["case"])
+        if not old or not old["p50_ms"]:
+            continue
+        ratio = record["p50_ms"] / old["p50_ms"]
+        marker = "  <-- regression" if ratio > 1.2 else ""
+        print(f"  {record['case']:<72} {old['p50_ms']:>9.1f} -> {record['p50_ms']:>9.1f} ms  x{ratio:.2f}{marker}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, nargs='+', default=[30, 120])
+    parser.add_argument('--sizes', nargs='+', default=['224x224', '480x640'], help="WIDTHxHEIGHT")
+    parser.add_argument('--colors', nargs='+', default=['gray', 'rgb'], choices=['gray', 'rgb'])
+    parser.add_argument('--dtypes', nargs='+', default=['uint8', 'float32'], choices=['uint8', 'float32'])
+    parser.add_argument('--storage', nargs='+', default=['compressed', 'raw'], choices=['compressed', 'raw'])
+    parser.add_argument('--groups', nargs='+', default=['convert', 'preprocess', 'stream', 'struct_pred'],
+                        choices=['convert', 'preprocess', 'stream', 'struct_pred'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--quick', action='store_true', help="smaller preprocess option matrix")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="earlier --output file to compare p50 latencies against")
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp(prefix='echopilot-bench-')
+    os.environ['TRANSCODE_CACHE_DIR'] = os.path.join(tmp_dir, 'transcode')
+    os.environ['BLOB_DIR'] = os.path.join(tmp_dir, 'blobs')
+    os.environ['FRAME_STORE_DIR'] = os.path.join(tmp_dir, 'sidecars')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    import logging
+    logging.disable(logging.INFO)
+    import app as app_module  # noqa: E402  (after the cache directories are set)
+    from exam_index import ExamIndex  # noqa: E402
+    client = app_module.app.test_client()
+
+    clips = []
+    for num_frames, size, color, dtype, storage in itertools.product(
+            args.frames, args.sizes, args.colors, args.dtypes, args.storage):
+        width, height = map(int, size.split('x'))
+        clips.append(make_clip(tmp_dir, num_frames, width, height, color, dtype, storage))
+    print(f"{len(clips)} clips in {tmp_dir}")
+
+    results = []
+    if 'convert' in args.groups:
+        print("\nconvert")
+        for clip in clips:
+            bench_convert(client, app_module, clip, args.repeat, results)
+
+    if 'preprocess' in args.groups:
+        axes = QUICK_AXES if args.quick else PREPROCESS_AXES
+        combos = [dict(zip(axes, values)) for values in itertools.product(*axes.values())]
+        print(f"\npreprocess: {len(combos)} option combinations on {clips[0]['name']}")
+        for options in combos:
+            options = {k: v for k, v in options.items() if v is not None}
+            label = ",".join(f"{k}={'x'.join(map(str, v)) if isinstance(v, list) else v}" for k, v in options.items())
+            bench_preprocess(client, clips[0], options, args.repeat, results, label)
+        print("\npreprocess: base options on every clip")
+        for clip in clips:
+            bench_preprocess(client, clip, BASE_PREPROCESS, args.repeat, results, "base")
+
+    if 'stream' in args.groups:
+        print("\nstream")
+        for clip in clips:
+            bench_stream(client, clip, args.repeat, results)
+
+    if 'struct_pred' in args.groups:
+        print("\nstruct_pred")
+        db_path = os.path.join(tmp_dir, 'db.json')
+        exam_ids = write_struct_pred_db(db_path, app_module.standardized_structure, STRUCT_PRED_EXAMS)
+        app_module.exam_index = ExamIndex(db_path)
+        bench_struct_pred(client, exam_ids, args.repeat, results)
+
+    report = {
+        "environment": environment_info(app_module),
+        "clips": clips,
+        "max_rss_mb": round(max_rss_bytes() / 2 ** 20, 1),
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\n{len(results)} cases, process peak RSS {report['max_rss_mb']} MiB -> {args.output}")
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Payload size and time-to-first-frame of /api/preprocess: base64 JSON vs binary transport
+
+For each clip length the same request is made with "transport": "json" and
+"transport": "binary". In JSON mode the first frame is usable once the whole
+document has been received, parsed and its first data URI decoded. In binary
+mode it is usable once the small metadata JSON and the first length-prefixed
+record of the bundle have arrived. Requests go through the Flask test client.
+
+Usage:
+    python benchmarks/bench_transport.py [--frames 30 300] [--size 224x224] [--repeat 3]
+"""
+
+import argparse
+import base64
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from create_test_npz import generate_echo_frames  # noqa: E402
+
+
+def json_first_frame(client, body):
+    t0 = time.perf_counter()
+    resp = client.post('/api/preprocess', json=body)
+    raw = resp.get_data()
+    data = json.loads(raw)
+    frames = data["frames"]
+    base64.b64decode(frames[0].split(',', 1)[1])
+    ttff = time.perf_counter() - t0
+    return ttff, len(raw), len(frames)
+
+
+def binary_first_frame(client, body):
+    t0 = time.perf_counter()
+    resp = client.post('/api/preprocess', json=body)
+    meta_raw = resp.get_data()
+    meta = json.loads(meta_raw)
+    blob = client.get(meta["frames_url"], buffered=False)
+    received = bytearray()
+    ttff = None
+    for chunk in blob.response:
+        received += chunk
+        if ttff is None and len(received) >= 4:
+            (length,) = struct.unpack_from('>I', received)
+            if len(received) >= 4 + length:
+                ttff = time.perf_counter() - t0
+    blob.close()
+    return ttff, len(meta_raw) + len(received), meta["frame_count"]
+
+
+def best_of(fn, client, body, repeat):
+    best = None
+    for _ in range(repeat):
+        result = fn(client, body)
+        if best is None or result[0] < best[0]:
+            best = result
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, nargs='+', default=[30, 300])
+    parser.add_argument('--size', default='224x224', help="clip resolution WIDTHxHEIGHT")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+    width, height = map(int, args.size.split('x'))
+
+    tmp_dir = tempfile.mkdtemp(prefix='echopilot-transport-')
+    os.environ.setdefault('BLOB_DIR', os.path.join(tmp_dir, 'blobs'))
+    from app import app  # noqa: E402  (after BLOB_DIR is set)
+    client = app.test_client()
+
+    print(f"{'frames':>6}  {'transport':<9} {'payload KiB':>12} {'first frame ms':>15}")
+    for num_frames in args.frames:
+        npz_path = os.path.join(tmp_dir, f'clip{num_frames}.npz')
+        np.savez_compressed(npz_path, frames=generate_echo_frames(num_frames, height, width, seed=0))
+        options = {"format": "video_frames", "max_frames": num_frames}
+        for transport, fn in (("json", json_first_frame), ("binary", binary_first_frame)):
+            body = {"path": npz_path, "options": dict(options, transport=transport)}
+            fn(client, body)  # warm the frame cache
+            ttff, payload, count = best_of(fn, client, body, args.repeat)
+            assert count == num_frames, (count, num_frames)
+            print(f"{num_frames:>6}  {transport:<9} {payload / 1024:>12.1f} {ttff * 1000:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Load test: requests/sec for /api/convert-npz and /api/stream-video, dev vs production server
+
+Each mode is started through start_server.py (--dev / --prod) on a spare port,
+then every endpoint is hit by N concurrent keep-alive clients for a fixed time.
+The dev server runs with FLASK_DEBUG=false so the reloader's child process can
+be shut down cleanly; production settings come from the usual SERVER_* variables.
+
+Usage:
+    python benchmarks/loadtest.py [--modes dev prod] [--concurrency 8] [--duration 10] [--npz PATH]
+"""
+
+import argparse
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from create_test_npz import generate_echo_frames  # noqa: E402
+
+
+def wait_for_health(port, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.3)
+    return False
+
+
+def start_server(mode, port, log):
+    env = dict(os.environ, FLASK_RUN_HOST='127.0.0.1', FLASK_RUN_PORT=str(port), FLASK_DEBUG='false')
+    return subprocess.Popen([sys.executable, 'start_server.py', f'--{mode}'], cwd=BACKEND_DIR, env=env,
+                            stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+
+def stop_server(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except (ProcessLookupError, AttributeError):
+        proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+def hammer(port, path, concurrency, duration):
+    """Run concurrent keep-alive clients against one URL; return (requests, errors, latencies)"""
+    stop_at = time.time() + duration
+    lock = threading.Lock()
+    latencies, errors = [], [0]
+
+    def client():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        while time.time() < stop_at:
+            t0 = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            elapsed = time.perf_counter() - t0
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return len(latencies), errors[0], latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', nargs='+', default=['dev', 'prod'], choices=['dev', 'prod'])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--npz', help="clip to request (default: synthetic 120-frame 256x256 clip)")
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp(prefix='echopilot-loadtest-')
+    npz_path = args.npz
+    if not npz_path:
+        npz_path = os.path.join(tmp_dir, 'loadtest.npz')
+        np.savez_compressed(npz_path, frames=generate_echo_frames(120, 256, 256, seed=0))
+
+    endpoints = {
+        'convert-npz': '/api/convert-npz?' + urlencode({'path': npz_path}),
+        'stream-video': '/api/stream-video?' + urlencode({'path': npz_path, 'resize': '224x224', 'pace': 'false'}),
+    }
+
+    print(f"clip: {npz_path}  concurrency: {args.concurrency}  duration: {args.duration:.0f}s")
+    print(f"{'mode':<5} {'endpoint':<13} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7}")
+    for mode in args.modes:
+        log_path = os.path.join(tmp_dir, f'server-{mode}.log')
+        with open(log_path, 'wb') as log:
+            proc = start_server(mode, args.port, log)
+            try:
+                if not wait_for_health(args.port):
+                    print(f"{mode:<5} server did not become healthy, see {log_path}")
+                    continue
+                for name, path in endpoints.items():
+                    hammer(args.port, path, 1, 0.5)  # warm the caches
+                    count, errors, latencies = hammer(args.port, path, args.concurrency, args.duration)
+                    p50, p95 = (np.percentile(latencies, [50, 95]) * 1000) if latencies else (0.0, 0.0)
+                    print(f"{mode:<5} {name:<13} {count / args.duration:>8.1f} {p50:>8.1f} {p95:>8.1f} {errors:>7}")
+            finally:
+                stop_server(proc)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Short-lived binary handles for /api/preprocess results
+
+Instead of base64 data URIs inside the JSON response, encoded frames or an MP4
+are written to a file in a shared directory and the JSON carries a handle that
+the client fetches as raw bytes from /api/blob/<handle>. Blobs live on disk so
+any worker process can serve a handle created by another, and they expire
+BLOB_TTL_SECONDS after they were written.
+
+Frame bundles are a sequence of length-prefixed records:
+
+    [uint32 big-endian length][encoded image bytes] ...
+
+so a reader can hand each frame to the decoder as soon as its bytes arrive.
+"""
+
+import logging
+import os
+import re
+import secrets
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOB_DIR = os.path.join(tempfile.gettempdir(), 'echopilot-blobs')
+DEFAULT_TTL_SECONDS = 300
+
+# kind -> (file suffix, mimetype)
+BLOB_KINDS = {
+    'frames': ('.frames', 'application/x-echopilot-frames'),
+    'mp4': ('.mp4', 'video/mp4'),
+}
+FRAME_LENGTH = struct.Struct('>I')
+
+_HANDLE_RE = re.compile(r'^[A-Za-z0-9_-]{16,64}\.(frames|mp4)$')
+
+
+class BlobStore:
+    """Directory of write-once blobs addressed by random handles, expired by age"""
+
+    PART_SUFFIX = '.part'
+
+    def __init__(self, blob_dir: str = DEFAULT_BLOB_DIR, ttl_seconds: int = DEFAULT_TTL_SECONDS):
+        self.blob_dir = os.path.abspath(blob_dir)
+        self.ttl_seconds = int(ttl_seconds)
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self.created = 0
+        self.served = 0
+        self.expired = 0
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "BlobStore":
+        """Build a store from BLOB_DIR / BLOB_TTL_SECONDS"""
+        blob_dir = os.environ.get('BLOB_DIR') or DEFAULT_BLOB_DIR
+        try:
+            ttl_seconds = int(os.environ.get('BLOB_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+        except ValueError:
+            logger.warning("Invalid BLOB_TTL_SECONDS, using default")
+            ttl_seconds = DEFAULT_TTL_SECONDS
+        return cls(blob_dir, ttl_seconds)
+
+    @staticmethod
+    def mimetype_for(handle: str) -> str:
+        return BLOB_KINDS[handle.rsplit('.', 1)[-1]][1]
+
+    def reserve(self, kind: str) -> Tuple[str, str]:
+        """Pick a new handle and create its temp file; returns (handle, temp path).
+
+        The temp path keeps the kind's suffix last so encoders that choose the
+        container from the extension (cv2.VideoWriter) can write to it directly.
+        """
+        suffix = BLOB_KINDS[kind][0]
+        handle = secrets.token_urlsafe(18) + suffix
+        fd, tmp_path = tempfile.mkstemp(prefix=handle[:-len(suffix)] + '-', suffix=self.PART_SUFFIX + suffix,
+                                        dir=self.blob_dir)
+        os.close(fd)
+        return handle, tmp_path
+
+    def publish(self, handle: str, tmp_path: str) -> int:
+        """Atomically move a finished temp file into place; returns its size in bytes"""
+        path = os.path.join(self.blob_dir, handle)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.created += 1
+        self._purge_expired()
+        return os.path.getsize(path)
+
+    @staticmethod
+    def discard(tmp_path: str):
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+    def put_frames(self, frames: Iterable[bytes]) -> Tuple[str, int, int]:
+        """Write encoded frames as a length-prefixed bundle; returns (handle, frame count, bytes)"""
+        handle, tmp_path = self.reserve('frames')
+        count = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for data in frames:
+                    f.write(FRAME_LENGTH.pack(len(data)))
+                    f.write(data)
+                    count += 1
+            size = self.publish(handle, tmp_path)
+        except BaseException:
+            self.discard(tmp_path)
+            raise
+        return handle, count, size
+
+    def path_for(self, handle: str) -> Optional[str]:
+        """File path of a live handle, or None if it is malformed, unknown or expired"""
+        if not _HANDLE_RE.match(handle or ''):
+            return None
+        path = os.path.join(self.blob_dir, handle)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return None
+        if time.time() - mtime > self.ttl_seconds:
+            self._remove(path)
+            return None
+        with self._lock:
+            self.served += 1
+        return path
+
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            # e.g. still open for sending on Windows; retried on the next purge
+            logger.warning(f"Blob store: could not remove {path}: {e}")
+            return
+        with self._lock:
+            self.expired += 1
+
+    def _purge_expired(self):
+        """Delete expired blobs (and abandoned temp files), at most once per minute"""
+        now = time.time()
+        with self._lock:
+            if now - self._last_purge < 60:
+                return
+            self._last_purge = now
+        cutoff = now - self.ttl_seconds
+        for entry in os.scandir(self.blob_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    self._remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Union[int, str]]:
+        with self._lock:
+            return {
+                "dir": self.blob_dir,
+                "ttl_seconds": self.ttl_seconds,
+                "created": self.created,
+                "served": self.served,
+                "expired": self.expired,
+            }
@@ -7,46 +7,46 @@ import numpy as np
 import cv2
 import os
 
-def create_test_npz():
-    """Create a test NPZ file with synthetic echocardiography-like frames"""
-    
-    # Create synthetic frames (30 frames, 200x200, grayscale)
-    num_frames = 30
-    height, width = 200, 200
+def generate_echo_frames(num_frames=30, height=200, width=200, seed=None):
+    """Generate synthetic echocardiography-like grayscale frames (num_frames, height, width) uint8"""
+    rng = np.random.default_rng(seed)
+    scale = min(height, width) / 200.0
     
     frames = []
     
     for i in range(num_frames):
-        # Create a frame with a moving circle (simulating heart movement)
-        frame = np.zeros((height, width), dtype=np.uint8)
-        
         # Background noise
-        noise = np.random.normal(50, 20, (height, width))
+        noise = rng.normal(50, 20, (height, width))
         frame = np.clip(noise, 0, 255).astype(np.uint8)
         
         # Moving circle (simulating heart chamber)
-        center_x = width // 2 + int(10 * np.sin(i * 0.3))
-        center_y = height // 2 + int(5 * np.cos(i * 0.3))
-        radius = 30 + int(10 * np.sin(i * 0.4))
+        center_x = width // 2 + int(10 * scale * np.sin(i * 0.3))
+        center_y = height // 2 + int(5 * scale * np.cos(i * 0.3))
+        radius = int((30 + 10 * np.sin(i * 0.4)) * scale)
         
         cv2.circle(frame, (center_x, center_y), radius, 150, -1)
         
         # Inner circle (simulating inner chamber)
-        inner_radius = max(5, radius - 15)
+        inner_radius = max(5, radius - int(15 * scale))
         cv2.circle(frame, (center_x, center_y), inner_radius, 80, -1)
         
         # Add some texture lines
         for j in range(5):
-            x1 = np.random.randint(0, width)
-            y1 = np.random.randint(0, height)
-            x2 = np.random.randint(0, width)
-            y2 = np.random.randint(0, height)
+            x1 = int(rng.integers(0, width))
+            y1 = int(rng.integers(0, height))
+            x2 = int(rng.integers(0, width))
+            y2 = int(rng.integers(0, height))
             cv2.line(frame, (x1, y1), (x2, y2), 200, 1)
         
         frames.append(frame)
     
-    # Convert to numpy array
-    frames_array = np.array(frames)
+    return np.array(frames)
+
+def create_test_npz():
+    """Create a test NPZ file with synthetic echocardiography-like frames"""
+    
+    # Create synthetic frames (30 frames, 200x200, grayscale)
+    frames_array = generate_echo_frames(num_frames=30, height=200, width=200)
     print(f"Created frames array with shape: {frames_array.shape}")
     
     # Create test directory structure
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+In-memory index of the exam DB JSON used by /api/generate-struct-pred
+
+The DB file is parsed once and every per-video entry is grouped under its
+exam_id, so a lookup is a dict access instead of re-reading the file and
+scanning it. The file's (mtime_ns, size) is checked on each lookup and the
+index is rebuilt only when it changes; concurrent requests during a reload
+wait for the single rebuild.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def load_db_entries(db_json_path: str) -> List[dict]:
+    """Load the DB JSON and expand it to one entry per video (paths rewritten to the NAS share)"""
+    with open(db_json_path, 'r') as f:
+        raw = json.load(f)
+
+    # Flatten groups similar to original but simplified
+    groups: List[List[dict]] = []
+    if isinstance(raw, dict):
+        for v in raw.values():
+            groups.append(v if isinstance(v, list) else [v])
+    else:
+        groups.append(raw)
+
+    out = []
+    for grp in groups:
+        for e in grp:
+            vids = e["video_npz"]
+            metas = e.get("meta_json")
+
+            # Convert to lists
+            vids = [vids] if isinstance(vids, (str, Path)) else vids
+            metas = [metas] if isinstance(metas, (str, Path)) or metas is None else metas
+            if metas is None:
+                metas = [None] * len(vids)
+
+            for vid_str, meta_str in zip(vids, metas):
+                # Path conversion (adjust as needed for your environment)
+                vid_path = str(vid_str).replace("/mnt", "//10.10.10.10/NAS02").replace("/", "\\")
+                meta_path = str(meta_str).replace("/mnt", "//10.10.10.10/NAS02").replace("/", "\\") if meta_str else None
+
+                new_entry = e.copy()
+                new_entry["video_npz"] = vid_path
+                new_entry["meta_json"] = meta_path
+                out.append(new_entry)
+
+    return out
+
+
+class ExamIndex:
+    """exam_id -> [entry per video], rebuilt when the DB file changes"""
+
+    def __init__(self, db_json_path: str):
+        self.db_json_path = db_json_path
+        self._lock = threading.Lock()
+        self._version: Optional[Tuple[int, int]] = None
+        self._by_exam: Dict[str, List[dict]] = {}
+        self.entries_count = 0
+        self.load_time_ms = 0.0
+        self.loaded_at: Optional[float] = None
+        self.reloads = 0
+
+    def _file_version(self) -> Tuple[int, int]:
+        st = os.stat(self.db_json_path)
+        return st.st_mtime_ns, st.st_size
+
+    def refresh(self) -> bool:
+        """Rebuild the index if the file changed; returns True when a reload happened.
+
+        Raises FileNotFoundError if the DB file does not exist.
+        """
+        version = self._file_version()
+        if version == self._version:
+            return False
+        with self._lock:
+            version = self._file_version()
+            if version == self._version:
+                return False  # another request already reloaded it
+            t0 = time.perf_counter()
+            entries = load_db_entries(self.db_json_path)
+            by_exam: Dict[str, List[dict]] = {}
+            for entry in entries:
+                by_exam.setdefault(entry.get("exam_id"), []).append(entry)
+            self._by_exam = by_exam
+            self.entries_count = len(entries)
+            self.load_time_ms = round((time.perf_counter() - t0) * 1000.0, 3)
+            self.loaded_at = time.time()
+            self.reloads += 1
+            self._version = version
+        logger.info(f"Indexed {len(by_exam)} exams ({self.entries_count} entries) "
+                    f"from {self.db_json_path} in {self.load_time_ms} ms")
+        return True
+
+    def get(self, exam_id: str) -> Optional[List[dict]]:
+        """All entries (one per video) of an exam, or None; reloads the file first if it changed"""
+        self.refresh()
+        return self._by_exam.get(exam_id)
+
+    def __len__(self) -> int:
+        return len(self._by_exam)
+
+    def exam_ids(self) -> List[str]:
+        self.refresh()
+        return list(self._by_exam)
+
+    def select(self, patient_prefix: Optional[str] = None, date: Optional[str] = None) -> List[str]:
+        """Sorted exam_ids ("<patient>__<date>") whose patient starts with patient_prefix and date with date"""
+        self.refresh()
+        selected = []
+        for exam_id in self._by_exam:
+            if not isinstance(exam_id, str):
+                continue
+            patient, _, exam_date = exam_id.partition("__")
+            if patient_prefix and not patient.startswith(patient_prefix):
+                continue
+            if date and not exam_date.startswith(date):
+                continue
+            selected.append(exam_id)
+        return sorted(selected)
+
+    def stats(self) -> dict:
+        return {
+            "db_json_path": self.db_json_path,
+            "exams": len(self._by_exam),
+            "entries": self.entries_count,
+            "load_time_ms": self.load_time_ms,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+        }
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Cached directory index for /api/list
+
+Each directory is read once with os.scandir and its file names, sizes and
+mtimes are kept in memory. A listing is reused until the directory's own
+mtime changes (a file was added, removed or renamed in it), so listing a
+large NAS tree again costs one stat per directory instead of one per file.
+A file rewritten in place keeps a stale size/mtime until its directory
+changes.
+
+Results are sorted by path, mtime or size and paged with an opaque cursor
+holding the last (sort value, path) returned, so pages stay consistent while
+files are added. Frame count and resolution can be added from the NPZ
+headers, which are read once per (path, size, mtime).
+"""
+
+import base64
+import bisect
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from frame_cache import find_frames_key
+from npz_header import read_npz_headers
+
+logger = logging.getLogger(__name__)
+
+SORT_FIELDS = ('name', 'mtime', 'size')
+MAX_DIRS = 4096
+MAX_HEADERS = 20000
+MAX_VIEWS = 64
+# Types of a cursor's (sort value, path) per sort, as produced by FileIndex._sort_key
+CURSOR_TYPES = {'name': (str, str), 'mtime': (int, str), 'size': (int, str)}
+
+
+class FileEntry(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+
+
+class DirListing(NamedTuple):
+    mtime_ns: int
+    files: Tuple[FileEntry, ...]
+    subdirs: Tuple[str, ...]
+
+
+class InvalidCursor(ValueError):
+    """Raised for a cursor that was not produced by the same sort"""
+
+
+def clip_geometry(shape: Tuple[int, ...]) -> Optional[dict]:
+    """Frame count and resolution of a frames array, with the same layout rules as the MP4 conversion"""
+    if len(shape) == 4:
+        return {"frames": shape[0], "height": shape[1], "width": shape[2], "channels": shape[3]}
+    if len(shape) == 3:
+        if shape[0] > shape[2]:  # (height, width, frames)
+            return {"frames": shape[2], "height": shape[0], "width": shape[1], "channels": 1}
+        return {"frames": shape[0], "height": shape[1], "width": shape[2], "channels": 1}
+    return None
+
+
+def encode_cursor(sort: str, key: tuple) -> str:
+    raw = json.dumps([sort, *key], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(sort: str, cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_sort, *key = json.loads(raw)
+    except Exception:
+        raise InvalidCursor("Malformed cursor")
+    if cursor_sort != sort or len(key) != 2:
+        raise InvalidCursor(f"Cursor was created for sort '{cursor_sort}', not '{sort}'")
+    # A tampered key would fail (500) in bisect against the stored keys; JSON true/false are not ints here
+    if any(type(value) is not expected for value, expected in zip(key, CURSOR_TYPES[sort])):
+        raise InvalidCursor("Malformed cursor")
+    return tuple(key)
+
+
+class FileIndex:
+    """Directory listings cached by directory mtime, with sorted cursor pagination"""
+
+    def __init__(self, max_dirs: int = MAX_DIRS, max_headers: int = MAX_HEADERS):
+        self.max_dirs = max_dirs
+        self.max_headers = max_headers
+        self._lock = threading.Lock()
+        self._dirs: "OrderedDict[str, DirListing]" = OrderedDict()
+        self._headers: "OrderedDict[Tuple[str, int, int], Optional[dict]]" = OrderedDict()
+        # (root, exts, recursive, sort) -> (directory versions, sorted keys, sorted entries)
+        self._views: "OrderedDict[tuple, Tuple[tuple, List[tuple], List[FileEntry]]]" = OrderedDict()
+        self.scans = 0
+        self.dir_hits = 0
+        self.header_reads = 0
+        self.header_hits = 0
+
+    def _listing(self, directory: str) -> DirListing:
+        mtime_ns = os.stat(directory).st_mtime_ns
+        with self._lock:
+            cached = self._dirs.get(directory)
+            if cached is not None and cached.mtime_ns == mtime_ns:
+                self._dirs.move_to_end(directory)
+                self.dir_hits += 1
+                return cached
+
+        files, subdirs = [], []
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file():
+                        st = entry.stat()
+                        files.append(FileEntry(entry.path, st.st_size, st.st_mtime_ns))
+                except OSError:
+                    continue  # vanished or unreadable while scanning
+        listing = DirListing(mtime_ns, tuple(files), tuple(sorted(subdirs)))
+        with self._lock:
+            self._dirs[directory] = listing
+            self._dirs.move_to_end(directory)
+            while len(self._dirs) > self.max_dirs:
+                self._dirs.popitem(last=False)
+            self.scans += 1
+        return listing
+
+    def _walk(self, root: str, recursive: bool) -> Iterable[Tuple[str, DirListing]]:
+        pending = [root]
+        while pending:
+            directory = pending.pop()
+            try:
+                listing = self._listing(directory)
+            except OSError as e:
+                if directory == root:
+                    raise
+                logger.warning(f"File index: skipping {directory}: {e}")
+                continue
+            yield directory, listing
+            if recursive:
+                pending.extend(reversed(listing.subdirs))
+
+    @staticmethod
+    def _sort_key(entry: FileEntry, sort: str) -> tuple:
+        if sort == 'mtime':
+            return entry.mtime_ns, entry.path
+        if sort == 'size':
+            return entry.size, entry.path
+        return '', entry.path
+
+    def _view(self, root: str, exts: Set[str], recursive: bool, sort: str) -> Tuple[List[tuple], List[FileEntry]]:
+        listings = list(self._walk(root, recursive))
+        versions = tuple((directory, listing.mtime_ns) for directory, listing in listings)
+        view_key = (root, tuple(sorted(exts)), recursive, sort)
+        with self._lock:
+            cached = self._views.get(view_key)
+            if cached is not None and cached[0] == versions:
+                self._views.move_to_end(view_key)
+                return cached[1], cached[2]
+
+        entries = [
+            entry
+            for _, listing in listings
+            for entry in listing.files
+            if not exts or os.path.basename(entry.path).lower().split('.')[-1] in exts
+        ]
+        entries.sort(key=lambda e: self._sort_key(e, sort))
+        keys = [self._sort_key(e, sort) for e in entries]
+        with self._lock:
+            self._views[view_key] = (versions, keys, entries)
+            self._views.move_to_end(view_key)
+            while len(self._views) > MAX_VIEWS:
+                self._views.popitem(last=False)
+        return keys, entries
+
+    def header_info(self, entry: FileEntry) -> Optional[dict]:
+        """Frame count and resolution from the NPZ headers (None if unreadable), cached per file version"""
+        cache_key = (entry.path, entry.size, entry.mtime_ns)
+        with self._lock:
+            if cache_key in self._headers:
+                self._headers.move_to_end(cache_key)
+                self.header_hits += 1
+                return self._headers[cache_key]
+        info = None
+        try:
+            keys, key_to_meta = read_npz_headers(entry.path)
+            frames_key = find_frames_key(keys)
+            if frames_key and "shape" in key_to_meta[frames_key]:
+                meta = key_to_meta[frames_key]
+                info = clip_geometry(meta["shape"])
+                if info is not None:
+                    info["dtype"] = meta["dtype"]
+        except Exception as e:
+            logger.debug(f"File index: no header info for {entry.path}: {e}")
+        with self._lock:
+            self._headers[cache_key] = info
+            while len(self._headers) > self.max_headers:
+                self._headers.popitem(last=False)
+            self.header_reads += 1
+        return info
+
+    def list(self, root: str, exts: Iterable[str] = (), recursive: bool = False, sort: str = 'name',
+             descending: bool = False, cursor: Optional[str] = None, limit: int = 200,
+             headers: bool = False) -> dict:
+        """One page of files under root: {"entries", "total", "next_cursor"} (raises InvalidCursor)"""
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"Unknown sort '{sort}', expected one of {list(SORT_FIELDS)}")
+        limit = max(1, int(limit))
+        keys, entries = self._view(os.path.abspath(root), {e.lower() for e in exts}, recursive, sort)
+        # Sort values are ints (mtime/size) or '' (name), so a cursor key compares with the stored keys
+        after = decode_cursor(sort, cursor) if cursor else None
+
+        if descending:
+            end = bisect.bisect_left(keys, after) if after is not None else len(keys)
+            indices = range(end - 1, max(end - limit, 0) - 1, -1)
+        else:
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+            indices = range(start, min(start + limit, len(keys)))
+
+        page = []
+        for i in indices:
+            entry = entries[i]
+            item = {
+                "path": entry.path,
+                "name": os.path.basename(entry.path),
+                "size": entry.size,
+                "mtime": entry.mtime_ns / 1e9,
+            }
+            if headers and entry.path.lower().endswith('.npz'):
+                item["header"] = self.header_info(entry)
+            page.append(item)
+
+        last = indices[-1] if len(indices) else None
+        more = last is not None and (last > 0 if descending else last < len(keys) - 1)
+        return {
+            "entries": page,
+            "total": len(keys),
+            "next_cursor": encode_cursor(sort, keys[last]) if more else None,
+        }
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "dirs": len(self._dirs),
+                "scans": self.scans,
+                "dir_hits": self.dir_hits,
+                "headers": len(self._headers),
+                "header_reads": self.header_reads,
+                "header_hits": self.header_hits,
+            }
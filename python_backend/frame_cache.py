@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Process-wide cache of decoded NPZ frame arrays
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Keys probed (in order) for the frames array inside an NPZ file
+FRAME_KEYS = ('frames', 'video', 'data', 'array', 'arr_0')
+
+DEFAULT_MAX_BYTES = 1024 ** 3  # 1 GiB
+
+
+class NoFramesError(ValueError):
+    """Raised when an NPZ file contains no arrays at all"""
+
+
+def find_frames_key(files: Iterable[str]) -> Optional[str]:
+    """Pick the frames array from the member names of an NPZ file.
+
+    Standard keys win; otherwise the first available key is used.
+    """
+    files = list(files)
+    for key in FRAME_KEYS:
+        if key in files:
+            return key
+    if files:
+        logger.info(f"Using first available key: {files[0]}")
+        return files[0]
+    return None
+
+
+class _Loading:
+    """Single-flight slot shared by all requests waiting on one decode"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Tuple[np.ndarray, str]] = None
+        self.error: Optional[BaseException] = None
+
+
+class FrameCache:
+    """LRU cache of decoded frame arrays, bounded by total array bytes.
+
+    Entries are invalidated when the file's mtime or size changes. Concurrent
+    requests for the same file wait on a single decode instead of inflating
+    the compressed array several times. Cached arrays are read-only and shared
+    between requests, so callers must copy before modifying them in place.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        # abs path -> (version, frames, frames_key)
+        self._entries: "OrderedDict[str, Tuple[Tuple[int, int], np.ndarray, str]]" = OrderedDict()
+        self._loading: Dict[Tuple[str, Tuple[int, int]], _Loading] = {}
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    @classmethod
+    def from_env(cls) -> "FrameCache":
+        """Build a cache from FRAME_CACHE_MAX_BYTES"""
+        try:
+            max_bytes = int(os.environ.get('FRAME_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        except ValueError:
+            logger.warning("Invalid FRAME_CACHE_MAX_BYTES, using default")
+            max_bytes = DEFAULT_MAX_BYTES
+        return cls(max_bytes)
+
+    def get(self, npz_path: str) -> Tuple[np.ndarray, str]:
+        """Return (frames, frames_key) for an NPZ file, decoding it at most once"""
+        abs_path = os.path.abspath(npz_path)
+        st = os.stat(abs_path)
+        version = (st.st_mtime_ns, st.st_size)
+
+        with self._lock:
+            entry = self._entries.get(abs_path)
+            if entry is not None:
+                if entry[0] == version:
+                    self._entries.move_to_end(abs_path)
+                    self.hits += 1
+                    return entry[1], entry[2]
+                # File changed on disk; drop the stale array
+                self._drop_locked(abs_path)
+            slot = self._loading.get((abs_path, version))
+            leader = slot is None
+            if leader:
+                slot = _Loading()
+                self._loading[(abs_path, version)] = slot
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            slot.done.wait()
+            if slot.error is not None:
+                raise slot.error
+            return slot.result
+
+        try:
+            frames, frames_key = self._decode(abs_path)
+            slot.result = (frames, frames_key)
+            with self._lock:
+                self._store_locked(abs_path, version, frames, frames_key)
+            return frames, frames_key
+        except BaseException as e:
+            slot.error = e
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop((abs_path, version), None)
+            slot.done.set()
+
+    def peek(self, npz_path: str) -> Optional[Tuple[np.ndarray, str]]:
+        """Return (frames, frames_key) if a current decode is cached, without decoding"""
+        abs_path = os.path.abspath(npz_path)
+        st = os.stat(abs_path)
+        with self._lock:
+            entry = self._entries.get(abs_path)
+            if entry is None or entry[0] != (st.st_mtime_ns, st.st_size):
+                return None
+            self._entries.move_to_end(abs_path)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    @staticmethod
+    def _decode(abs_path: str) -> Tuple[np.ndarray, str]:
+        logger.info(f"Decoding NPZ frames: {abs_path}")
+        with np.load(abs_path) as data:
+            frames_key = find_frames_key(data.files)
+            if frames_key is None:
+                raise NoFramesError("No data found in NPZ file")
+            frames = data[frames_key]
+        frames.flags.writeable = False
+        return frames, frames_key
+
+    def _store_locked(self, abs_path: str, version: Tuple[int, int], frames: np.ndarray, frames_key: str):
+        if frames.nbytes > self.max_bytes:
+            logger.info(f"Frame cache: {abs_path} ({frames.nbytes} bytes) exceeds the cache budget, not cached")
+            return
+        if abs_path in self._entries:
+            self._drop_locked(abs_path)
+        self._entries[abs_path] = (version, frames, frames_key)
+        self._total_bytes += frames.nbytes
+        while self._total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop_locked(oldest)
+            self.evictions += 1
+
+    def _drop_locked(self, abs_path: str):
+        _, frames, _ = self._entries.pop(abs_path)
+        self._total_bytes -= frames.nbytes
+
+    def invalidate(self, npz_path: str):
+        """Forget any cached array for a file"""
+        with self._lock:
+            abs_path = os.path.abspath(npz_path)
+            if abs_path in self._entries:
+                self._drop_locked(abs_path)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Frame-parallel executor for per-frame OpenCV work
+
+Most cv2 calls (resize, blurs, bilateralFilter, imencode) release the GIL, so
+running independent frames on a thread pool scales across cores. Results are
+always returned in frame order and the number of frames in flight is bounded,
+so a long clip never queues thousands of intermediate frames at once.
+"""
+
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+from lazy_start import LazyStart
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class FrameExecutor:
+    """Shared thread pool that maps a per-frame function over a clip in order"""
+
+    def __init__(self, workers: int = 1, max_in_flight: Optional[int] = None):
+        self.workers = max(1, int(workers))
+        self.max_in_flight = max(1, int(max_in_flight or self.workers * 4))
+        self._pool: LazyStart[ThreadPoolExecutor] = LazyStart(
+            lambda: ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='frame-worker'))
+
+    @classmethod
+    def from_env(cls) -> "FrameExecutor":
+        """Build an executor from FRAME_WORKERS / FRAME_MAX_IN_FLIGHT"""
+        try:
+            workers = int(os.environ.get('FRAME_WORKERS') or (os.cpu_count() or 1))
+            max_in_flight = int(os.environ.get('FRAME_MAX_IN_FLIGHT') or 0) or None
+        except ValueError:
+            logger.warning("Invalid FRAME_WORKERS/FRAME_MAX_IN_FLIGHT, running frame work serially")
+            workers, max_in_flight = 1, None
+        return cls(workers, max_in_flight)
+
+    @property
+    def parallel(self) -> bool:
+        return self.workers > 1
+
+    def map(self, fn: Callable[[T], R], items: Iterable[T], max_in_flight: Optional[int] = None) -> Iterator[R]:
+        """Yield fn(item) for every item, in order, with at most max_in_flight pending.
+
+        max_in_flight defaults to the executor-wide bound. Closing the returned
+        generator early (e.g. a disconnected stream) cancels frames that have
+        not started yet.
+        """
+        limit = max(1, int(max_in_flight or self.max_in_flight))
+        if not self.parallel and max_in_flight is None:
+            for item in items:
+                yield fn(item)
+            return
+
+        pool = self._pool.get()
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(fn, item))
+                if len(pending) >= limit:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def run_indexed(self, fn: Callable[[int], None], count: int):
+        """Call fn(i) for i in range(count); fn writes its result into a preallocated buffer"""
+        for _ in self.map(fn, range(count)):
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_in_flight": self.max_in_flight,
+        }
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped frame store: uncompressed .npy sidecars for NPZ clips
+
+Our NPZs are written with np.savez_compressed, so reading even one frame
+inflates the whole clip. Ingesting a clip writes its frames array once as a
+raw .npy sidecar that np.load(mmap_mode='r') can open, after which readers
+only touch the pages of the frames they actually use.
+
+Usage:
+    python frame_store.py <npz file or directory> [...] [--force]
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+
+from frame_cache import FrameCache
+from npz_stream import DEFAULT_CHUNK_BYTES, FrameSource, NpzFrameStream, unit_range
+
+logger = logging.getLogger(__name__)
+
+SIDECAR_SUFFIX = '.frames.npy'
+DEFAULT_STREAM_MIN_BYTES = 256 * 1024 ** 2  # 256 MiB
+COPY_CHUNK_BYTES = 4 * 1024 ** 2
+MAX_UNIT_RANGES = 4096
+
+
+class FrameStore:
+    """Resolve NPZ frames from a fresh mmap sidecar, falling back to the frame cache.
+
+    A sidecar is considered fresh when its mtime equals the NPZ's mtime; ingest
+    stamps the sidecar with the source mtime, so any later rewrite of the NPZ
+    makes the sidecar stale and it is ignored until re-ingested.
+    """
+
+    def __init__(self, frame_cache: FrameCache, sidecar_dir: Optional[str] = None, auto_ingest: bool = False,
+                 stream_min_bytes: int = DEFAULT_STREAM_MIN_BYTES, chunk_bytes: int = DEFAULT_CHUNK_BYTES):
+        self.frame_cache = frame_cache
+        self.sidecar_dir = os.path.abspath(sidecar_dir) if sidecar_dir else None
+        self.auto_ingest = auto_ingest
+        self.stream_min_bytes = int(stream_min_bytes)
+        self.chunk_bytes = int(chunk_bytes)
+        self._lock = threading.Lock()
+        self._ingesting: Set[str] = set()
+        # (abs path, mtime_ns, size) -> unit_range of that version of the clip
+        self._unit_ranges: "OrderedDict[Tuple[str, int, int], Optional[bool]]" = OrderedDict()
+        self.mmap_opens = 0
+        self.fallbacks = 0
+        self.streamed = 0
+        self.ingested = 0
+        if self.sidecar_dir:
+            os.makedirs(self.sidecar_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, frame_cache: FrameCache) -> "FrameStore":
+        """Build a store from FRAME_STORE_DIR / FRAME_STORE_AUTO_INGEST / NPZ_STREAM_MIN_BYTES / NPZ_STREAM_CHUNK_BYTES"""
+        sidecar_dir = os.environ.get('FRAME_STORE_DIR') or None
+        auto_ingest = os.environ.get('FRAME_STORE_AUTO_INGEST', 'false').lower() == 'true'
+        try:
+            stream_min_bytes = int(os.environ.get('NPZ_STREAM_MIN_BYTES') or DEFAULT_STREAM_MIN_BYTES)
+            chunk_bytes = int(os.environ.get('NPZ_STREAM_CHUNK_BYTES') or DEFAULT_CHUNK_BYTES)
+        except ValueError:
+            logger.warning("Invalid NPZ_STREAM_MIN_BYTES/NPZ_STREAM_CHUNK_BYTES, using defaults")
+            stream_min_bytes, chunk_bytes = DEFAULT_STREAM_MIN_BYTES, DEFAULT_CHUNK_BYTES
+        return cls(frame_cache, sidecar_dir, auto_ingest, stream_min_bytes, chunk_bytes)
+
+    def sidecar_path(self, npz_path: str) -> str:
+        """Sidecar location: next to the NPZ, or hashed into FRAME_STORE_DIR if set"""
+        abs_path = os.path.abspath(npz_path)
+        if self.sidecar_dir:
+            digest = hashlib.sha1(abs_path.encode('utf-8')).hexdigest()
+            return os.path.join(self.sidecar_dir, digest + SIDECAR_SUFFIX)
+        return abs_path + SIDECAR_SUFFIX
+
+    def _fresh_sidecar(self, npz_path: str) -> Optional[str]:
+        sidecar = self.sidecar_path(npz_path)
+        try:
+            if os.stat(sidecar).st_mtime_ns == os.stat(npz_path).st_mtime_ns:
+                return sidecar
+        except FileNotFoundError:
+            pass
+        return None
+
+    def has_sidecar(self, npz_path: str) -> bool:
+        return self._fresh_sidecar(npz_path) is not None
+
+    def _open_sidecar(self, npz_path: str) -> Optional[np.ndarray]:
+        sidecar = self._fresh_sidecar(npz_path)
+        if sidecar is not None:
+            try:
+                frames = np.load(sidecar, mmap_mode='r')
+                with self._lock:
+                    self.mmap_opens += 1
+                return frames
+            except (OSError, ValueError) as e:
+                logger.warning(f"Frame store: unreadable sidecar {sidecar} ({e}), falling back to NPZ")
+        return None
+
+    def _decode(self, npz_path: str) -> Tuple[np.ndarray, str]:
+        frames, frames_key = self.frame_cache.get(npz_path)
+        with self._lock:
+            self.fallbacks += 1
+        if self.auto_ingest:
+            self._ingest_in_background(npz_path, frames)
+        return frames, frames_key
+
+    def open(self, npz_path: str) -> Tuple[np.ndarray, str]:
+        """Return (frames, frames_key) for an NPZ file.
+
+        With a fresh sidecar the array is a read-only memmap, so slicing it
+        reads only the requested frames from disk. Otherwise the whole array
+        is decoded through the shared frame cache.
+        """
+        frames = self._open_sidecar(npz_path)
+        if frames is not None:
+            return frames, 'frames'
+        return self._decode(npz_path)
+
+    def open_stream(self, npz_path: str) -> Tuple[FrameSource, str]:
+        """Like open(), for callers that walk the clip in order (see npz_stream.frame_chunks).
+
+        A clip that has no sidecar, is not in the frame cache and decodes to at
+        least NPZ_STREAM_MIN_BYTES comes back as an NpzFrameStream instead of an
+        array, so it is inflated chunk by chunk and never held whole in memory.
+        """
+        frames = self._open_sidecar(npz_path)
+        if frames is not None:
+            return frames, 'frames'
+        cached = self.frame_cache.peek(npz_path)
+        if cached is not None:
+            return cached
+        stream = NpzFrameStream(npz_path, self.chunk_bytes)
+        if stream.streamable and stream.nbytes >= self.stream_min_bytes:
+            with self._lock:
+                self.streamed += 1
+            if self.auto_ingest:
+                self._ingest_in_background(npz_path)
+            return stream, stream.frames_key
+        return self._decode(npz_path)
+
+    def unit_range(self, npz_path: str, frames: FrameSource) -> Optional[bool]:
+        """npz_stream.unit_range of a clip opened from npz_path, scanned once per version of the file.
+
+        Per-frame readers (/api/frame, /api/frames) pass it to clip_to_bgr so a
+        float frame is scaled exactly as in the clip's MP4 and its neighbours.
+        """
+        if frames.dtype != np.float32 and frames.dtype != np.float64:
+            return None
+        st = os.stat(npz_path)
+        key = (os.path.abspath(npz_path), st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if key in self._unit_ranges:
+                self._unit_ranges.move_to_end(key)
+                return self._unit_ranges[key]
+        value = unit_range(frames)
+        with self._lock:
+            self._unit_ranges[key] = value
+            while len(self._unit_ranges) > MAX_UNIT_RANGES:
+                self._unit_ranges.popitem(last=False)
+        return value
+
+    def ingest(self, npz_path: str, force: bool = False, frames: Optional[np.ndarray] = None) -> str:
+        """Write the frames sidecar for an NPZ file (no-op if already fresh) and return its path"""
+        npz_path = os.path.abspath(npz_path)
+        if not force:
+            sidecar = self._fresh_sidecar(npz_path)
+            if sidecar is not None:
+                return sidecar
+
+        source_mtime_ns = os.stat(npz_path).st_mtime_ns
+        sidecar = self.sidecar_path(npz_path)
+        fd, tmp_path = tempfile.mkstemp(prefix='.ingest-', suffix='.npy', dir=os.path.dirname(sidecar))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if frames is not None:
+                    np.save(f, frames, allow_pickle=False)
+                    nbytes = frames.nbytes
+                else:
+                    # The .npy member already is the sidecar: inflate it straight to disk in chunks
+                    stream = NpzFrameStream(npz_path)
+                    if stream.dtype.hasobject:
+                        raise ValueError("Object arrays cannot be stored as frame sidecars")
+                    with zipfile.ZipFile(npz_path) as zf, zf.open(stream.member) as src:
+                        shutil.copyfileobj(src, f, COPY_CHUNK_BYTES)
+                    nbytes = stream.nbytes
+            # Stamp with the source mtime; this is what marks the sidecar as fresh
+            os.utime(tmp_path, ns=(source_mtime_ns, source_mtime_ns))
+            os.replace(tmp_path, sidecar)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self.ingested += 1
+        logger.info(f"Frame store: ingested {npz_path} -> {sidecar} ({nbytes} bytes)")
+        return sidecar
+
+    def _ingest_in_background(self, npz_path: str, frames: Optional[np.ndarray] = None):
+        abs_path = os.path.abspath(npz_path)
+        with self._lock:
+            if abs_path in self._ingesting:
+                return
+            self._ingesting.add(abs_path)
+
+        def run():
+            try:
+                self.ingest(abs_path, frames=frames)
+            except Exception as e:
+                logger.warning(f"Frame store: auto-ingest failed for {abs_path}: {e}")
+            finally:
+                with self._lock:
+                    self._ingesting.discard(abs_path)
+
+        threading.Thread(target=run, name='frame-store-ingest', daemon=True).start()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sidecar_dir": self.sidecar_dir,
+                "auto_ingest": self.auto_ingest,
+                "mmap_opens": self.mmap_opens,
+                "fallbacks": self.fallbacks,
+                "streamed": self.streamed,
+                "stream_min_bytes": self.stream_min_bytes,
+                "ingested": self.ingested,
+                "ingesting": len(self._ingesting),
+            }
+
+
+def iter_npz_paths(targets: List[str], recursive: bool = True):
+    """Yield NPZ files from a mix of file and directory arguments"""
+    for target in targets:
+        if os.path.isdir(target):
+            if recursive:
+                for dirpath, _, filenames in os.walk(target):
+                    for fname in sorted(filenames):
+                        if fname.lower().endswith('.npz'):
+                            yield os.path.join(dirpath, fname)
+            else:
+                for fname in sorted(os.listdir(target)):
+                    full = os.path.join(target, fname)
+                    if os.path.isfile(full) and fname.lower().endswith('.npz'):
+                        yield full
+        elif target.lower().endswith('.npz'):
+            yield target
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest NPZ clips into memory-mappable .npy sidecars")
+    parser.add_argument('targets', nargs='+', help="NPZ files or directories to ingest")
+    parser.add_argument('--force', action='store_true', help="Rewrite sidecars even if they are fresh")
+    parser.add_argument('--sidecar-dir', default=os.environ.get('FRAME_STORE_DIR') or None,
+                        help="Write sidecars here instead of next to the NPZ files")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    store = FrameStore(FrameCache(0), sidecar_dir=args.sidecar_dir)
+    failures = 0
+    for npz_path in iter_npz_paths(args.targets):
+        try:
+            print(f"✅ {npz_path} -> {store.ingest(npz_path, force=args.force)}")
+        except Exception as e:
+            failures += 1
+            print(f"❌ {npz_path}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+"""
+Asynchronous convert / preprocess jobs on a pool of worker processes
+
+POST /api/jobs queues an NPZ -> MP4 conversion (what /api/convert-npz does)
+or a preprocess-and-encode run (the mp4_blob output of /api/preprocess) and
+returns a job id immediately; the client polls GET /api/jobs/<id> for its
+state and progress (frames encoded of total) and fetches the finished MP4
+from /api/jobs/<id>/result.
+
+Jobs run in JOB_WORKERS spawned processes, so long encodes neither hold the
+request threads nor compete with them for the GIL. A worker encodes into a
+temp file the server created in the transcode cache directory; the server
+publishes it through its own TranscodeCache, which keeps the only LRU index
+and enforces the byte budget, so a finished convert job is also a cache hit
+for /api/convert-npz. Submissions whose cache key matches a queued, running
+or still-cached job return that job instead of encoding the clip again, and a
+convert job takes the cache's single-flight slot (TranscodeCache.claim), so it
+waits for a /api/convert-npz request already encoding the clip and vice versa.
+
+Workers report progress over a multiprocessing queue. If JOB_NOTIFY_URL is
+set (the websocket sidecar's /notify/jobs), every finished job is POSTed
+there and pushed to the connected browsers as a "job_update" event.
+
+Job state lives in the server process that accepted the submission.
+"""
+
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import cv2
+
+from frame_cache import FrameCache
+from frame_store import FrameStore
+from lazy_start import LazyStart
+from preprocess_pipeline import PreprocessPipeline
+from renditions import clip_dimensions, iter_bgr_frames
+from transcode_cache import TranscodeCache
+
+logger = logging.getLogger(__name__)
+
+JOB_KINDS = ('convert', 'preprocess')
+DEFAULT_WORKERS = 1
+DEFAULT_MAX_QUEUE = 32
+DEFAULT_MAX_FRAMES = 30
+MAX_JOB_HISTORY = 200
+PROGRESS_INTERVAL_SECONDS = 0.25
+NOTIFY_TIMEOUT_SECONDS = 5.0
+
+# /api/preprocess options that do not change the encoded frames (fps and preset are part of the key already)
+_OUTPUT_OPTIONS = ('format', 'transport', 'fps', 'preset')
+
+
+class JobQueueFull(RuntimeError):
+    """Raised when a submission would exceed JOB_MAX_QUEUE queued and running jobs"""
+
+
+class Job:
+    """State of one asynchronous job as seen by the server process"""
+
+    def __init__(self, job_id: str, kind: str, npz_path: str, key: str, fps: float, codec: str, options: dict):
+        self.id = job_id
+        self.kind = kind
+        self.path = npz_path
+        self.key = key
+        self.fps = fps
+        self.codec = codec
+        self.options = options
+        self.state = "queued"
+        self.phase: Optional[str] = None
+        self.done = 0
+        self.total = 0
+        self.submissions = 1
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        data = {
+            "id": self.id,
+            "kind": self.kind,
+            "path": self.path,
+            "state": self.state,
+            "phase": self.phase,
+            "done": self.done,
+            "total": self.total,
+            "progress": 1.0 if self.state == "done" else (round(self.done / self.total, 3) if self.total else 0.0),
+            "fps": self.fps,
+            "video_encoder": self.codec,
+            "submissions": self.submissions,
+            "created_at": self.created_at,
+            "elapsed_s": round((self.finished_at or time.time()) - self.created_at, 2),
+        }
+        if self.kind == 'preprocess':
+            data["options"] = self.options
+        if self.result is not None:
+            data["result"] = self.result
+            data["result_url"] = f"/api/jobs/{self.id}/result"
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+# ------------------------------------------------------------------ worker side
+
+# Per-process state of a pool worker, set up by _init_worker
+_worker: dict = {}
+
+
+def _init_worker(progress):
+    _worker['progress'] = progress
+    # No decoded-frame cache in the workers: each job reads its clip once
+    _worker['frame_store'] = FrameStore.from_env(FrameCache(0))
+
+
+def _report(job_id: str, phase: str, done: int, total: int):
+    _worker['progress'].put((job_id, phase, done, total))
+
+
+def _counted(job_id: str, frames: Iterable, total: int) -> Iterator:
+    """Pass frames through to the encoder, reporting how many were consumed at most every PROGRESS_INTERVAL_SECONDS"""
+    last = time.monotonic()
+    done = 0
+    for frame in frames:
+        yield frame
+        done += 1
+        now = time.monotonic()
+        if now - last >= PROGRESS_INTERVAL_SECONDS:
+            _report(job_id, 'encode', done, total)
+            last = now
+    _report(job_id, 'encode', done, total)
+
+
+def _gray_to_bgr(frames) -> Iterator:
+    for frame in frames:
+        if frame.shape[-1] == 1:
+            yield cv2.cvtColor(frame.squeeze(-1), cv2.COLOR_GRAY2BGR)
+        else:
+            yield frame
+
+
+def _run_job(job_id: str, kind: str, npz_path: str, tmp_path: str, fps: float, encoder, options: dict) -> dict:
+    """Load, transform and encode one clip into tmp_path (runs in a pool worker; the server publishes it)"""
+    _report(job_id, 'load', 0, 0)
+    frames, _ = _worker['frame_store'].open_stream(npz_path)
+    info = {}
+    if kind == 'convert':
+        total, height, width = clip_dimensions(frames)
+        bgr_frames = iter_bgr_frames(frames)
+    else:
+        _report(job_id, 'transform', 0, 0)
+        max_frames = options.get('max_frames', DEFAULT_MAX_FRAMES)
+        result = PreprocessPipeline.compile(options).run(frames, keep=max_frames)
+        display_frames = result.frames[:min(max_frames, len(result.frames))]
+        total = len(display_frames)
+        if not total:
+            raise ValueError("Preprocessing left no frames to encode")
+        height, width = display_frames.shape[1:3]
+        bgr_frames = _gray_to_bgr(display_frames)
+        info = {
+            "processed_shape": list(result.shape),
+            "display_frames": total,
+            "processing_steps": result.steps,
+            "stats": result.stats,
+        }
+
+    _report(job_id, 'encode', 0, total)
+    encoder.write_file(_counted(job_id, bgr_frames, total), fps, width, height, tmp_path)
+    return {"frames": total, "resolution": f"{width}x{height}", **info}
+
+
+# ------------------------------------------------------------------ server side
+
+class JobManager:
+    """Bounded queue of convert/preprocess jobs executed by a spawned process pool"""
+
+    def __init__(self, cache: TranscodeCache, workers: int = DEFAULT_WORKERS, max_queue: int = DEFAULT_MAX_QUEUE,
+                 notify_url: Optional[str] = None, notify_token: Optional[str] = None):
+        self.cache = cache
+        self.workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.notify_url = notify_url or None
+        self.notify_token = notify_token or None
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._by_key: Dict[str, Job] = {}
+        self._ids = itertools.count(1)
+        self._pool: LazyStart[ProcessPoolExecutor] = LazyStart(self._start_pool)
+        self._progress = None
+        self._drainer: Optional[threading.Thread] = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.failed = 0
+        self.notify_errors = 0
+
+    @classmethod
+    def from_env(cls, cache: TranscodeCache) -> "JobManager":
+        """Build a manager from JOB_WORKERS / JOB_MAX_QUEUE / JOB_NOTIFY_URL / JOB_NOTIFY_TOKEN"""
+        try:
+            workers = int(os.environ.get('JOB_WORKERS') or DEFAULT_WORKERS)
+            max_queue = int(os.environ.get('JOB_MAX_QUEUE') or DEFAULT_MAX_QUEUE)
+        except ValueError:
+            logger.warning("Invalid JOB_WORKERS/JOB_MAX_QUEUE, using defaults")
+            workers, max_queue = DEFAULT_WORKERS, DEFAULT_MAX_QUEUE
+        return cls(cache, workers, max_queue, os.environ.get('JOB_NOTIFY_URL'), os.environ.get('JOB_NOTIFY_TOKEN'))
+
+    @staticmethod
+    def job_options(kind: str, options: Optional[dict]) -> dict:
+        """Options a job is run (and keyed) with: preprocess options minus output-only settings"""
+        if kind == 'convert':
+            return {}
+        options = {k: v for k, v in (options or {}).items() if k not in _OUTPUT_OPTIONS}
+        if options.get('profile') is not None:
+            raise ValueError("Preprocess jobs start from the native frames; 'profile' is not supported")
+        options.pop('profile', None)
+        try:
+            options['max_frames'] = int(options.get('max_frames', DEFAULT_MAX_FRAMES))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid 'max_frames' option")
+        if options['max_frames'] < 1:
+            raise ValueError("Invalid 'max_frames' option")
+        # Fail on bad options now rather than in the worker
+        PreprocessPipeline.compile(options)
+        return options
+
+    def key_for(self, kind: str, npz_path: str, codec: str, fps: float, options: dict) -> str:
+        # Convert jobs share the /api/convert-npz key, so either one warms the other
+        if kind == 'convert':
+            return self.cache.make_key(npz_path, codec, fps)
+        return self.cache.make_key(npz_path, codec, fps, job='preprocess',
+                                   options=json.dumps(options, sort_keys=True))
+
+    def submit(self, kind: str, npz_path: str, encoder, fps: float, options: Optional[dict] = None) -> Tuple[Job, bool]:
+        """Queue a job, or return the job already producing this artifact.
+
+        Returns (job, created). Raises ValueError for bad arguments and
+        JobQueueFull when JOB_MAX_QUEUE jobs are already queued or running.
+        """
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind '{kind}', expected one of {list(JOB_KINDS)}")
+        npz_path = os.path.abspath(npz_path)
+        options = self.job_options(kind, options)
+        key = self.key_for(kind, npz_path, encoder.name, fps, options)
+
+        future = tmp_path = None
+        waiting = False
+        with self._lock:
+            # Not counted as a cache hit or miss: no client looked the artifact up
+            cached = self.cache.get(key, count=False) is not None
+            existing = self._by_key.get(key)
+            if existing is not None and (not existing.finished or (existing.state == "done" and cached)):
+                existing.submissions += 1
+                self.coalesced += 1
+                return existing, False
+
+            job = Job(f"j{next(self._ids)}", kind, npz_path, key, fps, encoder.name, options)
+            if not cached:
+                active = sum(1 for j in self._jobs.values() if not j.finished)
+                if active >= self.max_queue:
+                    raise JobQueueFull(f"Job queue is full ({active} of {self.max_queue} jobs queued or running)")
+                # Share the single-flight slot with /api/convert-npz requests for the same key
+                path, tmp_path = self.cache.claim(key, wait=False)
+                cached = path is not None
+                waiting = not cached and tmp_path is None
+            if cached:
+                # Encoded earlier (by a request, a previous job or another server process)
+                self._mark_cached_locked(job)
+            elif tmp_path is not None:
+                future = self._submit_locked(job, tmp_path, encoder)
+            else:
+                job.phase = 'wait'
+            self.submitted += 1
+            self._jobs[job.id] = job
+            self._by_key[key] = job
+            self._trim_locked()
+        if future is not None:
+            # Outside the lock: the callback runs right here if the job already finished
+            future.add_done_callback(lambda f, job=job, tmp_path=tmp_path: self._finish(job, tmp_path, f))
+        elif waiting:
+            # A request (or another job's key) is already encoding this clip: wait for its publish
+            threading.Thread(target=self._wait_for_build, args=(job, encoder), name='job-wait', daemon=True).start()
+        logger.info(f"Job {job.id}: {kind} {npz_path} ({job.state})")
+        return job, True
+
+    def _submit_locked(self, job: Job, tmp_path: str, encoder):
+        args = (_run_job, job.id, job.kind, job.path, tmp_path, job.fps, encoder, job.options)
+        try:
+            try:
+                return self._pool.get().submit(*args)
+            except BrokenProcessPool:
+                self._reset_pool_locked()
+                return self._pool.get().submit(*args)
+        except BaseException:
+            self.cache.discard(tmp_path)
+            raise
+
+    @staticmethod
+    def _mark_cached_locked(job: Job):
+        job.state = "done"
+        job.finished_at = time.time()
+        job.result = {"cached": True}
+
+    def _wait_for_build(self, job: Job, encoder):
+        path, tmp_path = self.cache.claim(job.key)
+        future = None
+        with self._lock:
+            job.phase = None
+            if path is not None:
+                self._mark_cached_locked(job)
+                self.completed += 1
+            else:
+                # The other build failed: this job encodes the clip itself
+                try:
+                    future = self._submit_locked(job, tmp_path, encoder)
+                except Exception as e:
+                    job.state = "failed"
+                    job.finished_at = time.time()
+                    job.error = str(e) or type(e).__name__
+                    self.failed += 1
+        if future is not None:
+            future.add_done_callback(lambda f: self._finish(job, tmp_path, f))
+            return
+        if job.state == "done":
+            logger.info(f"Job {job.id}: served by a concurrent encode of {job.path}")
+        else:
+            logger.warning(f"Job {job.id}: {job.kind} {job.path} failed: {job.error}")
+        self._notify(job)
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        # spawn: workers must not inherit the server's threads and locks (and it is the only option on Windows)
+        context = multiprocessing.get_context('spawn')
+        if self._progress is None:
+            self._progress = context.Queue()
+            self._drainer = threading.Thread(target=self._drain_progress, name='job-progress', daemon=True)
+            self._drainer.start()
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_init_worker,
+                                   initargs=(self._progress,))
+
+    def _reset_pool_locked(self):
+        pool = self._pool.reset()
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _drain_progress(self):
+        while True:
+            job_id, phase, done, total = self._progress.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.finished:
+                    continue
+                if job.state == "queued":
+                    job.state = "running"
+                    job.started_at = time.time()
+                job.phase = phase
+                job.done = done
+                job.total = total
+
+    def _finish(self, job: Job, tmp_path: str, future):
+        error = future.exception()
+        result = None
+        if error is None:
+            try:
+                path = self.cache.publish(job.key, tmp_path)
+                result = {**future.result(), "bytes": os.path.getsize(path)}
+            except OSError as e:
+                error = e
+        if error is not None:
+            self.cache.discard(tmp_path)
+        with self._lock:
+            job.finished_at = time.time()
+            job.phase = None
+            if error is None:
+                job.state = "done"
+                job.result = result
+                job.done = job.total = result["frames"]
+                self.completed += 1
+            else:
+                job.state = "failed"
+                job.error = str(error) or type(error).__name__
+                self.failed += 1
+                if isinstance(error, BrokenProcessPool):
+                    # A worker died (e.g. killed for memory); the next submission starts a fresh pool
+                    self._reset_pool_locked()
+        if error is None:
+            logger.info(f"Job {job.id}: finished in {job.finished_at - job.created_at:.1f} s")
+        else:
+            logger.warning(f"Job {job.id}: {job.kind} {job.path} failed: {job.error}")
+        self._notify(job)
+
+    def _trim_locked(self):
+        while len(self._jobs) > MAX_JOB_HISTORY:
+            oldest = next(iter(self._jobs.values()))
+            if not oldest.finished:
+                break
+            del self._jobs[oldest.id]
+            if self._by_key.get(oldest.key) is oldest:
+                del self._by_key[oldest.key]
+
+    def _notify(self, job: Job):
+        if not self.notify_url:
+            return
+        threading.Thread(target=self._post_event, args=({"event": "job_update", "job": job.to_dict()},),
+                         name='job-notify', daemon=True).start()
+
+    def _post_event(self, event: dict):
+        headers = {'Content-Type': 'application/json'}
+        if self.notify_token:
+            headers['X-Notify-Token'] = self.notify_token
+        body = json.dumps(event).encode('utf-8')
+        try:
+            with urllib.request.urlopen(urllib.request.Request(self.notify_url, data=body, headers=headers),
+                                        timeout=NOTIFY_TIMEOUT_SECONDS):
+                pass
+        except Exception as e:
+            with self._lock:
+                self.notify_errors += 1
+            logger.warning(f"Job notification to {self.notify_url} failed: {e}")
+
+    def job(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+            return {
+                "workers": self.workers,
+                "started": self._pool.started,
+                "queued": sum(1 for j in jobs if j.state == "queued"),
+                "running": sum(1 for j in jobs if j.state == "running"),
+                "max_queue": self.max_queue,
+                "submitted": self.submitted,
+                "coalesced": self.coalesced,
+                "completed": self.completed,
+                "failed": self.failed,
+                "notify": bool(self.notify_url),
+                "notify_errors": self.notify_errors,
+                "jobs": [job.to_dict() for job in reversed(jobs)],
+            }
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Start-on-first-use holder for worker pools and background threads
+
+The backend's singletons are built when app.py is imported, and gunicorn
+imports the app before forking its server workers. Threads started at that
+point do not survive the fork and processes spawned there would be repeated
+in every server worker, so pools and background threads are wrapped in a
+LazyStart and only started by the first request that needs them.
+"""
+
+import threading
+from typing import Callable, Generic, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class LazyStart(Generic[T]):
+    """Calls factory() on the first get() and hands out the same result until reset()"""
+
+    def __init__(self, factory: Callable[[], T]):
+        self._factory = factory
+        self._value: Optional[T] = None
+        self._lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._value is not None
+
+    def get(self) -> T:
+        value = self._value
+        if value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+                value = self._value
+        return value
+
+    def reset(self) -> Optional[T]:
+        """Forget the started value (e.g. a broken pool) and return it; the next get() starts a new one"""
+        with self._lock:
+            value, self._value = self._value, None
+        return value
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Request metrics and per-request profiling
+
+Endpoints wrap their hot paths in named spans (load, key, transform, encode,
+send, ...). Every span and every request is recorded in a latency histogram
+labelled by route, and request/response bytes are counted per route. The
+registry renders everything, plus the numeric stats of the caches registered
+as collectors, in the Prometheus text format for /api/metrics.
+
+Spans are attached to the current request through a context variable, so a
+request sent with "X-Profile: 1" can get its own breakdown back in a
+Server-Timing header. Work that runs on other threads (the frame executor)
+passes the request profile explicitly. Spans that finish after the headers
+were sent (streamed bodies) still reach the histograms but not the header.
+A streamed request is recorded when the server closes its body, so its
+duration, "send" span and response bytes include the streaming.
+"""
+
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Seconds; Prometheus default buckets extended to cover long encodes
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PREFIX = 'echopilot'
+
+
+class Histogram:
+    """Cumulative-bucket histogram (one per label set)"""
+
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.total += seconds
+        self.count += 1
+
+
+class RequestProfile:
+    """Spans recorded while one request is handled"""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+        self.bytes_sent = 0
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: one entry per span name (summed), then the total"""
+        totals: "OrderedDict[str, List[float]]" = OrderedDict()
+        for name, seconds in list(self.spans):
+            entry = totals.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+        parts = []
+        for name, (seconds, count) in totals.items():
+            desc = f';desc="{count}x"' if count > 1 else ''
+            parts.append(f"{name}{desc};dur={seconds * 1000.0:.1f}")
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000.0:.1f}")
+        return ', '.join(parts)
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar('echopilot_request_profile', default=None)
+
+
+class Metrics:
+    """Histograms and byte counters by route, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: Dict[Tuple[str, str, str], Histogram] = {}
+        self._spans: Dict[Tuple[str, str], Histogram] = {}
+        self._bytes_in: Dict[str, int] = {}
+        self._bytes_out: Dict[str, int] = {}
+        # name -> (stats function, names of its monotonic counter fields)
+        self._collectors: "OrderedDict[str, Tuple[Callable[[], dict], frozenset]]" = OrderedDict()
+
+    # -------------------------------------------------------------- requests
+
+    def begin_request(self, route: str) -> RequestProfile:
+        profile = RequestProfile(route)
+        _current.set(profile)
+        return profile
+
+    @staticmethod
+    def current() -> Optional[RequestProfile]:
+        return _current.get()
+
+    def end_request(self, profile: RequestProfile, method: str, status: int,
+                    bytes_in: Optional[int], bytes_out: Optional[int]):
+        seconds = time.perf_counter() - profile.started
+        with self._lock:
+            self._requests.setdefault((profile.route, method, str(status)), Histogram()).observe(seconds)
+            if bytes_in:
+                self._bytes_in[profile.route] = self._bytes_in.get(profile.route, 0) + bytes_in
+            if bytes_out:
+                self._bytes_out[profile.route] = self._bytes_out.get(profile.route, 0) + bytes_out
+
+    # -------------------------------------------------------------- spans
+
+    def observe_span(self, name: str, seconds: float, profile: Optional[RequestProfile] = None):
+        profile = profile or _current.get()
+        route = profile.route if profile else 'background'
+        if profile is not None:
+            profile.spans.append((name, seconds))
+        with self._lock:
+            self._spans.setdefault((route, name), Histogram()).observe(seconds)
+
+    @contextmanager
+    def span(self, name: str, profile: Optional[RequestProfile] = None):
+        """Time the block as span `name` of the current (or given) request"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_span(name, time.perf_counter() - t0, profile)
+
+    def timed_iter(self, name: str, items: Iterable, profile: Optional[RequestProfile] = None) -> Iterator:
+        """Yield from items, recording the time spent producing them as one span"""
+        profile = profile or _current.get()
+        elapsed = 0.0
+        iterator = iter(items)
+        try:
+            while True:
+                t0 = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - t0
+                yield item
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+            self.observe_span(name, elapsed, profile)
+
+    def count_stream(self, body: Iterable[bytes], profile: RequestProfile) -> Iterator[bytes]:
+        """Pass a generated response body through, adding its size to profile.bytes_sent"""
+        try:
+            for chunk in body:
+                profile.bytes_sent += len(chunk)
+                yield chunk
+        finally:
+            close = getattr(body, 'close', None)
+            if close is not None:
+                close()
+
+    def end_streamed_request(self, profile: RequestProfile, method: str, status: int,
+                             bytes_in: Optional[int], bytes_out: Optional[int], headers_sent: float):
+        """end_request for a streamed body, called once the server has closed it: the request's
+        duration covers the whole body and the time since the headers is its "send" span"""
+        self.observe_span('send', time.perf_counter() - headers_sent, profile)
+        self.end_request(profile, method, status, bytes_in,
+                         bytes_out if bytes_out is not None else profile.bytes_sent)
+
+    # -------------------------------------------------------------- export
+
+    def register_collector(self, name: str, stats: Callable[[], dict], counters: Iterable[str] = ()):
+        """Export the numeric top-level values of stats() as <prefix>_<name>_<key>.
+
+        Keys listed in counters only ever grow (hits, evictions, completed
+        jobs, ...) and are exported as counters named <prefix>_<name>_<key>_total;
+        the rest are gauges.
+        """
+        self._collectors[name] = (stats, frozenset(counters))
+
+    @staticmethod
+    def _labels(**labels) -> str:
+        return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + '}'
+
+    def _histogram_lines(self, metric: str, series: Dict[tuple, Histogram], label_names: Tuple[str, ...]) -> List[str]:
+        lines = [f"# TYPE {metric} histogram"]
+        for key, hist in sorted(series.items()):
+            labels = dict(zip(label_names, key))
+            cumulative = 0
+            for bound, count in zip(BUCKETS, hist.counts):
+                cumulative += count
+                lines.append(f"{metric}_bucket{self._labels(**labels, le=f'{bound:g}')} {cumulative}")
+            lines.append(f"{metric}_bucket{self._labels(**labels, le='+Inf')} {hist.count}")
+            lines.append(f"{metric}_sum{self._labels(**labels)} {hist.total:.6f}")
+            lines.append(f"{metric}_count{self._labels(**labels)} {hist.count}")
+        return lines
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)"""
+        with self._lock:
+            requests = {k: _copy(h) for k, h in self._requests.items()}
+            spans = {k: _copy(h) for k, h in self._spans.items()}
+            bytes_in = dict(self._bytes_in)
+            bytes_out = dict(self._bytes_out)
+
+        lines = [f"# HELP {PREFIX}_request_duration_seconds Request latency by route, method and status"]
+        lines += self._histogram_lines(f"{PREFIX}_request_duration_seconds", requests, ('route', 'method', 'status'))
+        lines.append(f"# HELP {PREFIX}_span_duration_seconds Time spent in named stages of a request")
+        lines += self._histogram_lines(f"{PREFIX}_span_duration_seconds", spans, ('route', 'span'))
+        for metric, values, help_text in ((f"{PREFIX}_request_bytes_total", bytes_in, "Request body bytes"),
+                                          (f"{PREFIX}_response_bytes_total", bytes_out, "Response body bytes")):
+            lines.append(f"# HELP {metric} {help_text} by route")
+            lines.append(f"# TYPE {metric} counter")
+            lines += [f"{metric}{self._labels(route=route)} {size}" for route, size in sorted(values.items())]
+
+        for name, (stats, counters) in list(self._collectors.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                lines.append(f"# collector {name} failed: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                help_text = f"{name} {key}".replace('_', ' ').capitalize()
+                if key in counters:
+                    metric = f"{PREFIX}_{name}_{key}_total"
+                    lines.append(f"# HELP {metric} {help_text} since the server process started")
+                    lines.append(f"# TYPE {metric} counter")
+                else:
+                    metric = f"{PREFIX}_{name}_{key}"
+                    lines.append(f"# HELP {metric} {help_text}")
+                    lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _copy(hist: Histogram) -> Histogram:
+    clone = Histogram()
+    clone.counts = list(hist.counts)
+    clone.total = hist.total
+    clone.count = hist.count
+    return clone
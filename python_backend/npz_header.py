@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Header-only NPZ inspection
+
+Reads shape/dtype/order from the .npy header of every member and the sizes
+from the zip central directory, without decompressing any array data. Only
+the first few hundred bytes of each member are inflated, so the cost does
+not depend on clip length.
+"""
+
+import zipfile
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy.lib import format as npy_format
+
+_COMPRESSION_NAMES = {
+    zipfile.ZIP_STORED: "stored",
+    zipfile.ZIP_DEFLATED: "deflated",
+    zipfile.ZIP_BZIP2: "bzip2",
+    zipfile.ZIP_LZMA: "lzma",
+}
+
+
+def read_npy_header(fp) -> Tuple[tuple, bool, np.dtype]:
+    version = npy_format.read_magic(fp)
+    if version == (1, 0):
+        return npy_format.read_array_header_1_0(fp)
+    if version == (2, 0):
+        return npy_format.read_array_header_2_0(fp)
+    # Format 3.0 (utf-8 field names) has no public reader
+    return npy_format._read_array_header(fp, version)
+
+
+def read_npz_headers(npz_path: str) -> Tuple[List[str], Dict[str, dict]]:
+    """Return (keys, key -> metadata) for an NPZ file using only member headers.
+
+    Keys follow np.load's naming: the '.npy' suffix is stripped from array members.
+    """
+    keys: List[str] = []
+    key_to_meta: Dict[str, dict] = {}
+    with zipfile.ZipFile(npz_path) as zf:
+        for info in zf.infolist():
+            name = info.filename
+            key = name[:-4] if name.endswith('.npy') else name
+            keys.append(key)
+            meta = {
+                "compressed_bytes": int(info.compress_size),
+                "uncompressed_bytes": int(info.file_size),
+                "compression": _COMPRESSION_NAMES.get(info.compress_type, str(info.compress_type)),
+            }
+            if name.endswith('.npy'):
+                try:
+                    with zf.open(info) as fp:
+                        shape, fortran_order, dtype = read_npy_header(fp)
+                    meta.update({
+                        "shape": tuple(int(x) for x in shape),
+                        "dtype": str(dtype),
+                        "ndim": len(shape),
+                        "fortran_order": bool(fortran_order),
+                    })
+                except Exception as e:
+                    meta["error"] = f"Failed to read header: {str(e)}"
+            key_to_meta[key] = meta
+    return keys, key_to_meta
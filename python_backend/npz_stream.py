@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Chunked decoding of the frames array inside an NPZ file
+
+np.load(...)[key] inflates the whole .npy member before returning, so a long
+clip costs its full decoded size (plus every full-size copy made afterwards)
+for the duration of a request. NpzFrameStream reads the .npy header, then
+inflates the member incrementally and yields frame-first chunks of about
+NPZ_STREAM_CHUNK_BYTES, so peak memory follows the chunk size instead of the
+clip length. Frames before a requested start are inflated and discarded;
+nothing after the requested stop is inflated at all.
+
+Only C-ordered members with frames on the first axis can be cut into frame
+chunks; FrameStore.open_stream decodes other layouts whole as before.
+"""
+
+import zipfile
+from typing import Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from frame_cache import NoFramesError, find_frames_key
+from npz_header import read_npy_header
+
+DEFAULT_CHUNK_BYTES = 32 * 1024 ** 2  # 32 MiB
+READ_BYTES = 1024 ** 2
+
+
+def frames_first(frames: np.ndarray) -> np.ndarray:
+    """View of a 3D clip with frames on the first axis ((height, width, frames) is transposed)"""
+    if frames.ndim == 3 and frames.shape[0] > frames.shape[2]:
+        return np.transpose(frames, (2, 0, 1))
+    return frames
+
+
+class NpzFrameStream:
+    """Frames array of an NPZ file, inflated a chunk of frames at a time.
+
+    Opening reads only the zip directory and the .npy header. Every call to
+    iter_chunks inflates the member again from the start, so a clip can be
+    scanned more than once (e.g. a max() pass before converting floats).
+    """
+
+    def __init__(self, npz_path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES):
+        self.path = npz_path
+        self.chunk_bytes = max(1, int(chunk_bytes))
+        with zipfile.ZipFile(npz_path) as zf:
+            names = zf.namelist()
+            frames_key = find_frames_key([n[:-4] if n.endswith('.npy') else n for n in names])
+            if frames_key is None:
+                raise NoFramesError("No data found in NPZ file")
+            self.frames_key = frames_key
+            self.member = frames_key + '.npy' if frames_key + '.npy' in names else frames_key
+            with zf.open(self.member) as fp:
+                shape, fortran_order, dtype = read_npy_header(fp)
+                self._data_offset = fp.tell()
+        self.shape: Tuple[int, ...] = tuple(int(x) for x in shape)
+        self.dtype = np.dtype(dtype)
+        self.fortran_order = bool(fortran_order)
+        self.ndim = len(self.shape)
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape, dtype=np.int64)) * self.dtype.itemsize
+
+    @property
+    def streamable(self) -> bool:
+        """True if frames are contiguous, consecutive runs of the member (C order, frames first)"""
+        if self.fortran_order or self.dtype.hasobject or self.ndim not in (3, 4):
+            return False
+        return not (self.ndim == 3 and self.shape[0] > self.shape[2])
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    @property
+    def frame_bytes(self) -> int:
+        return int(np.prod(self.shape[1:], dtype=np.int64)) * self.dtype.itemsize
+
+    @property
+    def chunk_frames(self) -> int:
+        return max(1, self.chunk_bytes // max(1, self.frame_bytes))
+
+    def iter_chunks(self, start: int = 0, stop: Optional[int] = None, step: int = 1) -> Iterator[np.ndarray]:
+        """Yield entries start:stop:step of the first axis as fresh arrays of at most chunk_frames entries.
+
+        Each chunk gets its own buffer, so callers may keep references to
+        earlier chunks (e.g. frames still being encoded on another thread).
+        """
+        if self.fortran_order or self.dtype.hasobject or self.ndim < 1:
+            raise ValueError(f"Array of shape {self.shape} (fortran_order={self.fortran_order}, "
+                             f"dtype={self.dtype}) cannot be read in chunks along its first axis")
+        count = len(self)
+        start = min(max(0, start), count)
+        stop = count if stop is None else min(max(start, stop), count)
+        step = max(1, int(step))
+        frame_bytes = self.frame_bytes
+        per_chunk = self.chunk_frames
+        with zipfile.ZipFile(self.path) as zf, zf.open(self.member) as fp:
+            # Seeking forward inflates and discards; it never buffers the skipped frames
+            fp.seek(self._data_offset + start * frame_bytes)
+            position = start
+            while position < stop:
+                n = min(per_chunk, stop - position)
+                chunk = np.empty((n,) + self.shape[1:], dtype=self.dtype)
+                _read_exact(fp, memoryview(chunk.reshape(-1).view(np.uint8)))
+                # First frame of this chunk that lies on the start:stop:step grid
+                offset = (-(position - start)) % step
+                position += n
+                if offset < n:
+                    yield chunk[offset::step] if step > 1 else chunk
+
+    def read(self) -> np.ndarray:
+        """Inflate the whole array at once (what np.load would return)"""
+        with np.load(self.path) as data:
+            return data[self.frames_key]
+
+    def max(self, start: int = 0, stop: Optional[int] = None, step: int = 1):
+        """Maximum over the selected frames, computed one chunk at a time (None if no frames)"""
+        result = None
+        for chunk in self.iter_chunks(start, stop, step):
+            value = chunk.max()
+            result = value if result is None else max(result, value)
+        return result
+
+
+def _read_exact(fp, buffer: memoryview):
+    # Small reads keep ZipExtFile's intermediate bytes objects from growing to the chunk size
+    filled = 0
+    while filled < len(buffer):
+        data = fp.read(min(READ_BYTES, len(buffer) - filled))
+        if not data:
+            raise ValueError("NPZ member ended before the array data was complete")
+        buffer[filled:filled + len(data)] = data
+        filled += len(data)
+
+
+FrameSource = Union[np.ndarray, NpzFrameStream]
+
+
+def clip_length(frames: FrameSource) -> int:
+    """Number of frames of an array (any layout frames_first accepts) or a stream"""
+    return len(frames) if isinstance(frames, NpzFrameStream) else len(frames_first(frames))
+
+
+def frame_chunks(frames: FrameSource, start: int = 0, stop: Optional[int] = None, step: int = 1,
+                 chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> Iterator[np.ndarray]:
+    """Frame-first chunks of an in-memory/memory-mapped array or an NpzFrameStream.
+
+    Array chunks are views (a memmap only pages in the frames being used).
+    """
+    if isinstance(frames, NpzFrameStream):
+        yield from frames.iter_chunks(start, stop, step)
+        return
+    frames = frames_first(frames)[start:stop:step]
+    if frames.ndim == 0 or len(frames) == 0:
+        return
+    frame_bytes = max(1, frames[0].nbytes)
+    per_chunk = max(1, chunk_bytes // frame_bytes)
+    for i in range(0, len(frames), per_chunk):
+        yield frames[i:i + per_chunk]
+
+
+def unit_range(frames: FrameSource) -> Optional[bool]:
+    """Whether a float32/float64 clip lies in [0, 1], scanned chunk by chunk over the whole clip.
+
+    Only the channels that are encoded (the first three) are judged. None for
+    other dtypes. An NpzFrameStream costs an inflate pass.
+    """
+    if frames.dtype != np.float32 and frames.dtype != np.float64:
+        return None
+    for chunk in frame_chunks(frames):
+        if chunk.ndim == 4 and chunk.shape[-1] > 3:
+            chunk = chunk[..., :3]
+        if chunk.size and chunk.max() > 1.0:
+            return False
+    return True
+
+
+def take_frames(frames: FrameSource, indices: Sequence[int]) -> np.ndarray:
+    """Gather frames by index (sorted, unique indices) from an array or a single pass over a stream"""
+    if not isinstance(frames, NpzFrameStream):
+        return frames_first(frames)[np.asarray(indices)]
+    wanted = np.asarray(indices, dtype=np.int64)
+    out = np.empty((len(wanted),) + frames.shape[1:], dtype=frames.dtype)
+    if not len(wanted):
+        return out
+    filled = 0
+    position = 0
+    for chunk in frames.iter_chunks(0, int(wanted[-1]) + 1):
+        end = position + len(chunk)
+        while filled < len(wanted) and wanted[filled] < end:
+            out[filled] = chunk[wanted[filled] - position]
+            filled += 1
+        position = end
+    return out
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Compiled preprocessing pipeline for /api/preprocess
+
+The request options are compiled once into an ordered chain of stages. Each
+stage works on whole (frames, height, width, channels) arrays and writes into
+a buffer preallocated for the clip instead of building per-frame lists:
+
+  frame_range -> downsample -> layout -> resize -> to_uint8 -> contrast -> denoise -> stats
+
+Contrast/brightness is a 256-entry lookup table applied to uint8 data, and the
+statistics (including the effect of normalization, which is affine) are
+derived from a single histogram pass, so the clip is never cast to float.
+The per-frame OpenCV stages (resize, denoise) run on a FrameExecutor when one
+is given, writing each frame into its slot of the output buffer.
+
+Given an NpzFrameStream instead of an array, frame_range and downsample pick
+the frames to inflate and the remaining stages run one decoded chunk at a
+time; only the first `keep` processed frames are held, while the histogram
+behind the statistics still covers every frame.
+"""
+
+import time
+from collections import OrderedDict
+from functools import lru_cache, partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from frame_executor import FrameExecutor
+from npz_stream import FrameSource, NpzFrameStream
+
+# Frames processed per chunk when a stage needs a temporary buffer
+CHUNK_FRAMES = 32
+
+
+@lru_cache(maxsize=64)
+def _contrast_lut(contrast: float, brightness: float) -> np.ndarray:
+    """Map every uint8 value through x * contrast + brightness * 255, clipped to [0, 255]"""
+    values = np.arange(256, dtype=np.float32) * contrast + brightness * 255
+    lut = np.clip(values, 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
+
+
+def _frame_view(arr: np.ndarray, i: int) -> np.ndarray:
+    """2D view for single-channel frames (OpenCV drops the channel axis), 3D otherwise"""
+    return arr[i, :, :, 0] if arr.shape[-1] == 1 else arr[i]
+
+
+class PreprocessResult:
+    """Output of a pipeline run"""
+
+    def __init__(self, frames: np.ndarray, steps: List[dict], stats: Dict[str, float], scale: float, offset: float,
+                 shape: Optional[Tuple[int, ...]] = None):
+        self.frames = frames          # uint8, (frames, height, width, channels)
+        self.shape = tuple(shape or frames.shape)  # shape of the whole processed clip (frames may hold fewer)
+        self.steps = steps            # [{"stage", "step", "duration_ms"}, ...]
+        self.stats = stats            # min/max/mean/std after normalization
+        self._scale = scale
+        self._offset = offset
+
+    def to_float(self) -> np.ndarray:
+        """Materialize the normalized float32 clip (only needed for raw downloads)"""
+        out = self.frames.astype(np.float32)
+        out *= np.float32(self._scale)
+        out += np.float32(self._offset)
+        return out
+
+
+class PreprocessPipeline:
+    """Options compiled into a chain of (name, stage) callables"""
+
+    def __init__(self, options: dict, executor: Optional[FrameExecutor] = None):
+        self.options = options or {}
+        self.executor = executor
+
+        frame_range = self.options.get('frame_range')
+        self.frame_range = tuple(frame_range) if frame_range and len(frame_range) == 2 else None
+        self.downsample = self.options.get('downsample', 1)
+        resize = self.options.get('resize')
+        self.resize = tuple(resize) if resize and len(resize) == 2 else None
+        contrast = self.options.get('contrast', 1.0)
+        brightness = self.options.get('brightness', 0.0)
+        self.contrast, self.brightness = contrast, brightness
+        self.lut = _contrast_lut(float(contrast), float(brightness)) if contrast != 1.0 or brightness != 0.0 else None
+        self.denoise = self.options.get('denoise')
+        self.normalize = self.options.get('normalize')
+
+        stages: List[Tuple[str, Callable]] = []
+        if self.frame_range:
+            stages.append(('frame_range', self._frame_range))
+        if self.downsample > 1:
+            stages.append(('downsample', self._downsample))
+        stages.append(('layout', self._layout))
+        if self.resize:
+            stages.append(('resize', self._resize))
+        stages.append(('to_uint8', self._to_uint8))
+        if self.lut is not None:
+            stages.append(('contrast', self._contrast))
+        if self.denoise:
+            stages.append(('denoise', self._denoise))
+        self.stages = tuple(stages)
+
+    @classmethod
+    def compile(cls, options: Optional[dict], executor: Optional[FrameExecutor] = None) -> "PreprocessPipeline":
+        return cls(options or {}, executor)
+
+    def run(self, frames: FrameSource, keep: Optional[int] = None) -> PreprocessResult:
+        """Run every stage on a (possibly read-only or memory-mapped) frames array.
+
+        An NpzFrameStream is processed chunk by chunk; keep bounds how many of
+        its processed frames are returned (None keeps all of them).
+        """
+        if isinstance(frames, NpzFrameStream):
+            frames_first = frames.ndim == 3 or (frames.ndim == 4 and frames.shape[0] >= frames.shape[-1])
+            if frames_first and not frames.fortran_order:
+                return self._run_chunked(frames, keep)
+            # (height, width, channels, frames) needs the whole clip to transpose
+            frames = frames.read()
+        steps: List[dict] = []
+        arr = frames
+        for name, stage in self.stages:
+            # Buffers allocated by an earlier stage are private and may be rewritten in place
+            owned = arr is not frames and arr.base is None
+            t0 = time.perf_counter()
+            arr, message = stage(arr, owned)
+            if message:
+                steps.append(self._step(name, message, t0))
+
+        t0 = time.perf_counter()
+        stats, scale, offset, message = self._stats(self._histogram(arr))
+        steps.append(self._step('stats', message or "Computed stats", t0))
+        return PreprocessResult(arr, steps, stats, scale, offset)
+
+    def _run_chunked(self, stream: NpzFrameStream, keep: Optional[int]) -> PreprocessResult:
+        steps: List[dict] = []
+        start, stop, step = 0, len(stream), 1
+        if self.frame_range:
+            t0 = time.perf_counter()
+            start, stop = max(0, self.frame_range[0]), min(len(stream), self.frame_range[1])
+            steps.append(self._step('frame_range', f"Extracted frames {start}:{stop}", t0))
+        if self.downsample > 1:
+            step = self.downsample
+            steps.append(self._step('downsample', f"Downsampled by factor {self.downsample}", time.perf_counter()))
+
+        # The [0, 1] check of to_uint8 must see the whole selection, not one chunk
+        unit_range = None
+        if stream.dtype == np.float32 or stream.dtype == np.float64:
+            peak = stream.max(start, stop, step)
+            unit_range = peak is None or peak <= 1.0
+        chunk_stages = []
+        for name, stage in self.stages:
+            if name == 'layout':
+                stage = self._chunk_layout
+            elif name == 'to_uint8':
+                stage = partial(self._to_uint8, unit_range=unit_range)
+            elif name in ('frame_range', 'downsample'):
+                continue
+            chunk_stages.append((name, stage))
+
+        timings: "OrderedDict[str, List]" = OrderedDict()  # name -> [message, seconds]
+        hist = np.zeros(256, dtype=np.int64)
+        out: Optional[np.ndarray] = None
+        total = filled = 0
+        for chunk in stream.iter_chunks(start, stop, step):
+            arr = chunk
+            for name, stage in chunk_stages:
+                owned = arr is not chunk and arr.base is None
+                t0 = time.perf_counter()
+                arr, message = stage(arr, owned)
+                if message:
+                    timing = timings.setdefault(name, [message, 0.0])
+                    timing[1] += time.perf_counter() - t0
+            t0 = time.perf_counter()
+            hist += self._histogram(arr)
+            timing = timings.setdefault('stats', [None, 0.0])
+            timing[1] += time.perf_counter() - t0
+            if out is None:
+                selected = len(range(start, max(start, stop), step))
+                kept = selected if keep is None else min(max(0, keep), selected)
+                out = np.empty((kept,) + arr.shape[1:], dtype=np.uint8)
+            n = min(len(arr), len(out) - filled)
+            if n > 0:
+                out[filled:filled + n] = arr[:n]
+                filled += n
+            total += len(arr)
+        if out is None:
+            raise ValueError("No frames left after preprocessing")
+
+        stats_seconds = timings.pop('stats', [None, 0.0])[1]
+        for name, (message, seconds) in timings.items():
+            steps.append({"stage": name, "step": message, "duration_ms": round(seconds * 1000.0, 3)})
+        t0 = time.perf_counter() - stats_seconds
+        stats, scale, offset, message = self._stats(hist)
+        steps.append(self._step('stats', message or "Computed stats", t0))
+        return PreprocessResult(out, steps, stats, scale, offset, shape=(total,) + out.shape[1:])
+
+    @staticmethod
+    def _step(name: str, message: str, t0: float) -> dict:
+        return {
+            "stage": name,
+            "step": message,
+            "duration_ms": round((time.perf_counter() - t0) * 1000.0, 3),
+        }
+
+    def _for_each_frame(self, fn: Callable[[int], None], count: int):
+        if self.executor is None:
+            for i in range(count):
+                fn(i)
+        else:
+            self.executor.run_indexed(fn, count)
+
+    # ------------------------------------------------------------------ stages
+
+    def _frame_range(self, arr: np.ndarray, owned: bool):
+        start, end = max(0, self.frame_range[0]), min(len(arr), self.frame_range[1])
+        return arr[start:end], f"Extracted frames {start}:{end}"
+
+    def _downsample(self, arr: np.ndarray, owned: bool):
+        return arr[::self.downsample], f"Downsampled by factor {self.downsample}"
+
+    @staticmethod
+    def _chunk_layout(arr: np.ndarray, owned: bool):
+        # Chunks are frames-first already; a short chunk must not trip the transpose heuristic
+        return (arr[..., np.newaxis] if arr.ndim == 3 else arr), None
+
+    @staticmethod
+    def _layout(arr: np.ndarray, owned: bool):
+        # Ensure (frames, height, width, channels)
+        if arr.ndim == 3:
+            arr = arr[..., np.newaxis]
+        elif arr.ndim == 4 and arr.shape[0] < arr.shape[-1]:
+            # Probably (height, width, channels, frames)
+            arr = np.transpose(arr, (3, 0, 1, 2))
+        return arr, None
+
+    def _resize(self, arr: np.ndarray, owned: bool):
+        width, height = self.resize
+        out = np.empty((len(arr), height, width, arr.shape[-1]), dtype=arr.dtype)
+
+        def resize_frame(i):
+            cv2.resize(_frame_view(arr, i), (width, height), dst=_frame_view(out, i))
+
+        self._for_each_frame(resize_frame, len(arr))
+        return out, f"Resized to {width}x{height}"
+
+    @staticmethod
+    def _to_uint8(arr: np.ndarray, owned: bool, unit_range: Optional[bool] = None):
+        if arr.dtype == np.uint8:
+            return arr, None
+        out = np.empty(arr.shape, dtype=np.uint8)
+        if arr.dtype in (np.float32, np.float64):
+            if unit_range is None:
+                unit_range = len(arr) > 0 and arr.max() <= 1.0
+            tmp = np.empty((min(CHUNK_FRAMES, len(arr)),) + arr.shape[1:], dtype=arr.dtype)
+            for i in range(0, len(arr), CHUNK_FRAMES):
+                chunk = arr[i:i + CHUNK_FRAMES]
+                buf = tmp[:len(chunk)]
+                if unit_range:
+                    np.multiply(chunk, 255, out=buf)
+                else:
+                    np.clip(chunk, 0, 255, out=buf)
+                out[i:i + len(chunk)] = buf
+        else:
+            np.copyto(out, arr, casting='unsafe')
+        return out, "Converted to uint8"
+
+    def _contrast(self, arr: np.ndarray, owned: bool):
+        # The LUT is applied in place on buffers produced by resize/to_uint8
+        out = arr if owned else np.empty(arr.shape, dtype=np.uint8)
+        if arr.flags.c_contiguous and out.flags.c_contiguous and arr.size:
+            rows = arr.shape[0] * arr.shape[1]
+            cv2.LUT(arr.reshape(rows, -1), self.lut, dst=out.reshape(rows, -1))
+        else:
+            for i in range(len(arr)):
+                cv2.LUT(_frame_view(arr, i), self.lut, dst=_frame_view(out, i))
+        return out, f"Adjusted contrast: {self.contrast}, brightness: {self.brightness}"
+
+    def _denoise(self, arr: np.ndarray, owned: bool):
+        denoise = self.denoise
+        message = f"Applied {denoise} denoising"
+        single_channel = arr.shape[-1] == 1
+        if denoise == 'gaussian':
+            def apply(src, dst):
+                cv2.GaussianBlur(src, (5, 5), 0, dst=dst)
+        elif denoise == 'median' and single_channel:
+            def apply(src, dst):
+                cv2.medianBlur(src, 5, dst=dst)
+        elif denoise == 'bilateral':
+            def apply(src, dst):
+                cv2.bilateralFilter(src, 9, 75, 75, dst=dst)
+        else:
+            # Median blur is only applied to single-channel frames; unknown filters are a no-op
+            return arr, message
+        out = np.empty(arr.shape, dtype=arr.dtype)
+        self._for_each_frame(lambda i: apply(_frame_view(arr, i), _frame_view(out, i)), len(arr))
+        return out, message
+
+    @staticmethod
+    def _histogram(arr: np.ndarray) -> np.ndarray:
+        if arr.size == 0:
+            raise ValueError("No frames left after preprocessing")
+        hist = np.zeros(256, dtype=np.int64)
+        for i in range(0, len(arr), CHUNK_FRAMES):
+            hist += np.bincount(arr[i:i + CHUNK_FRAMES].reshape(-1), minlength=256)
+        return hist
+
+    def _stats(self, hist: np.ndarray):
+        """min/max/mean/std of the normalized clip from its uint8 histogram.
+
+        Every normalization mode is an affine map x -> scale * x + offset, so
+        the stats of the normalized data follow from the raw histogram.
+        """
+        values = np.arange(256, dtype=np.float64)
+        count = float(hist.sum())
+        nonzero = np.flatnonzero(hist)
+        raw_min, raw_max = float(nonzero[0]), float(nonzero[-1])
+        raw_mean = float(hist @ values) / count
+        raw_std = float(np.sqrt(max(float(hist @ (values * values)) / count - raw_mean * raw_mean, 0.0)))
+
+        scale, offset, message = 1.0, 0.0, None
+        if self.normalize == '0-1':
+            scale = 1.0 / 255.0
+            message = "Normalized to [0, 1]"
+        elif self.normalize == 'z-score':
+            scale = 1.0 / (raw_std + 1e-8)
+            offset = -raw_mean * scale
+            message = f"Z-score normalized (mean={raw_mean:.2f}, std={raw_std:.2f})"
+        elif self.normalize == 'minmax':
+            scale = 1.0 / (raw_max - raw_min + 1e-8)
+            offset = -raw_min * scale
+            message = f"MinMax normalized (min={raw_min:.2f}, max={raw_max:.2f})"
+
+        stats = {
+            "min": raw_min * scale + offset,
+            "max": raw_max * scale + offset,
+            "mean": raw_mean * scale + offset,
+            "std": raw_std * scale,
+        }
+        return stats, scale, offset, message
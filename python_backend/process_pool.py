@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+"""
+Shared worker-process pool for CPU-heavy request work
+
+cv2 calls release the GIL, but the Python between them (per-frame loops,
+slicing, scheduling) does not, so one heavy request (e.g. a bilateral-filter
+preprocess of a long clip) slows every other request handled by the same
+server process. Preprocessing, the MP4 encodes of /api/convert-npz and the
+JPEG encoding of /api/stream-video therefore run on PROCESS_POOL_WORKERS
+spawned processes, and the request threads only wait on the result, staying
+free for health checks, listings and struct_pred. A streamed MP4 is written
+by the worker into the cache temp file and the request thread sends the
+bytes as they land there (follow_file).
+
+Frames are never pickled on the way in:
+
+  memory-mapped .npy   the worker maps the same file (frame store sidecars,
+                       cached renditions)
+  NpzFrameStream       the worker inflates the NPZ itself
+  other arrays         copied once into a multiprocessing.shared_memory block
+                       that the worker maps
+
+and large results come back the same way (take_array). At most
+PROCESS_POOL_MAX_QUEUE tasks are queued or running; beyond that a request is
+rejected (PoolBusy -> 503 with Retry-After) or, with PROCESS_POOL_ON_FULL=inline,
+runs in the request thread as it did before the pool existed.
+"""
+
+import logging
+import mmap
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from lazy_start import LazyStart
+from npz_stream import NpzFrameStream
+from preprocess_pipeline import PreprocessPipeline, PreprocessResult
+from renditions import iter_bgr_frames
+from stream_engine import jpeg_frame
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETRY_AFTER = 5
+ON_FULL_POLICIES = ('reject', 'inline')
+# Windows frees a named block when its last handle closes, so workers keep results open until the server has read them
+EXPORT_LINGER_SECONDS = 30.0
+FOLLOW_READ_BYTES = 256 * 1024
+FOLLOW_POLL_SECONDS = 0.02
+
+
+class PoolBusy(RuntimeError):
+    """Raised when PROCESS_POOL_MAX_QUEUE tasks are already queued or running"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# ------------------------------------------------------------------ frame transport
+
+class SharedArray:
+    """Picklable reference to an array in a named shared memory block"""
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype: str):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    @classmethod
+    def copy_of(cls, arr: np.ndarray) -> Tuple["SharedArray", shared_memory.SharedMemory]:
+        """Copy arr into a new block; the caller closes and unlinks the returned block when done"""
+        shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        np.copyto(np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf), arr, casting='no')
+        return cls(shm.name, tuple(arr.shape), arr.dtype.str), shm
+
+    def attach(self) -> Tuple[np.ndarray, shared_memory.SharedMemory]:
+        shm = shared_memory.SharedMemory(name=self.name)
+        return np.ndarray(self.shape, dtype=np.dtype(self.dtype), buffer=shm.buf), shm
+
+    def take(self) -> np.ndarray:
+        """Copy the array out of the block and free the block"""
+        view, shm = self.attach()
+        try:
+            return view.copy()
+        finally:
+            del view
+            shm.close()
+            shm.unlink()
+
+
+def _mapped_file(frames: np.ndarray) -> Optional[tuple]:
+    """(filename, offset, shape, dtype, order) if frames is a whole memory-mapped file, else None"""
+    if not isinstance(frames, np.memmap) or not isinstance(frames.base, mmap.mmap) or frames.filename is None:
+        return None
+    order = 'F' if frames.flags.f_contiguous and not frames.flags.c_contiguous else 'C'
+    return frames.filename, frames.offset, frames.shape, frames.dtype.str, order
+
+
+def share_frames(frames) -> Tuple[tuple, Callable[[], None]]:
+    """Picklable handle for frames plus a release callback to run once the task is done"""
+    if isinstance(frames, NpzFrameStream):
+        return ('stream', frames), lambda: None
+    mapped = _mapped_file(frames)
+    if mapped is not None:
+        return ('file',) + mapped, lambda: None
+    ref, shm = SharedArray.copy_of(frames)
+
+    def release():
+        shm.close()
+        shm.unlink()
+    return ('shm', ref), release
+
+
+def open_frames(handle: tuple):
+    """Frames for a handle made by share_frames (or ('local', frames) for in-process runs)"""
+    kind = handle[0]
+    if kind in ('local', 'stream'):
+        return handle[1]
+    if kind == 'file':
+        filename, offset, shape, dtype, order = handle[1:]
+        return np.memmap(filename, dtype=np.dtype(dtype), mode='r', offset=offset, shape=shape, order=order)
+    view, shm = handle[1].attach()
+    _worker['attached'].append(shm)
+    return view
+
+
+def export_array(arr: np.ndarray):
+    """Hand a task result back: a SharedArray from a worker, the array itself in-process"""
+    if not _worker:
+        return arr
+    ref, shm = SharedArray.copy_of(arr)
+    if os.name == 'nt':
+        _worker['exported'].append((time.monotonic(), shm))
+    else:
+        # The server unlinks the block after copying it out
+        shm.close()
+    return ref
+
+
+def take_array(value) -> np.ndarray:
+    """Counterpart of export_array on the server side"""
+    return value.take() if isinstance(value, SharedArray) else value
+
+
+# ------------------------------------------------------------------ worker side
+
+# Per-process state of a pool worker (empty in the server process)
+_worker: dict = {}
+
+
+def _init_worker():
+    _worker['attached'] = []
+    _worker['exported'] = []
+    # Parallelism comes from the pool size; OpenCV's own threads would oversubscribe the cores
+    cv2.setNumThreads(1)
+
+
+def _close_attached():
+    attached = _worker['attached']
+    for shm in list(attached):
+        try:
+            shm.close()
+        except BufferError:
+            # Still referenced (e.g. from a traceback); retried before the next task
+            continue
+        attached.remove(shm)
+
+
+def _call(fn: Callable, handle: tuple, *args):
+    if not _worker:
+        return fn(open_frames(handle), *args)
+    _close_attached()
+    exported = _worker['exported']
+    while exported and time.monotonic() - exported[0][0] > EXPORT_LINGER_SECONDS:
+        exported.pop(0)[1].close()
+    frames = open_frames(handle)
+    try:
+        return fn(frames, *args)
+    finally:
+        del frames
+        _close_attached()
+
+
+def _preprocess(frames, options: dict, keep: Optional[int]) -> PreprocessResult:
+    result = PreprocessPipeline.compile(options).run(frames, keep=keep)
+    result.frames = export_array(result.frames)
+    return result
+
+
+def _encode_clip(frames, encoder, fps: float, width: int, height: int, path: str):
+    encoder.write_file(iter_bgr_frames(frames), fps, width, height, path)
+
+
+def _stream_clip(frames, encoder, fps: float, width: int, height: int, path: str):
+    with open(path, 'wb') as f:
+        for chunk in encoder.stream(iter_bgr_frames(frames), fps, width, height):
+            f.write(chunk)
+            # Visible to follow_file in the server as soon as ffmpeg emits it
+            f.flush()
+
+
+def _encode_jpegs(frames, quality: int, size: Optional[Tuple[int, int]]) -> List[Optional[bytes]]:
+    encoded = []
+    for frame in frames:
+        try:
+            encoded.append(jpeg_frame(frame, quality, size))
+        except Exception as e:
+            logger.error(f"Error processing frame: {e}")
+            encoded.append(None)
+    return encoded
+
+
+# Tasks: module-level so they pickle by reference, frame handle first
+
+def preprocess_frames(handle: tuple, options: dict, keep: Optional[int]) -> PreprocessResult:
+    """Run the preprocess pipeline compiled from options; result.frames comes back via export_array"""
+    return _call(_preprocess, handle, options, keep)
+
+
+def encode_clip(handle: tuple, encoder, fps: float, width: int, height: int, path: str):
+    """Convert a clip to BGR and encode it into path"""
+    return _call(_encode_clip, handle, encoder, fps, width, height, path)
+
+
+def stream_clip(handle: tuple, encoder, fps: float, width: int, height: int, path: str):
+    """Encode a clip with encoder.stream, appending each fragment to path as it is produced"""
+    return _call(_stream_clip, handle, encoder, fps, width, height, path)
+
+
+def encode_jpegs(handle: tuple, quality: int, size: Optional[Tuple[int, int]]) -> List[Optional[bytes]]:
+    """JPEG bytes (None for frames that fail) of a batch of stream frames"""
+    return _call(_encode_jpegs, handle, quality, size)
+
+
+# ------------------------------------------------------------------ server side
+
+def default_workers() -> int:
+    """This server process's share of the cores: CPU count / SERVER_WORKERS, at least 1"""
+    try:
+        server_workers = max(1, int(os.environ.get('SERVER_WORKERS') or 1))
+    except ValueError:
+        server_workers = 1
+    return max(1, (os.cpu_count() or 1) // server_workers)
+
+
+class ProcessPool:
+    """Bounded pool of spawned worker processes shared by all request threads"""
+
+    def __init__(self, workers: int = 0, max_queue: Optional[int] = None, on_full: str = 'reject',
+                 retry_after: int = DEFAULT_RETRY_AFTER):
+        self.workers = max(0, int(workers))
+        self.max_queue = max(1, int(max_queue or self.workers * 2 or 1))
+        self.on_full = on_full if on_full in ON_FULL_POLICIES else 'reject'
+        self.retry_after = max(1, int(retry_after))
+        self._lock = threading.Lock()
+        self._pool: LazyStart[ProcessPoolExecutor] = LazyStart(self._start_pool)
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.inline = 0
+
+    @classmethod
+    def from_env(cls) -> "ProcessPool":
+        """Build a pool from PROCESS_POOL_WORKERS / PROCESS_POOL_MAX_QUEUE / PROCESS_POOL_ON_FULL / PROCESS_POOL_RETRY_AFTER"""
+        try:
+            workers = int(os.environ.get('PROCESS_POOL_WORKERS') or default_workers())
+            max_queue = int(os.environ.get('PROCESS_POOL_MAX_QUEUE') or 0) or None
+            retry_after = int(os.environ.get('PROCESS_POOL_RETRY_AFTER') or DEFAULT_RETRY_AFTER)
+        except ValueError:
+            logger.warning("Invalid PROCESS_POOL_WORKERS/PROCESS_POOL_MAX_QUEUE/PROCESS_POOL_RETRY_AFTER, "
+                           "running heavy work in the request threads")
+            workers, max_queue, retry_after = 0, None, DEFAULT_RETRY_AFTER
+        on_full = (os.environ.get('PROCESS_POOL_ON_FULL') or 'reject').strip().lower()
+        if on_full not in ON_FULL_POLICIES:
+            logger.warning(f"Invalid PROCESS_POOL_ON_FULL '{on_full}', using 'reject'")
+        return cls(workers, max_queue, on_full, retry_after)
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    @property
+    def saturated(self) -> bool:
+        with self._lock:
+            return self.enabled and self.in_flight >= self.max_queue
+
+    def _start_pool(self) -> ProcessPoolExecutor:
+        # spawn: workers must not inherit the server's threads and locks (and it is the only option on Windows)
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_worker)
+
+    def submit(self, task: Callable, frames, *args, on_full: Optional[str] = None) -> Optional[Future]:
+        """Start task(handle of frames, *args) on a worker and return its future.
+
+        Returns None when the work should run in the calling thread instead:
+        the pool is disabled, or full with the 'inline' policy. Raises
+        PoolBusy when full with the 'reject' policy. Shared frames are
+        released when the task finishes, even if nobody waits for it.
+        """
+        with self._lock:
+            if not self.enabled:
+                return None
+            if self.in_flight >= self.max_queue:
+                if (on_full or self.on_full) == 'reject':
+                    self.rejected += 1
+                    raise PoolBusy(f"Worker pool is busy ({self.in_flight} of {self.max_queue} tasks queued or running)",
+                                   self.retry_after)
+                self.inline += 1
+                return None
+            self.in_flight += 1
+
+        release = None
+        try:
+            handle, release = share_frames(frames)
+            try:
+                future = self._submit(task, handle, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); replace the pool once
+                self._reset()
+                future = self._submit(task, handle, *args)
+        except BaseException:
+            if release is not None:
+                release()
+            with self._lock:
+                self.in_flight -= 1
+                self.failed += 1
+            raise
+        future.add_done_callback(lambda f: self._finished(f, release))
+        return future
+
+    def run(self, task: Callable, frames, *args, local: Optional[Callable] = None, on_full: Optional[str] = None):
+        """Run task on a worker and wait for its result, or in this thread when submit returns None
+        (local(frames) if given, else the task itself)"""
+        future = self.submit(task, frames, *args, on_full=on_full)
+        if future is None:
+            return local(frames) if local is not None else task(('local', frames), *args)
+        return future.result()
+
+    def _finished(self, future: Future, release: Callable[[], None]):
+        release()
+        error = None if future.cancelled() else future.exception()
+        with self._lock:
+            self.in_flight -= 1
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if isinstance(error, BrokenProcessPool):
+            self._reset()
+
+    def _submit(self, task: Callable, *args):
+        return self._pool.get().submit(task, *args)
+
+    def _reset(self):
+        pool = self._pool.reset()
+        if pool is not None:
+            logger.warning("Worker pool broken, starting a new one")
+            pool.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "started": self._pool.started,
+                "max_queue": self.max_queue,
+                "on_full": self.on_full,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "inline": self.inline,
+            }
+
+
+def follow_file(path: str, future: Future, read_bytes: int = FOLLOW_READ_BYTES,
+                poll_seconds: float = FOLLOW_POLL_SECONDS):
+    """Yield what a worker appends to path until its task finishes, then raise the task's error if any"""
+    with open(path, 'rb') as f:
+        while True:
+            done = future.done()
+            data = f.read(read_bytes)
+            if data:
+                yield data
+            elif done:
+                break
+            else:
+                wait([future], timeout=poll_seconds)
+    future.result()
+
+
+def batches(frames: Sequence, size: int):
+    """Consecutive slices of at most size frames"""
+    for i in range(0, len(frames), size):
+        yield frames[i:i + size]
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Precomputed renditions of echo clips
+
+Each NPZ can be rendered into a fixed ladder of profiles:
+
+  thumbnail  JPEG strip of a few evenly spaced frames (worklist browsing)
+  model      224x224 uint8 frame array (.npy, memory-mapped on use)
+  preview    small MP4 (longest side 320, "fast" encoder preset)
+  full       native-resolution MP4 (same artifact as /api/convert-npz)
+
+Renditions live in the transcode cache directory next to the cached MP4s and
+share its byte budget. They are built on first access or ahead of time (CLI
+below, or a warm-up job), and rebuilt automatically when the NPZ changes
+because the cache key includes its mtime and size. Concurrent requests for
+the same missing rendition wait for a single build.
+
+Usage:
+    python renditions.py <npz file or directory>... [--profiles thumbnail model preview]
+"""
+
+import argparse
+import logging
+import sys
+import threading
+import time
+from typing import Dict, Iterator, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from frame_cache import FrameCache
+from frame_executor import FrameExecutor
+from frame_store import FrameStore, iter_npz_paths
+from npz_stream import FrameSource, NpzFrameStream, clip_length, frame_chunks, frames_first, take_frames, unit_range
+from preprocess_pipeline import PreprocessPipeline
+from transcode_cache import TranscodeCache
+from video_encoder import EncoderRegistry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FPS = 20.0
+MODEL_SIZE = (224, 224)       # width, height
+PREVIEW_MAX_SIDE = 320
+THUMBNAIL_FRAMES = 8
+THUMBNAIL_HEIGHT = 96
+
+
+class RenditionProfile(NamedTuple):
+    name: str
+    suffix: str
+    mimetype: str
+    description: str
+
+
+PROFILES: Dict[str, RenditionProfile] = {
+    'thumbnail': RenditionProfile('thumbnail', '.jpg', 'image/jpeg',
+                                  f"{THUMBNAIL_FRAMES}-frame JPEG strip, {THUMBNAIL_HEIGHT}px high"),
+    'model': RenditionProfile('model', '.npy', 'application/octet-stream',
+                              f"{MODEL_SIZE[0]}x{MODEL_SIZE[1]} uint8 frames"),
+    'preview': RenditionProfile('preview', '.mp4', 'video/mp4',
+                                f"MP4, longest side {PREVIEW_MAX_SIDE}px, fast preset"),
+    'full': RenditionProfile('full', '.mp4', 'video/mp4', "native-resolution MP4"),
+}
+LAZY_PROFILES = ('thumbnail', 'model', 'preview')
+
+
+def clip_dimensions(frames: FrameSource) -> Tuple[int, int, int]:
+    """(frames, height, width) of a clip clip_to_bgr can convert; raises ValueError for other shapes"""
+    if frames.ndim < 3:
+        raise ValueError(f"Invalid frames shape: {frames.shape}")
+    if frames.ndim > 4:
+        raise ValueError(f"Unsupported frames dimensions: {frames.ndim}")
+    shape = frames.shape if isinstance(frames, NpzFrameStream) else frames_first(frames).shape
+    if len(shape) == 4 and shape[3] == 2:
+        raise ValueError(f"Unsupported channel count 2 in frames shape {shape}, expected 1, 3 or more")
+    return shape[0], shape[1], shape[2]
+
+
+class BgrFrameConverter:
+    """Per-frame kernel turning one NPZ frame into uint8 BGR inside a reused buffer.
+
+    Frames are (height, width) grayscale or (height, width, channels); dtype
+    conversion runs first into a uint8 scratch frame (float frames in [0, 1]
+    are scaled by 255 into a float scratch frame before that), then OpenCV
+    expands gray or swaps RGB into the contiguous output buffer. Every buffer
+    is allocated once, so converting a clip allocates nothing per frame and
+    nothing the size of the clip. The returned frame is overwritten by the
+    next call; copy it to keep it.
+    """
+
+    def __init__(self, frame_shape: Tuple[int, ...], dtype, unit_range: Optional[bool] = None):
+        dtype = np.dtype(dtype)
+        height, width = frame_shape[:2]
+        channels = frame_shape[2] if len(frame_shape) == 3 else 1
+        if channels == 2:
+            # Neither gray nor RGB: there is no sensible third channel to fill in
+            raise ValueError(f"Unsupported channel count 2 in frame shape {tuple(frame_shape)}, expected 1, 3 or more")
+        self.scale = bool(unit_range) and (dtype == np.float32 or dtype == np.float64)
+        if unit_range is None and (dtype == np.float32 or dtype == np.float64):
+            raise ValueError("unit_range must be decided over the whole clip for float frames")
+        self.channels = channels
+        self.gray = channels == 1
+        self.out = np.empty((height, width, 3), dtype=np.uint8)
+        source_shape = (height, width) if self.gray else (height, width, min(channels, 3))
+        self._scaled = np.empty(source_shape, dtype=dtype) if self.scale else None
+        self._uint8 = np.empty(source_shape, dtype=np.uint8) if dtype != np.uint8 else None
+
+    def __call__(self, frame: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Convert one frame into out (a contiguous (height, width, 3) uint8 array) or the shared buffer"""
+        out = self.out if out is None else out
+        if frame.ndim == 3:
+            # Single-channel frames drop the channel axis, extra channels beyond the first three are ignored
+            frame = frame[:, :, 0] if self.channels == 1 else frame[:, :, :3]
+        if self._uint8 is not None:
+            if self._scaled is not None:
+                np.multiply(frame, 255, out=self._scaled)
+                frame = self._scaled
+            np.copyto(self._uint8, frame, casting='unsafe')
+            frame = self._uint8
+        if self.gray:
+            cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR, dst=out)
+        elif self.channels == 3:
+            cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, dst=out)
+        else:
+            np.copyto(out, frame)
+        return out
+
+
+def clip_to_bgr(frames: np.ndarray, indices: Optional[Sequence[int]] = None,
+                clip_unit_range: Optional[bool] = None) -> np.ndarray:
+    """Convert an NPZ frames array to uint8 BGR (frames, height, width, 3) for encoding.
+
+    3D arrays are grayscale (a (height, width, frames) layout is transposed),
+    4D arrays are RGB (reversed to BGR), single-channel or multi-channel.
+    Float clips in [0, 1] are scaled to 0-255; that is decided over the whole
+    clip, also when indices picks a few frames, unless the caller passes the
+    clip's unit_range() as clip_unit_range. Raises ValueError for other shapes.
+    """
+    clip_dimensions(frames)
+    frames = frames_first(frames)
+    if clip_unit_range is None:
+        clip_unit_range = unit_range(frames)
+    if indices is not None:
+        frames = frames[np.asarray(indices)]
+    return _frames_to_bgr(frames, clip_unit_range)
+
+
+def iter_bgr_frames(frames: FrameSource) -> Iterator[np.ndarray]:
+    """Yield the frames of a clip as uint8 BGR, converted one at a time into a single reused buffer.
+
+    Frames are read chunk by chunk (see npz_stream.frame_chunks), so the
+    encoder must consume each frame before asking for the next. Whether a
+    float clip is in [0, 1] is decided once over the whole clip, as
+    clip_to_bgr does; for an NpzFrameStream that costs an extra inflate pass.
+    """
+    clip_dimensions(frames)
+    clip_unit_range = unit_range(frames)
+    converter = None
+    for chunk in frame_chunks(frames):
+        if converter is None:
+            converter = BgrFrameConverter(chunk.shape[1:], chunk.dtype, clip_unit_range)
+        for frame in chunk:
+            yield converter(frame)
+
+
+def _frames_to_bgr(frames: np.ndarray, clip_unit_range: Optional[bool]) -> np.ndarray:
+    """Frames-first frames to a new uint8 BGR array, floats scaled as decided for their whole clip"""
+    out = np.empty(frames.shape[:3] + (3,), dtype=np.uint8)
+    if len(frames):
+        converter = BgrFrameConverter(frames.shape[1:], frames.dtype, clip_unit_range)
+        for i, frame in enumerate(frames):
+            converter(frame, out[i])
+    return out
+
+
+def fit_within(width: int, height: int, max_side: int) -> Tuple[int, int]:
+    """Scale (width, height) down so the longest side is at most max_side, keeping even dimensions"""
+    scale = min(1.0, max_side / float(max(width, height)))
+    return max(2, int(round(width * scale / 2)) * 2), max(2, int(round(height * scale / 2)) * 2)
+
+
+class RenditionManager:
+    """Builds and serves the rendition ladder through the transcode cache"""
+
+    def __init__(self, cache: TranscodeCache, frame_store: FrameStore, encoders: EncoderRegistry,
+                 executor: Optional[FrameExecutor] = None):
+        self.cache = cache
+        self.frame_store = frame_store
+        self.encoders = encoders
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._building: Dict[str, threading.Event] = {}
+        self.built = 0
+        self.coalesced = 0
+        self.build_ms: Dict[str, float] = {}
+
+    def key_for(self, npz_path: str, profile: str, fps: float = DEFAULT_FPS) -> str:
+        """Cache key of a rendition; the full profile shares its key with /api/convert-npz"""
+        if profile == 'full':
+            return self.cache.make_key(npz_path, self.encoders.get(None).name, fps)
+        if profile == 'preview':
+            return self.cache.make_key(npz_path, self.encoders.get('fast').name, fps,
+                                       profile='preview', max_side=PREVIEW_MAX_SIDE)
+        if profile == 'model':
+            return self.cache.make_key(npz_path, 'npy', 0, profile='model', size=f"{MODEL_SIZE[0]}x{MODEL_SIZE[1]}")
+        if profile == 'thumbnail':
+            return self.cache.make_key(npz_path, 'jpeg', 0, profile='thumbnail',
+                                       frames=THUMBNAIL_FRAMES, height=THUMBNAIL_HEIGHT)
+        raise ValueError(f"Unknown profile '{profile}', expected one of {list(PROFILES)}")
+
+    def get(self, npz_path: str, profile: str, fps: float = DEFAULT_FPS, create: bool = True) -> Optional[str]:
+        """Path of the rendition, building it first if needed (None if missing and create is False)"""
+        suffix = PROFILES[profile].suffix if profile in PROFILES else None
+        key = self.key_for(npz_path, profile, fps)
+        path = self.cache.get(key, suffix)
+        if path or not create:
+            return path
+
+        with self._lock:
+            event = self._building.get(key)
+            owner = event is None
+            if owner:
+                event = self._building[key] = threading.Event()
+            else:
+                self.coalesced += 1
+        if not owner:
+            event.wait()
+            path = self.cache.get(key, suffix)
+            if path is None:
+                raise RuntimeError(f"Building the {profile} rendition of {npz_path} failed")
+            return path
+        try:
+            t0 = time.perf_counter()
+            path = self._build(npz_path, profile, fps, key, suffix)
+            elapsed_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+            with self._lock:
+                self.built += 1
+                self.build_ms[profile] = elapsed_ms
+            logger.info(f"Built {profile} rendition of {npz_path} in {elapsed_ms} ms")
+            return path
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+            event.set()
+
+    def frames(self, npz_path: str, profile: str = 'model') -> np.ndarray:
+        """Memory-mapped frames of an array rendition (only 'model' is stored as frames)"""
+        if profile != 'model':
+            raise ValueError(f"Profile '{profile}' has no frame array, use 'model'")
+        return np.load(self.get(npz_path, profile), mmap_mode='r')
+
+    def ensure(self, npz_path: str, profiles: Sequence[str] = LAZY_PROFILES, fps: float = DEFAULT_FPS) -> Dict[str, str]:
+        """Build every listed rendition that is not cached yet; returns profile -> path"""
+        return {profile: self.get(npz_path, profile, fps) for profile in profiles}
+
+    # ------------------------------------------------------------------ builders
+
+    def _build(self, npz_path: str, profile: str, fps: float, key: str, suffix: str) -> str:
+        # The full profile shares its key with /api/convert-npz, which may be encoding it right now
+        path, tmp_path = self.cache.claim(key, suffix)
+        if path is not None:
+            return path
+        try:
+            frames, _ = self.frame_store.open_stream(npz_path)
+            if profile == 'thumbnail':
+                self._write_thumbnail(frames, tmp_path)
+            elif profile == 'model':
+                result = PreprocessPipeline.compile({'resize': list(MODEL_SIZE)}, executor=self.executor).run(frames)
+                np.save(tmp_path, result.frames)
+            else:
+                self._write_mp4(frames, profile, fps, tmp_path)
+            return self.cache.publish(key, tmp_path, suffix)
+        except BaseException:
+            self.cache.discard(tmp_path)
+            raise
+
+    @staticmethod
+    def _write_thumbnail(frames: FrameSource, path: str):
+        clip_dimensions(frames)
+        count = clip_length(frames)
+        indices = np.unique(np.linspace(0, max(count - 1, 0), THUMBNAIL_FRAMES).astype(int))
+        picked = _frames_to_bgr(take_frames(frames, indices), unit_range(frames))
+        height, width = picked.shape[1:3]
+        size = (max(1, int(round(width * THUMBNAIL_HEIGHT / height))), THUMBNAIL_HEIGHT)
+        strip = cv2.hconcat([cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in picked])
+        ok, buffer = cv2.imencode('.jpg', strip, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        if not ok:
+            raise RuntimeError("Failed to encode thumbnail strip")
+        with open(path, 'wb') as f:
+            f.write(buffer.tobytes())
+
+    def _write_mp4(self, frames: FrameSource, profile: str, fps: float, path: str):
+        _, height, width = clip_dimensions(frames)
+        frames_bgr = iter_bgr_frames(frames)
+        if profile == 'preview':
+            encoder = self.encoders.get('fast')
+            size = fit_within(width, height, PREVIEW_MAX_SIDE)
+            if size != (width, height):
+                frames_bgr = (cv2.resize(frame, size, interpolation=cv2.INTER_AREA) for frame in frames_bgr)
+                width, height = size
+        else:
+            encoder = self.encoders.get(None)
+        encoder.write_file(frames_bgr, fps, width, height, path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "profiles": {name: p.description for name, p in PROFILES.items()},
+                "built": self.built,
+                "building": len(self._building),
+                "coalesced": self.coalesced,
+                "last_build_ms": dict(self.build_ms),
+            }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build cached renditions (thumbnail, model, preview, full) of NPZ clips")
+    parser.add_argument('targets', nargs='+', help="NPZ files or directories")
+    parser.add_argument('--profiles', nargs='+', default=list(LAZY_PROFILES), choices=list(PROFILES))
+    parser.add_argument('--fps', type=float, default=DEFAULT_FPS, help="frame rate of the MP4 renditions")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    manager = RenditionManager(TranscodeCache.from_env(), FrameStore.from_env(FrameCache(0)),
+                               EncoderRegistry.from_env(), FrameExecutor.from_env())
+    failures = 0
+    for npz_path in iter_npz_paths(args.targets):
+        try:
+            for profile, path in manager.ensure(npz_path, args.profiles, args.fps).items():
+                print(f"✅ {npz_path} [{profile}] -> {path}")
+        except Exception as e:
+            failures += 1
+            print(f"❌ {npz_path}: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,24 @@
 #!/usr/bin/env python3
 """
 Startup script for the NPZ to MP4 conversion server
+
+Usage:
+    python start_server.py           # development server (Werkzeug, reloader when FLASK_DEBUG=true)
+    python start_server.py --prod    # production server (gunicorn gthread workers; waitress on Windows)
+
+The mode can also be selected with SERVER_MODE=production in .env.
+
+Every server process starts its own worker pools: PROCESS_POOL_WORKERS
+processes for preprocess/encode work, JOB_WORKERS processes for /api/jobs and
+FRAME_WORKERS threads. The effective number of server processes is exported
+as SERVER_WORKERS before the app is imported, and PROCESS_POOL_WORKERS
+defaults to CPU count / SERVER_WORKERS, so a default --prod launch runs about
+one encode process per core rather than SERVER_WORKERS x CPU count. Keep
+SERVER_WORKERS x (PROCESS_POOL_WORKERS + JOB_WORKERS) near the core count
+when setting them by hand.
 """
 
+import argparse
 import subprocess
 import sys
 import os
@@ -46,8 +62,82 @@ def create_test_data():
     
     return True
 
-def main():
+def _env_int(name, default):
+    """Read an integer setting from the environment, falling back to default"""
+    value = os.environ.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"⚠️  Invalid {name}={value!r}, using {default}")
+        return default
+
+def production_settings():
+    """Worker/concurrency settings for the production server, from .env / OS environment"""
+    return {
+        "workers": _env_int("SERVER_WORKERS", os.cpu_count() or 1),
+        "threads": _env_int("SERVER_THREADS", 8),
+        "timeout": _env_int("SERVER_TIMEOUT", 120),
+        "keepalive": _env_int("SERVER_KEEPALIVE", 5),
+    }
+
+def run_production(host, port):
+    """Serve the app with a multi-worker production server"""
+    settings = production_settings()
+    print(f"🏭 Production mode: {settings}")
+
+    if os.name == "nt":
+        # gunicorn does not run on Windows; waitress is a single-process threaded server
+        os.environ["SERVER_WORKERS"] = "1"
+        from waitress import serve
+        threads = settings["workers"] * settings["threads"]
+        print(f"🌐 Binding waitress on {host}:{port} ({threads} threads)")
+        from app import app
+        serve(app, host=host, port=port, threads=threads, channel_timeout=settings["timeout"])
+        return
+
+    from gunicorn.app.base import BaseApplication
+
+    class EchoPilotApplication(BaseApplication):
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            # Imported in each worker after fork, so caches and thread pools are per-process
+            from app import app
+            return app
+
+    # Read by the app in each worker to size its process pool (see module docstring)
+    os.environ["SERVER_WORKERS"] = str(settings["workers"])
+    options = {
+        "bind": f"{host}:{port}",
+        "worker_class": "gthread",
+        "workers": settings["workers"],
+        "threads": settings["threads"],
+        "timeout": settings["timeout"],
+        "keepalive": settings["keepalive"],
+        "accesslog": "-",
+    }
+    print(f"🌐 Binding gunicorn on {host}:{port} "
+          f"({settings['workers']} workers x {settings['threads']} threads)")
+    EchoPilotApplication(options).run()
+
+def main(argv=None):
     """Main startup function"""
+    parser = argparse.ArgumentParser(description="Start the NPZ to MP4 conversion server")
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument("--prod", action="store_const", const="production", dest="mode",
+                            help="run under a multi-worker production server")
+    mode_group.add_argument("--dev", action="store_const", const="development", dest="mode",
+                            help="run the Flask development server")
+    args = parser.parse_args(argv)
+
     print("🚀 Starting NPZ to MP4 Conversion Server")
     print("=" * 50)
     # Load environment variables from backend and project root .env files, if available
@@ -64,6 +154,9 @@ def main():
         # Continue even if python-dotenv is not installed
         print(f"⚠️  Could not load .env files automatically ({e}). Proceeding with OS environment.")
     
+    mode = (args.mode or os.environ.get("SERVER_MODE", "development")).lower()
+    production = mode in ("production", "prod")
+    
     # Check dependencies
     if not check_dependencies():
         sys.exit(1)
@@ -87,13 +180,18 @@ def main():
     print(f"   Working Directory: {os.getcwd()}")
     
     print("\n" + "=" * 50)
-    print("Starting Flask server...")
+    print("Starting production server..." if production else "Starting Flask server...")
     
     # Start the Flask app
     try:
-        from app import app
         host = os.environ.get("FLASK_RUN_HOST", "0.0.0.0")
         port = int(os.environ.get("FLASK_RUN_PORT", "5000"))
+        if production:
+            run_production(host, port)
+            return
+        # The development server is a single process
+        os.environ["SERVER_WORKERS"] = "1"
+        from app import app
         debug = os.environ.get("FLASK_DEBUG", "true").lower() == "true"
         print(f"🌐 Binding Flask on {host}:{port} (debug={debug})")
         app.run(host=host, port=port, debug=debug)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Paced streaming engine for /api/stream-video
+
+Frames are rendered a few ahead on the shared frame executor (or, in batches
+of STREAM_BATCH_FRAMES, on the worker process pool) while the request thread
+only waits and writes, releasing each frame at its presentation time
+(index / fps). When the client disconnects, the WSGI server closes the
+generator and any frames still queued for encoding are cancelled. Every
+active stream reports how far encoding lags behind the requested frame rate.
+"""
+
+import itertools
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from frame_executor import FrameExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PREFETCH = 4
+# Frames per task when stream frames are JPEG-encoded on the worker process pool
+STREAM_BATCH_FRAMES = 8
+
+
+def jpeg_frame(frame: np.ndarray, quality: int, size: Optional[Tuple[int, int]] = None) -> Optional[bytes]:
+    """One stream frame as JPEG bytes: RGB, scaled to uint8, optionally resized to size (width, height)"""
+    # Ensure proper format
+    if frame.ndim == 2:
+        # Grayscale - convert to RGB
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+    elif frame.ndim == 3:
+        if frame.shape[-1] == 1:
+            frame_rgb = cv2.cvtColor(frame.squeeze(-1), cv2.COLOR_GRAY2RGB)
+        elif frame.shape[-1] == 3:
+            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        else:
+            frame_rgb = frame[:, :, :3]
+    else:
+        return None
+
+    # Normalize to 0-255 if needed
+    if frame_rgb.dtype != np.uint8:
+        if frame_rgb.max() <= 1.0:
+            frame_rgb = (frame_rgb * 255).astype(np.uint8)
+        else:
+            frame_rgb = np.clip(frame_rgb, 0, 255).astype(np.uint8)
+
+    if size:
+        frame_rgb = cv2.resize(frame_rgb, size)
+
+    success, buffer = cv2.imencode('.jpg', frame_rgb, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes() if success else None
+
+
+class StreamSession:
+    """Counters for one viewer's stream"""
+
+    def __init__(self, stream_id: int, path: str, fps: float, total_frames: int):
+        self.id = stream_id
+        self.path = path
+        self.fps = fps
+        self.total_frames = total_frames
+        self.started_at = time.time()
+        self.frames_sent = 0
+        self.late_frames = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_last = 0.0
+
+    def record(self, lag: float):
+        self.frames_sent += 1
+        self.lag_last = lag
+        if lag > 0:
+            self.late_frames += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "path": self.path,
+            "fps": self.fps,
+            "total_frames": self.total_frames,
+            "frames_sent": self.frames_sent,
+            "elapsed_s": round(time.time() - self.started_at, 3),
+            "late_frames": self.late_frames,
+            "encode_lag_ms": {
+                "last": round(self.lag_last * 1000.0, 2),
+                "max": round(self.lag_max * 1000.0, 2),
+                "mean_late": round(self.lag_total / self.late_frames * 1000.0, 2) if self.late_frames else 0.0,
+            },
+        }
+
+
+class StreamEngine:
+    """Runs paced, prefetching frame streams and tracks the active ones"""
+
+    def __init__(self, executor: FrameExecutor, prefetch: int = DEFAULT_PREFETCH):
+        self.executor = executor
+        self.prefetch = max(1, int(prefetch))
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._active: Dict[int, StreamSession] = {}
+        self.completed = 0
+        self.disconnected = 0
+
+    @classmethod
+    def from_env(cls, executor: FrameExecutor) -> "StreamEngine":
+        """Build an engine from STREAM_PREFETCH_FRAMES"""
+        try:
+            prefetch = int(os.environ.get('STREAM_PREFETCH_FRAMES', DEFAULT_PREFETCH))
+        except ValueError:
+            logger.warning("Invalid STREAM_PREFETCH_FRAMES, using default")
+            prefetch = DEFAULT_PREFETCH
+        return cls(executor, prefetch)
+
+    def stream(self, path: str, items: Iterable, render: Callable, fps: float,
+               total_frames: int, pace: bool = True, batched: bool = False) -> Iterator[Tuple[int, Optional[bytes]]]:
+        """Yield (frame index, render(item)) at fps, rendering up to `prefetch` frames ahead.
+
+        With batched=True each item is a batch of frames, render returns a
+        list with one result per frame, and `prefetch` counts batches.
+
+        Playback starts when the first frame is ready; frame i is then due at
+        start + i / fps. A frame that is not rendered by its
+        due time is sent as soon as it is ready and counted as encode lag; the
+        schedule is not shifted, so a stalled encoder catches up afterwards.
+        """
+        session = StreamSession(next(self._ids), path, fps, total_frames)
+        with self._lock:
+            self._active[session.id] = session
+        interval = 1.0 / fps if pace and fps > 0 else 0.0
+        rendered = self.executor.map(render, items, max_in_flight=self.prefetch)
+        frames = (data for batch in rendered for data in batch) if batched else rendered
+        finished = False
+        try:
+            start = None
+            for i, data in enumerate(frames):
+                now = time.monotonic()
+                if start is None:
+                    start = now
+                due = start + i * interval
+                if now < due:
+                    time.sleep(due - now)
+                    lag = 0.0
+                else:
+                    lag = now - due if interval else 0.0
+                session.record(lag)
+                yield i, data
+            finished = True
+        finally:
+            # GeneratorExit on disconnect lands here; closing the map cancels queued frames
+            rendered.close()
+            with self._lock:
+                self._active.pop(session.id, None)
+                if finished:
+                    self.completed += 1
+                else:
+                    self.disconnected += 1
+            if not finished:
+                logger.info(f"Stream {session.id} closed by client after {session.frames_sent} frames")
+
+    def active_streams(self):
+        with self._lock:
+            return [s.to_dict() for s in self._active.values()]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lags = [s.lag_max for s in self._active.values()]
+            return {
+                "active": len(self._active),
+                "completed": self.completed,
+                "disconnected": self.disconnected,
+                "prefetch_frames": self.prefetch,
+                "max_encode_lag_ms": round(max(lags) * 1000.0, 2) if lags else 0.0,
+            }
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Precompiled field plan for /api/generate-struct-pred
+
+standardized_structure is flattened once into a tuple of
+(category, field, field key, "category//field" key, override mode) rows, in
+the same order the DataFrame-based version produced them. Filling a plan from
+an exam entry is a single pass of dict lookups.
+"""
+
+import math
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+# Fields always read from the ground-truth label, whatever mode was requested
+TRUE_LABEL_FIELDS = {
+    ("cardiomyopathy", "cardiomyopathy_type"),
+    ("lv_geometry", "lvh_presence"),
+}
+
+# Modes understood by extract_value
+EXTRACT_MODES = ("pred_label", "pred", "true_label", "true", "prob")
+
+
+def _is_empty(value) -> bool:
+    """Values left out of struct_pred: None, "" and any NaN (entries parsed from JSON carry their own NaN objects)"""
+    return value is None or value == "" or (isinstance(value, float) and math.isnan(value))
+
+
+class FieldSpec(NamedTuple):
+    category: str
+    field: str
+    key: str            # sample key tried first
+    scoped_key: str     # "category//field", used when the field key is absent
+    mode: Optional[str] # extraction mode override, None = request mode
+
+
+FieldPlan = Tuple[FieldSpec, ...]
+
+
+def compile_field_plan(structure: dict) -> FieldPlan:
+    """Flatten a standardized structure into field specs (classification categories are their own field)"""
+    plan = []
+    for cat, spec in structure.items():
+        if isinstance(spec, list):
+            fields = [cat]
+        elif isinstance(spec, dict):
+            fields = list(spec)
+        else:
+            continue
+        for field in fields:
+            mode = "true_label" if (cat.lower(), field) in TRUE_LABEL_FIELDS else None
+            plan.append(FieldSpec(cat, field, field, f"{cat}//{field}", mode))
+    return tuple(plan)
+
+
+def extract_value(val, mode: str):
+    """Extract value based on mode from potentially nested dict structure"""
+    if not isinstance(val, dict):
+        return val
+    if mode in ("pred", "pred_label"):
+        return val.get("pred_label", None)
+    if mode in ("true", "true_label"):
+        return val.get("true_label", None)
+    if mode == "prob":
+        return val.get(mode)
+    return None
+
+
+def apply_field_plan(plan: FieldPlan, sample: dict, mode: str) -> Tuple[Dict[str, Dict[str, Any]], int]:
+    """Fill the plan from one entry; returns (nested struct_pred, number of filled fields)"""
+    result: Dict[str, Dict[str, Any]] = {}
+    filled = 0
+    for spec in plan:
+        raw_val = sample[spec.key] if spec.key in sample else sample.get(spec.scoped_key)
+        value = extract_value(raw_val, spec.mode or mode)
+        if value is not None and value != "":
+            filled += 1
+        if _is_empty(value):
+            continue
+        result.setdefault(spec.category, {})[spec.field] = value
+    return result, filled
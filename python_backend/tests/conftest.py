@@ -0,0 +1,47 @@
+"""
+Shared pytest setup for the backend tests
+
+The backend modules are imported from the python_backend directory the same
+way app.py imports its siblings. Caches and the process pool are pointed at
+per-session temp locations before app is imported, so the tests never touch
+the real transcode cache or spawn pool workers.
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, BACKEND_DIR)
+
+_session_dir = tempfile.mkdtemp(prefix='echopilot-tests-')
+os.environ['TRANSCODE_CACHE_DIR'] = os.path.join(_session_dir, 'transcode')
+os.environ.setdefault('PROCESS_POOL_WORKERS', '0')
+os.environ.setdefault('JOB_WORKERS', '1')
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def make_npz(tmp_path):
+    """Write a synthetic uint8 clip of shape (frames, height, width) and return its path"""
+    def make(frames: int = 12, height: int = 48, width: int = 64, name: str = 'clip.npz', compressed: bool = False):
+        rng = np.random.default_rng(frames * 1000 + height)
+        clip = rng.integers(0, 255, (frames, height, width), dtype=np.uint8)
+        path = tmp_path / name
+        (np.savez_compressed if compressed else np.savez)(path, clip)
+        return str(path)
+    return make
@@ -0,0 +1,96 @@
+"""
+/api/convert-npz conditional and byte-range responses
+
+The first request for a clip encodes it into the transcode cache; the
+follow-up requests are answered from the cached file (206/416) or from the
+cache key alone (304).
+"""
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def clip(client, make_npz):
+    """An NPZ whose MP4 is already in the transcode cache, with the full body and its ETag"""
+    path = make_npz(frames=12)
+    response = client.get('/api/convert-npz', query_string={'path': path})
+    assert response.status_code == 200
+    body = response.get_data()
+    assert body
+    return path, body, response.headers['ETag']
+
+
+def test_range_request_is_served_from_the_cache(client, clip):
+    path, body, etag = clip
+    response = client.get('/api/convert-npz', query_string={'path': path},
+                          headers={'Range': 'bytes=100-299'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-299/{len(body)}'
+    assert response.headers['ETag'] == etag
+    assert response.get_data() == body[100:300]
+
+
+def test_open_ended_range_returns_the_tail(client, clip):
+    path, body, _ = clip
+    response = client.get('/api/convert-npz', query_string={'path': path},
+                          headers={'Range': f'bytes={len(body) - 50}-'})
+    assert response.status_code == 206
+    assert response.get_data() == body[-50:]
+
+
+def test_unsatisfiable_range_returns_416(client, clip):
+    path, body, _ = clip
+    response = client.get('/api/convert-npz', query_string={'path': path},
+                          headers={'Range': f'bytes={len(body) + 10}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(body)}'
+
+
+def test_matching_etag_returns_304(client, clip):
+    path, _, etag = clip
+    response = client.get('/api/convert-npz', query_string={'path': path},
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert 'private' in response.headers['Cache-Control']
+    assert response.get_data() == b''
+
+
+def test_stale_etag_returns_the_full_file(client, clip):
+    path, body, etag = clip
+    response = client.get('/api/convert-npz', query_string={'path': path},
+                          headers={'If-None-Match': '"stale"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == etag
+    assert response.get_data() == body
+
+
+def test_matching_etag_skips_the_encode(app_module, client, make_npz):
+    # The cache key is the ETag, so a client holding it gets 304 even with nothing cached
+    path = make_npz(frames=8, name='uncached.npz')
+    codec = app_module.video_encoders.get(None).name
+    etag = app_module.transcode_cache.make_key(path, codec, 20.0)
+    response = client.get('/api/convert-npz', query_string={'path': path},
+                          headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert app_module.transcode_cache.get(etag) is None
+
+
+def test_range_on_a_cold_cache_waits_for_the_encode(app_module, client, make_npz):
+    path = make_npz(frames=10, name='cold.npz')
+    response = client.get('/api/convert-npz', query_string={'path': path},
+                          headers={'Range': 'bytes=0-99'})
+    assert response.status_code == 206
+    assert len(response.get_data()) == 100
+    full = client.get('/api/convert-npz', query_string={'path': path})
+    assert full.status_code == 200
+    assert full.get_data()[:100] == response.get_data()
+
+
+def test_two_channel_clip_is_rejected_before_encoding(client, tmp_path):
+    path = str(tmp_path / 'two_channel.npz')
+    np.savez(path, np.zeros((4, 16, 16, 2), dtype=np.uint8))
+    response = client.get('/api/convert-npz', query_string={'path': path})
+    assert response.status_code == 400
+    assert "channel count 2" in response.get_json()["error"]
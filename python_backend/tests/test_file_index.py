@@ -0,0 +1,119 @@
+"""
+Cursor paging of FileIndex.list
+"""
+
+import os
+
+import pytest
+
+from file_index import SORT_FIELDS, FileIndex, InvalidCursor, encode_cursor
+
+# name -> (size, mtime seconds); two sizes and two mtimes tie so the path tiebreak is exercised
+FILES = {
+    'a.npz': (50, 1000), 'b.npz': (10, 1003), 'c.npz': (30, 1001), 'd.npz': (30, 1005),
+    'e.npz': (70, 1002), 'f.npz': (20, 1003), 'g.npz': (60, 1004),
+}
+
+
+@pytest.fixture
+def tree(tmp_path):
+    for name, (size, mtime) in FILES.items():
+        path = tmp_path / name
+        path.write_bytes(b'\0' * size)
+        os.utime(path, (mtime, mtime))
+    (tmp_path / 'notes.txt').write_text('not listed')
+    return tmp_path
+
+
+def _expected(root, sort: str, descending: bool):
+    if sort == 'name':
+        key = lambda name: name
+    elif sort == 'size':
+        key = lambda name: (FILES[name][0], name)
+    else:
+        key = lambda name: (FILES[name][1], name)
+    return [str(root / name) for name in sorted(FILES, key=key, reverse=descending)]
+
+
+def _page_through(index, root, sort, descending, limit):
+    paths, pages, cursor = [], 0, None
+    while True:
+        page = index.list(str(root), ['npz'], sort=sort, descending=descending, cursor=cursor, limit=limit)
+        assert page["total"] == len(FILES)
+        paths.extend(entry["path"] for entry in page["entries"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return paths, pages
+        assert pages <= len(FILES), "cursor did not advance"
+
+
+@pytest.mark.parametrize("sort", SORT_FIELDS)
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("limit", [1, 3, 7, 10])
+def test_cursor_round_trip(tree, sort, descending, limit):
+    paths, pages = _page_through(FileIndex(), tree, sort, descending, limit)
+    assert paths == _expected(tree, sort, descending)
+    assert pages == max(1, -(-len(FILES) // limit))
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_last_page_has_no_cursor(tree, descending):
+    index = FileIndex()
+    first = index.list(str(tree), ['npz'], sort='size', descending=descending, limit=len(FILES) - 1)
+    assert first["next_cursor"] is not None
+    last = index.list(str(tree), ['npz'], sort='size', descending=descending, cursor=first["next_cursor"],
+                      limit=len(FILES) - 1)
+    assert len(last["entries"]) == 1
+    assert last["next_cursor"] is None
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_cursor_past_the_end_returns_an_empty_page(tree, descending):
+    edge = (0, '') if descending else (10 ** 6, '\uffff')
+    page = FileIndex().list(str(tree), ['npz'], sort='size', descending=descending,
+                            cursor=encode_cursor('size', edge))
+    assert page["entries"] == [] and page["next_cursor"] is None
+
+
+def test_files_added_between_pages_do_not_shift_the_cursor(tree):
+    index = FileIndex()
+    first = index.list(str(tree), ['npz'], sort='name', limit=3)
+    # Sorts before the cursor: must not appear on later pages or push entries back onto them
+    (tree / '0.npz').write_bytes(b'')
+    rest, cursor = [], first["next_cursor"]
+    while cursor:
+        page = index.list(str(tree), ['npz'], sort='name', cursor=cursor, limit=3)
+        rest.extend(entry["path"] for entry in page["entries"])
+        cursor = page["next_cursor"]
+    assert [entry["path"] for entry in first["entries"]] + rest == _expected(tree, 'name', False)
+
+
+def test_empty_directory(tmp_path):
+    page = FileIndex().list(str(tmp_path), ['npz'])
+    assert page == {"entries": [], "total": 0, "next_cursor": None}
+
+
+def test_cursor_from_another_sort_is_rejected(tree):
+    index = FileIndex()
+    cursor = index.list(str(tree), ['npz'], sort='mtime', limit=2)["next_cursor"]
+    with pytest.raises(InvalidCursor):
+        index.list(str(tree), ['npz'], sort='size', cursor=cursor)
+    with pytest.raises(InvalidCursor):
+        index.list(str(tree), ['npz'], sort='size', cursor='not a cursor')
+
+
+@pytest.mark.parametrize("sort,key", [
+    ('size', ['x', 'y']), ('mtime', ['1000', 'a.npz']), ('size', [True, 'a.npz']),
+    ('size', [10, 5]), ('name', [0, 'a.npz']), ('name', ['', None]),
+])
+def test_cursor_with_mistyped_key_is_rejected(tree, sort, key):
+    with pytest.raises(InvalidCursor):
+        FileIndex().list(str(tree), ['npz'], sort=sort, cursor=encode_cursor(sort, tuple(key)))
+
+
+def test_list_route_returns_400_for_mistyped_cursor(client, tree):
+    response = client.get('/api/list', query_string={
+        'root': str(tree), 'sort': 'size', 'recursive': 'true', 'cursor': encode_cursor('size', ('x', 'y'))})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Malformed cursor"}
@@ -0,0 +1,61 @@
+"""
+JobManager submissions sharing the transcode cache with /api/convert-npz
+"""
+
+import threading
+
+import pytest
+
+from jobs import JobManager
+from transcode_cache import TranscodeCache
+
+
+class _Encoder:
+    name = 'test-encoder'
+
+
+def _wait_until(predicate):
+    for _ in range(500):
+        if predicate():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("condition not reached")
+
+
+@pytest.fixture
+def manager(tmp_path):
+    return JobManager(TranscodeCache(str(tmp_path / 'cache')), workers=1)
+
+
+def test_convert_job_waits_for_a_request_already_encoding(manager, make_npz):
+    path = make_npz()
+    key = manager.key_for('convert', path, _Encoder.name, 20.0, {})
+    _, tmp = manager.cache.claim(key)  # a /api/convert-npz request is encoding this clip
+
+    job, created = manager.submit('convert', path, _Encoder(), 20.0)
+    assert created and job.state == "queued" and job.phase == "wait"
+    assert not manager.stats()["started"]
+
+    with open(tmp, 'wb') as f:
+        f.write(b'mp4')
+    manager.cache.publish(key, tmp)
+    _wait_until(lambda: job.finished)
+    assert job.state == "done" and job.result == {"cached": True}
+    assert not manager.stats()["started"]
+    assert manager.cache.stats()["building"] == 0
+
+
+def test_submissions_do_not_count_as_cache_lookups(manager, make_npz):
+    path = make_npz()
+    key = manager.key_for('convert', path, _Encoder.name, 20.0, {})
+    tmp = manager.cache.new_temp_path(key)
+    with open(tmp, 'wb') as f:
+        f.write(b'mp4')
+    manager.cache.publish(key, tmp)
+
+    first, created = manager.submit('convert', path, _Encoder(), 20.0)
+    again, coalesced = manager.submit('convert', path, _Encoder(), 20.0)
+    assert created and first.state == "done"
+    assert again is first and not coalesced
+    stats = manager.cache.stats()
+    assert stats["hits"] == 0 and stats["misses"] == 0
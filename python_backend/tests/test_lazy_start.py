@@ -0,0 +1,36 @@
+"""
+LazyStart, the start-on-first-use holder for pools and threads
+"""
+
+import threading
+
+from lazy_start import LazyStart
+
+
+def test_factory_runs_once_across_threads():
+    calls = []
+    lazy = LazyStart(lambda: calls.append(1) or object())
+    barrier = threading.Barrier(8)
+    results = []
+
+    def get():
+        barrier.wait()
+        results.append(lazy.get())
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+
+
+def test_reset_returns_the_old_value_and_restarts():
+    lazy = LazyStart(object)
+    assert not lazy.started and lazy.reset() is None
+    first = lazy.get()
+    assert lazy.started
+    assert lazy.reset() is first and not lazy.started
+    assert lazy.get() is not first
+
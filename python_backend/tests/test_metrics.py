@@ -0,0 +1,42 @@
+"""
+Prometheus rendering of registered collectors
+"""
+
+from metrics import Metrics
+
+
+def _series(text: str) -> dict:
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if line and not line.startswith('#'))
+
+
+def test_collector_counters_and_gauges():
+    metrics = Metrics()
+    metrics.register_collector('cache', lambda: {"hits": 3, "entries": 2, "started": True, "dir": "/tmp"},
+                               counters=('hits',))
+    text = metrics.render()
+    lines = text.splitlines()
+
+    assert "# TYPE echopilot_cache_hits_total counter" in lines
+    assert "# TYPE echopilot_cache_entries gauge" in lines
+    assert any(line.startswith("# HELP echopilot_cache_hits_total ") for line in lines)
+    assert any(line.startswith("# HELP echopilot_cache_entries ") for line in lines)
+    series = _series(text)
+    assert series["echopilot_cache_hits_total"] == "3"
+    assert series["echopilot_cache_entries"] == "2"
+    assert series["echopilot_cache_started"] == "1"
+    assert "echopilot_cache_hits" not in series
+    assert not any("dir" in name for name in series)
+
+
+def test_failing_collector_is_reported_not_raised():
+    metrics = Metrics()
+    metrics.register_collector('broken', lambda: 1 / 0)
+    assert "# collector broken failed: division by zero" in metrics.render()
+
+
+def test_app_exports_cache_counters(client):
+    text = client.get('/api/metrics').get_data(as_text=True)
+    assert "# TYPE echopilot_transcode_cache_misses_total counter" in text
+    assert "# TYPE echopilot_jobs_submitted_total counter" in text
+    assert "# TYPE echopilot_warmup_completed_total counter" in text
+    assert "# TYPE echopilot_transcode_cache_bytes gauge" in text
@@ -0,0 +1,98 @@
+"""
+NpzFrameStream chunked decoding against a whole-array np.load
+"""
+
+import numpy as np
+import pytest
+
+from npz_stream import NpzFrameStream, frame_chunks, take_frames, unit_range
+from renditions import BgrFrameConverter, clip_dimensions, iter_bgr_frames
+
+
+def _write(tmp_path, clip: np.ndarray, compressed: bool) -> str:
+    path = str(tmp_path / 'clip.npz')
+    (np.savez_compressed if compressed else np.savez)(path, frames=clip)
+    return path
+
+
+def _clip(frames: int, dtype, channels=None) -> np.ndarray:
+    # Width stays above the frame count so 3D clips read as frames-first
+    shape = (frames, 4, 16) + ((channels,) if channels else ())
+    rng = np.random.default_rng(frames)
+    if np.dtype(dtype).kind == 'f':
+        return rng.random(shape, dtype=np.float32).astype(dtype)
+    return rng.integers(0, 255, shape, dtype=np.uint8)
+
+
+@pytest.mark.parametrize("frames", [1, 7, 10, 13])
+@pytest.mark.parametrize("chunk_frames", [1, 3, 4, 16])
+@pytest.mark.parametrize("compressed", [False, True])
+@pytest.mark.parametrize("dtype,channels", [(np.uint8, None), (np.float32, None), (np.uint8, 3)])
+def test_chunks_concatenate_to_the_full_decode(tmp_path, frames, chunk_frames, compressed, dtype, channels):
+    clip = _clip(frames, dtype, channels)
+    path = _write(tmp_path, clip, compressed)
+    stream = NpzFrameStream(path, chunk_bytes=chunk_frames * clip[0].nbytes)
+    assert stream.streamable and stream.chunk_frames == chunk_frames
+
+    chunks = list(stream.iter_chunks())
+    assert [len(c) for c in chunks] == [min(chunk_frames, frames - i) for i in range(0, frames, chunk_frames)]
+    np.testing.assert_array_equal(np.concatenate(chunks), np.load(path)['frames'])
+    np.testing.assert_array_equal(np.concatenate(list(frame_chunks(stream))), clip)
+
+
+@pytest.mark.parametrize("start,stop,step", [
+    (0, None, 1), (2, None, 1), (0, 9, 1), (3, 11, 1),
+    (0, None, 2), (1, None, 3), (4, 13, 4), (5, 6, 1), (12, None, 5), (6, 6, 1),
+])
+def test_slices_across_chunk_boundaries(tmp_path, start, stop, step):
+    clip = _clip(13, np.uint8)
+    stream = NpzFrameStream(_write(tmp_path, clip, True), chunk_bytes=4 * clip[0].nbytes)
+    chunks = list(stream.iter_chunks(start, stop, step))
+    expected = clip[start:stop:step]
+    got = np.concatenate(chunks) if chunks else np.empty((0,) + clip.shape[1:], clip.dtype)
+    np.testing.assert_array_equal(got, expected)
+    assert stream.max(start, stop, step) == (expected.max() if len(expected) else None)
+
+
+def test_take_frames_from_a_stream(tmp_path):
+    clip = _clip(11, np.uint8)
+    stream = NpzFrameStream(_write(tmp_path, clip, True), chunk_bytes=3 * clip[0].nbytes)
+    indices = [0, 2, 3, 5, 6, 10]
+    np.testing.assert_array_equal(take_frames(stream, indices), clip[indices])
+
+
+@pytest.mark.parametrize("peak", [0.9, 4.0])
+def test_bgr_conversion_matches_the_in_memory_clip(tmp_path, peak):
+    # Only the last chunk decides whether the float clip is in [0, 1]
+    clip = _clip(10, np.float32) * 0.5
+    clip[-1, 0, 0] = peak
+    stream = NpzFrameStream(_write(tmp_path, clip, True), chunk_bytes=4 * clip[0].nbytes)
+    assert unit_range(stream) == unit_range(clip) == (peak <= 1.0)
+    streamed = [frame.copy() for frame in iter_bgr_frames(stream)]
+    in_memory = [frame.copy() for frame in iter_bgr_frames(clip)]
+    np.testing.assert_array_equal(np.stack(streamed), np.stack(in_memory))
+
+
+@pytest.mark.parametrize("frame_shape", [(4, 5), (4, 5, 1), (4, 5, 3), (4, 5, 4)])
+def test_bgr_converter_channels(frame_shape):
+    frame = np.random.default_rng(0).integers(0, 255, frame_shape, dtype=np.uint8)
+    out = BgrFrameConverter(frame_shape, np.uint8)(frame)
+    if len(frame_shape) == 2 or frame_shape[2] == 1:
+        expected = np.repeat(frame.reshape(4, 5, 1), 3, axis=-1)
+    elif frame_shape[2] == 3:
+        expected = frame[:, :, ::-1]
+    else:
+        expected = frame[:, :, :3]  # extra channels are dropped, as in the whole-clip conversion
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_two_channel_frames_are_rejected():
+    with pytest.raises(ValueError, match="channel count 2"):
+        BgrFrameConverter((4, 5, 2), np.uint8)
+    with pytest.raises(ValueError, match="channel count 2"):
+        clip_dimensions(np.zeros((3, 4, 5, 2), dtype=np.uint8))
+
+
+def test_frames_last_layout_is_not_streamable(tmp_path):
+    clip = np.zeros((48, 64, 5), dtype=np.uint8)  # (height, width, frames)
+    assert not NpzFrameStream(_write(tmp_path, clip, False)).streamable
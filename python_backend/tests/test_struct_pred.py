@@ -0,0 +1,42 @@
+"""
+struct_pred field plan against output recorded from the previous pandas path
+
+tests/fixtures/struct_pred_golden.json holds synthetic exam entries and, for
+every mode, the (struct_pred, total_fields, filled_fields) the DataFrame-based
+implementation produced. Regenerate it with
+python benchmarks/bench_struct_pred.py --record tests/fixtures/struct_pred_golden.json
+"""
+
+import json
+import math
+import os
+
+import pytest
+
+from struct_pred import apply_field_plan
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'struct_pred_golden.json')
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(_same(x, y) for x, y in zip(a, b))
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return type(a) is type(b) and a == b
+
+
+with open(GOLDEN_PATH) as f:
+    GOLDEN = json.load(f)
+
+CASES = [(i, mode) for i in range(len(GOLDEN["samples"])) for mode in GOLDEN["modes"]]
+
+
+@pytest.mark.parametrize("index,mode", CASES)
+def test_field_plan_matches_pandas_path(app_module, index, mode):
+    sample = GOLDEN["samples"][index]
+    struct_pred, filled = apply_field_plan(app_module.struct_pred_plan, sample, mode)
+    assert _same([struct_pred, len(app_module.struct_pred_plan), filled], GOLDEN["expected"][index][mode])
+
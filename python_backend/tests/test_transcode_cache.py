@@ -0,0 +1,60 @@
+"""
+Single-flight builds in TranscodeCache.claim
+"""
+
+import threading
+
+from transcode_cache import TranscodeCache
+
+
+def _wait_for_waiters(cache: TranscodeCache, count: int):
+    for _ in range(500):
+        if cache.stats()["coalesced"] >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("waiters did not arrive")
+
+
+def test_concurrent_misses_build_once(tmp_path):
+    cache = TranscodeCache(str(tmp_path))
+    path, tmp = cache.claim('a' * 64)
+    assert path is None and tmp is not None
+
+    results = []
+    waiters = [threading.Thread(target=lambda: results.append(cache.claim('a' * 64))) for _ in range(3)]
+    for thread in waiters:
+        thread.start()
+    _wait_for_waiters(cache, 3)
+
+    with open(tmp, 'wb') as f:
+        f.write(b'mp4')
+    published = cache.publish('a' * 64, tmp)
+    for thread in waiters:
+        thread.join(5)
+
+    assert results == [(published, None)] * 3
+    assert cache.stats()["building"] == 0
+
+
+def test_waiter_takes_over_a_failed_build(tmp_path):
+    cache = TranscodeCache(str(tmp_path))
+    _, tmp = cache.claim('b' * 64)
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(cache.claim('b' * 64)))
+    waiter.start()
+    _wait_for_waiters(cache, 1)
+    cache.discard(tmp)
+    waiter.join(5)
+
+    (path, retry_tmp), = results
+    assert path is None and retry_tmp is not None and retry_tmp != tmp
+    cache.discard(retry_tmp)
+    assert cache.stats()["building"] == 0
+
+
+def test_claim_after_publish_is_a_hit(tmp_path):
+    cache = TranscodeCache(str(tmp_path))
+    _, tmp = cache.claim('c' * 64)
+    published = cache.publish('c' * 64, tmp)
+    assert cache.claim('c' * 64) == (published, None)
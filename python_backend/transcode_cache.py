@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache for transcoded MP4 files and other clip renditions
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'echopilot-transcode-cache')
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GiB
+STALE_PART_SECONDS = 3600
+# A build whose temp file has not been written to for this long is taken over by the next caller
+BUILD_STALL_SECONDS = 120
+BUILD_POLL_SECONDS = 1.0
+
+
+class _Build:
+    """Single-flight slot of an artifact one caller in this process is building"""
+
+    def __init__(self, tmp_path: str):
+        self.tmp_path = tmp_path
+        self.started = time.time()
+        self.done = threading.Event()
+
+    def stalled(self) -> bool:
+        try:
+            last_write = os.path.getmtime(self.tmp_path)
+        except OSError:
+            last_write = self.started
+        return time.time() - max(last_write, self.started) > BUILD_STALL_SECONDS
+
+
+class TranscodeCache:
+    """LRU cache of MP4 artifacts keyed by (absolute path, mtime, size, codec, fps).
+
+    Renditions of other types (.npy frame arrays, .jpg thumbnail strips) share
+    the directory and byte budget; their suffix is part of the entry name.
+
+    Artifacts are written to a temporary file inside the cache directory and
+    published with an atomic rename, so readers never observe a partial MP4.
+    The in-memory index is rebuilt from the directory on startup and falls
+    back to the filesystem on a miss, which lets several worker processes
+    share one cache directory. Concurrent misses for the same artifact within
+    one process are coalesced by claim(): the first caller builds it, the
+    others wait for its publish.
+    """
+
+    SUFFIX = '.mp4'
+    SUFFIXES = ('.mp4', '.npy', '.jpg')
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # file name (key + suffix) -> size in bytes
+        self._building: Dict[str, _Build] = {}  # file name -> build in progress
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan()
+
+    @classmethod
+    def from_env(cls) -> "TranscodeCache":
+        """Build a cache from TRANSCODE_CACHE_DIR / TRANSCODE_CACHE_MAX_BYTES"""
+        cache_dir = os.environ.get('TRANSCODE_CACHE_DIR') or DEFAULT_CACHE_DIR
+        try:
+            max_bytes = int(os.environ.get('TRANSCODE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES))
+        except ValueError:
+            logger.warning("Invalid TRANSCODE_CACHE_MAX_BYTES, using default")
+            max_bytes = DEFAULT_MAX_BYTES
+        return cls(cache_dir, max_bytes)
+
+    def _scan(self):
+        """Index artifacts left by a previous run, oldest access first"""
+        found = []
+        stale_before = time.time() - STALE_PART_SECONDS
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file():
+                continue
+            if any(entry.name.endswith('.part' + suffix) for suffix in self.SUFFIXES):
+                # Leftover from an interrupted encode; recent ones may belong to another worker
+                if entry.stat().st_mtime > stale_before:
+                    continue
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            if entry.name.endswith(self.SUFFIXES):
+                st = entry.stat()
+                found.append((st.st_atime, entry.name, st.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total_bytes += size
+        if found:
+            logger.info(f"Transcode cache: indexed {len(found)} artifacts ({self._total_bytes} bytes) in {self.cache_dir}")
+        self._evict_locked()
+
+    @staticmethod
+    def make_key(npz_path: str, codec: str, fps: float, **variant) -> str:
+        """Derive the content address for an NPZ/encoding combination.
+
+        Extra keyword arguments describe further variants of the artifact
+        (e.g. a rendition size) and are folded into the key in sorted order.
+        """
+        abs_path = os.path.abspath(npz_path)
+        st = os.stat(abs_path)
+        parts = [abs_path, str(st.st_mtime_ns), str(st.st_size), codec, f"{float(fps):g}"]
+        parts.extend(f"{k}={variant[k]}" for k in sorted(variant))
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def path_for(self, key: str, suffix: str = SUFFIX) -> str:
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def get(self, key: str, suffix: str = SUFFIX, count: bool = True) -> Optional[str]:
+        """Return the cached artifact path for key, or None on a miss.
+
+        count=False leaves the hit/miss counters alone, for internal existence
+        checks that are not client lookups.
+        """
+        name = key + suffix
+        path = self.path_for(key, suffix)
+        with self._lock:
+            if name in self._entries:
+                if os.path.exists(path):
+                    self._entries.move_to_end(name)
+                    if count:
+                        self.hits += 1
+                    self._touch(path)
+                    return path
+                # Removed behind our back (another worker evicted it)
+                self._total_bytes -= self._entries.pop(name)
+            elif os.path.exists(path):
+                # Published by another worker process sharing the directory
+                size = os.path.getsize(path)
+                self._entries[name] = size
+                self._total_bytes += size
+                if count:
+                    self.hits += 1
+                self._touch(path)
+                return path
+            if count:
+                self.misses += 1
+            return None
+
+    @staticmethod
+    def _touch(path: str):
+        # Persist recency so LRU order survives restarts
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def new_temp_path(self, key: str, suffix: str = SUFFIX) -> str:
+        """Create an empty temp file in the cache directory for an encode in progress"""
+        # Encoders pick the container from the extension, so temp files keep the suffix last
+        fd, tmp_path = tempfile.mkstemp(prefix=key[:16] + '-', suffix='.part' + suffix,
+                                        dir=self.cache_dir)
+        os.close(fd)
+        return tmp_path
+
+    def claim(self, key: str, suffix: str = SUFFIX, wait: bool = True) -> Tuple[Optional[str], Optional[str]]:
+        """After a miss: build the artifact, or wait for the caller already building it.
+
+        Returns (None, tmp_path) when this caller is the builder; it must
+        publish() or discard() tmp_path. Returns (path, None) when another
+        caller in this process published the artifact while we waited. If that
+        build fails (or stalls for BUILD_STALL_SECONDS) a waiter takes it over.
+        With wait=False, (None, None) is returned instead of waiting for a
+        build in progress.
+        """
+        name = key + suffix
+        waited = False
+        while True:
+            with self._lock:
+                build = self._building.get(name)
+                if build is not None and not build.stalled():
+                    if not wait:
+                        return None, None
+                    if not waited:
+                        self.coalesced += 1
+                        waited = True
+                elif build is None and os.path.exists(self.path_for(key, suffix)):
+                    pass  # Published between the caller's miss and now
+                else:
+                    if build is not None:
+                        logger.warning(f"Transcode cache: build of {name} stalled, taking it over")
+                    tmp_path = self.new_temp_path(key, suffix)
+                    self._building[name] = _Build(tmp_path)
+                    return None, tmp_path
+            if build is not None:
+                while not build.done.wait(BUILD_POLL_SECONDS):
+                    if build.stalled():
+                        break
+            # The caller's own lookup already counted the miss
+            path = self.get(key, suffix, count=False)
+            if path is not None:
+                return path, None
+
+    def _release_locked(self, tmp_path: str):
+        for name, build in list(self._building.items()):
+            if build.tmp_path == tmp_path:
+                del self._building[name]
+                build.done.set()
+
+    def publish(self, key: str, tmp_path: str, suffix: str = SUFFIX) -> str:
+        """Atomically move a finished temp file into place and return its path"""
+        name = key + suffix
+        path = self.path_for(key, suffix)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            if name in self._entries:
+                self._total_bytes -= self._entries.pop(name)
+            self._entries[name] = size
+            self._total_bytes += size
+            self._evict_locked()
+            self._release_locked(tmp_path)
+        logger.info(f"Transcode cache: published {path} ({size} bytes)")
+        return path
+
+    def discard(self, tmp_path: str):
+        """Remove a temp file from a failed encode (waiters in claim() then retry the build)"""
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        with self._lock:
+            self._release_locked(tmp_path)
+
+    def _evict_locked(self):
+        # Never evict the most recently used entry, even if it alone exceeds the budget
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # e.g. still open for sending on Windows (or mapped .npy); it is re-adopted on the next get()
+                logger.warning(f"Transcode cache: could not evict {name}: {e}")
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Union[int, str]]:
+        with self._lock:
+            return {
+                "dir": self.cache_dir,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "coalesced": self.coalesced,
+                "building": len(self._building),
+            }
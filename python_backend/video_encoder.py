@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+MP4 encoders for /api/convert-npz and /api/preprocess (mp4_blob)
+
+FfmpegPipeEncoder feeds raw BGR frames to an ffmpeg subprocess on stdin and
+reads a fragmented MP4 (moov first, then one fragment per keyframe) from
+stdout, so nothing touches the disk and the first bytes can be sent to the
+client while later frames are still being encoded. The ffmpeg binary comes
+from FFMPEG_BINARY, the PATH, or the optional imageio-ffmpeg package.
+
+OpenCVEncoder is the fallback when ffmpeg is not available. cv2.VideoWriter
+can only write to a file, so it encodes into a temp file that is always
+removed once its bytes have been read.
+
+EncoderRegistry probes every candidate (ffmpeg per preset, OpenCV per fourcc)
+once, on the first request that needs an encoder, by encoding a short
+synthetic clip, and then serves requests from the fastest working encoder for
+the requested preset. Importing the app (CLI tools, benchmarks, every server
+worker) therefore runs no test encodes.
+"""
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CHUNK_BYTES = 64 * 1024
+
+# Fragmented MP4: empty moov up front, a new fragment at every keyframe
+FRAGMENTED_MP4_FLAGS = 'frag_keyframe+empty_moov+default_base_moof'
+
+# Quality-vs-speed presets -> libx264 arguments
+PRESETS: Dict[str, Sequence[str]] = {
+    'fast': ('-preset', 'ultrafast', '-crf', '28'),
+    'balanced': ('-preset', 'veryfast', '-crf', '23'),
+    'quality': ('-preset', 'medium', '-crf', '18'),
+}
+DEFAULT_PRESET = 'balanced'
+
+# OpenCV fourccs tried by the probe; H.264 ones play in browsers, MPEG-4 part 2 ones mostly do not
+OPENCV_FOURCCS = ('avc1', 'H264', 'mp4v', 'XVID')
+BROWSER_PLAYABLE_FOURCCS = {'avc1', 'H264'}
+
+PROBE_FRAMES = 30
+PROBE_SIZE = (256, 256)  # width, height
+
+
+def find_ffmpeg() -> Optional[str]:
+    """Locate an ffmpeg binary: FFMPEG_BINARY, then the PATH, then imageio-ffmpeg if installed"""
+    configured = os.environ.get('FFMPEG_BINARY')
+    if configured:
+        return configured if os.path.exists(configured) else shutil.which(configured)
+    found = shutil.which('ffmpeg')
+    if found:
+        return found
+    try:
+        import imageio_ffmpeg  # type: ignore
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+class EncoderError(RuntimeError):
+    """Raised when an encoder cannot produce a video"""
+
+
+class FfmpegPipeEncoder:
+    """Encode through an ffmpeg subprocess: raw frames on stdin, fragmented MP4 on stdout"""
+
+    streams = True
+    browser_playable = True
+
+    def __init__(self, binary: str, codec: str = 'libx264', preset: str = DEFAULT_PRESET):
+        self.binary = binary
+        self.codec = codec
+        self.preset = preset
+        self.codec_args = tuple(PRESETS[preset])
+
+    @property
+    def name(self) -> str:
+        return f"ffmpeg-{self.codec}-{self.preset}"
+
+    def command(self, fps: float, width: int, height: int) -> List[str]:
+        return [
+            self.binary, '-hide_banner', '-loglevel', 'error', '-nostdin',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', f'{float(fps):g}',
+            '-i', 'pipe:0',
+            '-an', '-c:v', self.codec, *self.codec_args,
+            # yuv420p needs even dimensions; pad odd-sized clips by one pixel
+            '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p',
+            '-movflags', FRAGMENTED_MP4_FLAGS, '-f', 'mp4', 'pipe:1',
+        ]
+
+    def stream(self, frames: Iterable[np.ndarray], fps: float, width: int, height: int) -> Iterator[bytes]:
+        """Yield MP4 bytes as ffmpeg produces them; closing the generator stops the encode"""
+        proc = subprocess.Popen(self.command(fps, width, height), stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        errors: List[bytes] = []
+        feed_error: List[BaseException] = []
+
+        def feed():
+            try:
+                for frame in frames:
+                    proc.stdin.write(memoryview(np.ascontiguousarray(frame, dtype=np.uint8)).cast('B'))
+            except (BrokenPipeError, ValueError):
+                pass  # ffmpeg exited (or was killed); its exit status is reported below
+            except BaseException as e:
+                feed_error.append(e)
+            finally:
+                try:
+                    proc.stdin.close()
+                except OSError:
+                    pass
+
+        def drain_stderr():
+            errors.append(proc.stderr.read())
+
+        threads = [threading.Thread(target=feed, name='ffmpeg-feed', daemon=True),
+                   threading.Thread(target=drain_stderr, name='ffmpeg-stderr', daemon=True)]
+        for t in threads:
+            t.start()
+        finished = False
+        try:
+            while True:
+                chunk = proc.stdout.read1(CHUNK_BYTES)
+                if not chunk:
+                    break
+                yield chunk
+            finished = True
+        finally:
+            if not finished:
+                proc.kill()
+            proc.stdout.close()
+            returncode = proc.wait()
+            for t in threads:
+                t.join()
+        if feed_error:
+            raise EncoderError(f"Failed to read frames for ffmpeg: {feed_error[0]}") from feed_error[0]
+        if returncode != 0:
+            message = b''.join(errors).decode('utf-8', 'replace').strip().splitlines()
+            raise EncoderError(f"ffmpeg exited with {returncode}: {message[-1] if message else 'no output'}")
+
+    def encode(self, frames: Iterable[np.ndarray], fps: float, width: int, height: int) -> bytes:
+        return b''.join(self.stream(frames, fps, width, height))
+
+    def write_file(self, frames: Iterable[np.ndarray], fps: float, width: int, height: int, path: str):
+        with open(path, 'wb') as f:
+            for chunk in self.stream(frames, fps, width, height):
+                f.write(chunk)
+
+
+class OpenCVEncoder:
+    """cv2.VideoWriter, trying each fourcc in order until one opens"""
+
+    streams = False
+    preset = None  # VideoWriter exposes no quality/speed trade-off
+
+    def __init__(self, fourccs: Sequence[str] = ('H264', 'XVID')):
+        self.fourccs = tuple(fourccs)
+        self.browser_playable = self.fourccs[0] in BROWSER_PLAYABLE_FOURCCS
+
+    @property
+    def name(self) -> str:
+        return f"opencv-{self.fourccs[0]}"
+
+    def write_file(self, frames: Iterable[np.ndarray], fps: float, width: int, height: int, path: str) -> str:
+        """Encode into path (container chosen by its extension); returns the fourcc used"""
+        out = None
+        for fourcc in self.fourccs:
+            out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, (width, height))
+            if out.isOpened():
+                break
+            logger.warning(f"{fourcc} codec failed, trying next")
+        else:
+            raise EncoderError(f"Failed to create video writer (tried {', '.join(self.fourccs)})")
+        try:
+            for frame in frames:
+                out.write(frame)
+        finally:
+            out.release()
+        return fourcc
+
+    def stream(self, frames: Iterable[np.ndarray], fps: float, width: int, height: int) -> Iterator[bytes]:
+        fd, tmp_path = tempfile.mkstemp(prefix='echopilot-', suffix='.mp4')
+        os.close(fd)
+        try:
+            self.write_file(frames, fps, width, height, tmp_path)
+            with open(tmp_path, 'rb') as f:
+                while True:
+                    chunk = f.read(CHUNK_BYTES)
+                    if not chunk:
+                        break
+                    yield chunk
+        finally:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def encode(self, frames: Iterable[np.ndarray], fps: float, width: int, height: int) -> bytes:
+        return b''.join(self.stream(frames, fps, width, height))
+
+
+def _probe_frames() -> List[np.ndarray]:
+    """Short synthetic clip (moving gradient plus noise) used to check and time encoders"""
+    width, height = PROBE_SIZE
+    rng = np.random.default_rng(0)
+    ramp = np.add.outer(np.arange(height), np.arange(width)).astype(np.float32)
+    frames = []
+    for i in range(PROBE_FRAMES):
+        gray = (ramp + i * 8) % 256 + rng.normal(0, 12, ramp.shape)
+        frames.append(cv2.cvtColor(np.clip(gray, 0, 255).astype(np.uint8), cv2.COLOR_GRAY2BGR))
+    return frames
+
+
+class EncoderRegistry:
+    """Encoders probed once on first use; requests get the fastest working one for their preset.
+
+    H.264 encoders are preferred over faster MPEG-4 part 2 ones (mp4v/XVID)
+    because browsers cannot play the latter; those are only used when no
+    H.264 encoder works.
+    """
+
+    def __init__(self, candidates: Sequence, default_preset: str = DEFAULT_PRESET):
+        self.default_preset = default_preset if default_preset in PRESETS else DEFAULT_PRESET
+        self.candidates = list(candidates)
+        self.results: List[dict] = []
+        self.probe_ms: Optional[float] = None
+        self._working: List[tuple] = []  # (encoder, fps)
+        self._selected: Optional[Dict[str, object]] = None
+        self._lock = threading.Lock()
+
+    def _probe(self) -> Dict[str, object]:
+        # Concurrent first requests wait for a single probe
+        with self._lock:
+            if self._selected is None:
+                self._run_probe()
+            return self._selected
+
+    def _run_probe(self):
+        t0 = time.perf_counter()
+        frames = _probe_frames()
+        for encoder in self.candidates:
+            result = {"name": encoder.name, "preset": encoder.preset, "browser_playable": encoder.browser_playable}
+            try:
+                start = time.perf_counter()
+                size = len(encoder.encode(frames, 20, PROBE_SIZE[0], PROBE_SIZE[1]))
+                elapsed = time.perf_counter() - start
+                if size == 0:
+                    raise EncoderError("produced an empty file")
+                fps = len(frames) / elapsed
+                result.update(ok=True, encode_fps=round(fps, 1), probe_bytes=size)
+                self._working.append((encoder, fps))
+            except Exception as e:
+                result.update(ok=False, error=str(e))
+            self.results.append(result)
+        self.probe_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+        self._selected = {preset: self._select(preset) for preset in PRESETS}
+        logger.info(f"Video encoders probed in {self.probe_ms} ms: "
+                    + ", ".join(f"{r['name']}={r.get('encode_fps', 'failed')}" for r in self.results))
+        logger.info("Selected encoders: " + ", ".join(
+            f"{preset}={enc.name if enc else None}" for preset, enc in self._selected.items()))
+
+    @classmethod
+    def from_env(cls) -> "EncoderRegistry":
+        """VIDEO_ENCODER=auto | ffmpeg | opencv restricts the candidates; VIDEO_PRESET sets the default preset"""
+        choice = os.environ.get('VIDEO_ENCODER', 'auto').lower()
+        candidates = []
+        if choice != 'opencv':
+            binary = find_ffmpeg()
+            if binary:
+                candidates.extend(FfmpegPipeEncoder(binary, preset=preset) for preset in PRESETS)
+            elif choice == 'ffmpeg':
+                logger.warning("VIDEO_ENCODER=ffmpeg but no ffmpeg binary was found, using OpenCV")
+        if choice != 'ffmpeg' or not candidates:
+            candidates.extend(OpenCVEncoder((fourcc,)) for fourcc in OPENCV_FOURCCS)
+        return cls(candidates, os.environ.get('VIDEO_PRESET', DEFAULT_PRESET).lower())
+
+    def _select(self, preset: str):
+        # Encoders without presets (OpenCV) serve every preset
+        usable = [(enc, fps) for enc, fps in self._working if enc.preset in (None, preset)]
+        if not usable:
+            return None
+        return max(usable, key=lambda item: (item[0].browser_playable, item[1]))[0]
+
+    def get(self, preset: Optional[str] = None):
+        """Encoder for preset (default preset if None); raises EncoderError if none works"""
+        preset = preset or self.default_preset
+        if preset not in PRESETS:
+            raise ValueError(f"Unknown preset '{preset}', expected one of {list(PRESETS)}")
+        encoder = self._probe()[preset]
+        if encoder is None:
+            raise EncoderError("No working video encoder was found")
+        return encoder
+
+    def stats(self) -> dict:
+        """Probe results so far; reporting them does not start the probe"""
+        selected = self._selected
+        return {
+            "default_preset": self.default_preset,
+            "probed": selected is not None,
+            "selected": {preset: enc.name if enc else None for preset, enc in (selected or {}).items()},
+            "probe_ms": self.probe_ms,
+            "probe": self.results,
+        }
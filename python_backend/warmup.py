@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Background cache warm-up for a study folder
+
+When a reader opens a folder such as 26409027/2020-07-14/, every clip in it
+is queued here and, one clip at a time per worker, ingested into the frame
+store (mmap sidecar) and rendered into the rendition ladder (thumbnail and
+full MP4 by default), so the first click on any of them is a cache hit.
+
+Workers run at a lower OS scheduling priority (nice WARMUP_NICE, inherited by
+the ffmpeg processes they start) so interactive requests win the CPU. Clips
+that are already queued are not queued again, and a clip whose sidecar and
+renditions already exist costs only a few stat calls.
+
+Usage:
+    python warmup.py <root or npz>... [--exam <patient>__<date> ...] [--profiles thumbnail full]
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from exam_index import ExamIndex
+from frame_store import FrameStore, iter_npz_paths
+from lazy_start import LazyStart
+from renditions import DEFAULT_FPS, PROFILES, RenditionManager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILES = ('thumbnail', 'full')
+DEFAULT_WORKERS = 1
+DEFAULT_MAX_QUEUE = 5000
+DEFAULT_NICE = 10
+MAX_JOB_HISTORY = 50
+MAX_JOB_ERRORS = 20
+
+
+class WarmupQueueFull(RuntimeError):
+    """Raised when a submission would exceed the queue bound"""
+
+
+def exam_clip_paths(exam_index: ExamIndex, exam_ids: Iterable[str], root: Optional[str] = None) -> List[str]:
+    """NPZ files and folders for exams: DB video paths that exist here, plus <root>/<patient>/<date>"""
+    targets = []
+    for exam_id in exam_ids:
+        for entry in exam_index.get(exam_id) or []:
+            if entry.get("video_npz") and os.path.exists(entry["video_npz"]):
+                targets.append(entry["video_npz"])
+        if root and isinstance(exam_id, str):
+            patient, _, date = exam_id.partition("__")
+            exam_dir = os.path.join(root, patient, date)
+            if patient and date and os.path.isdir(exam_dir):
+                targets.append(exam_dir)
+    return targets
+
+
+def _lower_thread_priority(niceness: int):
+    """Raise the calling thread's nice value (Linux schedules threads individually; no-op elsewhere)"""
+    if niceness <= 0 or not hasattr(os, 'setpriority') or not hasattr(threading, 'get_native_id'):
+        return
+    try:
+        tid = threading.get_native_id()
+        os.setpriority(os.PRIO_PROCESS, tid, os.getpriority(os.PRIO_PROCESS, tid) + niceness)
+    except OSError as e:
+        logger.debug(f"Warm-up: could not lower worker priority: {e}")
+
+
+class WarmupJob:
+    """Progress of one warm-up submission"""
+
+    def __init__(self, job_id: str, targets: Sequence[str], profiles: Sequence[str], fps: float, ingest: bool):
+        self.id = job_id
+        self.targets = list(targets)
+        self.profiles = tuple(profiles)
+        self.fps = fps
+        self.ingest = ingest
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0   # already queued by an earlier job
+        self.errors: List[dict] = []
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.finished_at is not None:
+            return "done"
+        return "running" if self.done or self.failed else "queued"
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "targets": self.targets,
+            "profiles": list(self.profiles),
+            "fps": self.fps,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "progress": round((self.done + self.failed) / self.total, 3) if self.total else 1.0,
+            "errors": self.errors,
+            "created_at": self.created_at,
+            "elapsed_s": round((self.finished_at or time.time()) - self.created_at, 2),
+        }
+
+
+class WarmupManager:
+    """Bounded, low-priority worker pool that fills the frame store and rendition caches"""
+
+    def __init__(self, renditions: RenditionManager, frame_store: FrameStore, workers: int = DEFAULT_WORKERS,
+                 max_queue: int = DEFAULT_MAX_QUEUE, profiles: Sequence[str] = DEFAULT_PROFILES,
+                 niceness: int = DEFAULT_NICE):
+        self.renditions = renditions
+        self.frame_store = frame_store
+        self.workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.profiles = tuple(profiles)
+        self.niceness = int(niceness)
+        self._cond = threading.Condition()
+        self._queue: Deque[Tuple[WarmupJob, str]] = deque()
+        self._queued: Set[str] = set()
+        self._jobs: Dict[str, WarmupJob] = {}
+        self._threads: LazyStart[List[threading.Thread]] = LazyStart(self._start_workers)
+        self._ids = itertools.count(1)
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+
+    @classmethod
+    def from_env(cls, renditions: RenditionManager, frame_store: FrameStore) -> "WarmupManager":
+        """Build a manager from WARMUP_WORKERS / WARMUP_MAX_QUEUE / WARMUP_PROFILES / WARMUP_NICE"""
+        try:
+            workers = int(os.environ.get('WARMUP_WORKERS') or DEFAULT_WORKERS)
+            max_queue = int(os.environ.get('WARMUP_MAX_QUEUE') or DEFAULT_MAX_QUEUE)
+            niceness = int(os.environ.get('WARMUP_NICE') or DEFAULT_NICE)
+        except ValueError:
+            logger.warning("Invalid WARMUP_WORKERS/WARMUP_MAX_QUEUE/WARMUP_NICE, using defaults")
+            workers, max_queue, niceness = DEFAULT_WORKERS, DEFAULT_MAX_QUEUE, DEFAULT_NICE
+        profiles = [p.strip() for p in os.environ.get('WARMUP_PROFILES', '').split(',') if p.strip() in PROFILES]
+        return cls(renditions, frame_store, workers, max_queue, profiles or DEFAULT_PROFILES, niceness)
+
+    def submit(self, targets: Sequence[str], profiles: Optional[Sequence[str]] = None, fps: float = DEFAULT_FPS,
+               recursive: bool = True, ingest: bool = True) -> WarmupJob:
+        """Queue every NPZ under targets; returns the job immediately (raises WarmupQueueFull)"""
+        profiles = tuple(profiles or self.profiles)
+        unknown = [p for p in profiles if p not in PROFILES]
+        if unknown:
+            raise ValueError(f"Unknown profiles {unknown}, expected some of {list(PROFILES)}")
+        paths = list(dict.fromkeys(os.path.abspath(p) for p in iter_npz_paths(list(targets), recursive=recursive)))
+
+        with self._cond:
+            job = WarmupJob(f"w{next(self._ids)}", targets, profiles, fps, ingest)
+            fresh = [p for p in paths if p not in self._queued]
+            if len(self._queue) + len(fresh) > self.max_queue:
+                raise WarmupQueueFull(f"Warm-up queue is full ({len(self._queue)} of {self.max_queue} clips queued)")
+            job.total = len(fresh)
+            job.skipped = len(paths) - len(fresh)
+            if not fresh:
+                job.finished_at = time.time()
+            for path in fresh:
+                self._queue.append((job, path))
+                self._queued.add(path)
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOB_HISTORY:
+                oldest = next(iter(self._jobs))
+                if self._jobs[oldest].finished_at is None:
+                    break
+                del self._jobs[oldest]
+            self._threads.get()
+            self._cond.notify_all()
+        logger.info(f"Warm-up {job.id}: queued {job.total} clips ({job.skipped} already queued) from {list(targets)}")
+        return job
+
+    def _start_workers(self) -> List[threading.Thread]:
+        threads = [threading.Thread(target=self._run, name=f'warmup-{i}', daemon=True) for i in range(self.workers)]
+        for t in threads:
+            t.start()
+        return threads
+
+    def _run(self):
+        _lower_thread_priority(self.niceness)
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job, path = self._queue.popleft()
+                self.active += 1
+            error = None
+            try:
+                self.warm(path, job.profiles, job.fps, job.ingest)
+            except Exception as e:
+                error = str(e)
+                logger.warning(f"Warm-up {job.id}: {path} failed: {e}")
+            with self._cond:
+                self.active -= 1
+                self._queued.discard(path)
+                if error is None:
+                    job.done += 1
+                    self.completed += 1
+                else:
+                    job.failed += 1
+                    self.failed += 1
+                    if len(job.errors) < MAX_JOB_ERRORS:
+                        job.errors.append({"path": path, "error": error})
+                if job.done + job.failed == job.total:
+                    job.finished_at = time.time()
+                    logger.info(f"Warm-up {job.id}: finished {job.done}/{job.total} clips "
+                                f"in {job.finished_at - job.created_at:.1f} s")
+
+    def warm(self, npz_path: str, profiles: Sequence[str], fps: float = DEFAULT_FPS, ingest: bool = True):
+        """Warm one clip synchronously: frame store sidecar, then each rendition"""
+        if ingest:
+            self.frame_store.ingest(npz_path)
+        self.renditions.ensure(npz_path, profiles, fps)
+
+    def job(self, job_id: str) -> Optional[WarmupJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "profiles": list(self.profiles),
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "active": self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+                "jobs": [job.to_dict() for job in reversed(list(self._jobs.values()))],
+            }
+
+
+def main(argv=None):
+    from frame_cache import FrameCache
+    from frame_executor import FrameExecutor
+    from transcode_cache import TranscodeCache
+    from video_encoder import EncoderRegistry
+
+    parser = argparse.ArgumentParser(description="Fill the frame store and rendition caches for study folders")
+    parser.add_argument('targets', nargs='*', help="NPZ files or folders (with --exam: the study root)")
+    parser.add_argument('--exam', nargs='+', default=[], help="exam_ids (<patient>__<date>) from the DB JSON")
+    parser.add_argument('--db', default=os.environ.get('DB_JSON_PATH') or os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), '..', 'public', 'DB_json', 'eval_result-attn-50-3_local.json'),
+        help="DB JSON used to resolve --exam")
+    parser.add_argument('--profiles', nargs='+', default=list(DEFAULT_PROFILES), choices=list(PROFILES))
+    parser.add_argument('--fps', type=float, default=DEFAULT_FPS, help="frame rate of the MP4 renditions")
+    parser.add_argument('--no-ingest', action='store_true', help="Do not write frame store sidecars")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    args = parser.parse_args(argv)
+
+    targets = list(args.targets)
+    if args.exam:
+        root = targets[0] if len(targets) == 1 and os.path.isdir(targets[0]) else None
+        targets = exam_clip_paths(ExamIndex(args.db), args.exam, root)
+    if not targets:
+        parser.error("nothing to warm up: give NPZ files/folders, or --exam with a study root")
+
+    logging.basicConfig(level=logging.INFO)
+    frame_store = FrameStore.from_env(FrameCache(0))
+    manager = WarmupManager(
+        RenditionManager(TranscodeCache.from_env(), frame_store, EncoderRegistry.from_env(), FrameExecutor.from_env()),
+        frame_store, workers=args.workers, niceness=0)
+    job = manager.submit(targets, args.profiles, args.fps, ingest=not args.no_ingest)
+    while job.finished_at is None:
+        time.sleep(0.5)
+        print(f"⏳ {job.done + job.failed}/{job.total} clips, queue depth {manager.stats()['queue_depth']}")
+    for error in job.errors:
+        print(f"❌ {error['path']}: {error['error']}")
+    print(f"✅ warmed {job.done}/{job.total} clips in {time.time() - job.created_at:.1f} s")
+    return 1 if job.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
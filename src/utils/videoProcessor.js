@@ -13,6 +13,20 @@ export const getVideoPathFromExam = (examData) => {
   return "/videos/26409027(1).dcm.mp4";
 };
 
+// Split a binary frame bundle ([uint32 big-endian length][image bytes] ...) into object URLs
+export const parseFrameBundle = (buffer, mime = 'image/jpeg') => {
+  const view = new DataView(buffer);
+  const urls = [];
+  let offset = 0;
+  while (offset + 4 <= buffer.byteLength) {
+    const length = view.getUint32(offset);
+    offset += 4;
+    urls.push(URL.createObjectURL(new Blob([buffer.slice(offset, offset + length)], { type: mime })));
+    offset += length;
+  }
+  return urls;
+};
+
 // Method 1: Video Frames Sequence (Recommended for smooth playback)
 export const npzToVideoFrames = async (npzPath, options = {}) => {
   try {
@@ -29,6 +43,7 @@ export const npzToVideoFrames = async (npzPath, options = {}) => {
         denoise: options.denoise || null,
         contrast: options.contrast || 1.0,
         brightness: options.brightness || 0.0,
+        transport: 'binary',
         ...options
       }
     };
@@ -48,8 +63,18 @@ export const npzToVideoFrames = async (npzPath, options = {}) => {
     const data = await response.json();
     console.log('✅ Video frames received:', data.video_info);
     
+    // Binary transport: JSON carries metadata only, frames are fetched as raw bytes
+    let frames = data.frames;
+    if (data.frames_url) {
+      const bundle = await fetch(`${BACKEND_URL}${data.frames_url}`);
+      if (!bundle.ok) {
+        throw new Error(`HTTP error! status: ${bundle.status}`);
+      }
+      frames = parseFrameBundle(await bundle.arrayBuffer(), data.frame_mime);
+    }
+    
     return {
-      frames: data.frames,
+      frames,
       videoInfo: data.video_info,
       playbackInfo: data.playback_info,
       frameTimings: data.frame_timings
@@ -72,6 +97,7 @@ export const npzToVideoBlob = async (npzPath, options = {}) => {
         fps: options.fps || 20,
         max_frames: options.maxFrames || 50,
         resize: options.resize || [224, 224],
+        transport: 'binary',
         ...options
       }
     };
@@ -91,7 +117,8 @@ export const npzToVideoBlob = async (npzPath, options = {}) => {
     const data = await response.json();
     console.log('✅ Video blob received');
     
-    return data.video_blob;
+    // Binary transport returns a URL the video element can load directly
+    return data.video_url ? `${BACKEND_URL}${data.video_url}` : data.video_blob;
   } catch (error) {
     console.error('❌ Error getting video blob:', error);
     throw error;
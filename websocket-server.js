@@ -27,8 +27,54 @@ try {
   console.warn('Socket.IO server will start but OpenAI features will be disabled');
 }
 
+// Python 백엔드 작업 완료 알림 (JOB_NOTIFY_URL -> POST /notify/jobs)
+const NOTIFY_PATH = '/notify/jobs';
+const NOTIFY_TOKEN = process.env.JOB_NOTIFY_TOKEN || '';
+const NOTIFY_MAX_BYTES = 1024 * 1024;
+
+function handleHttpRequest(req, res) {
+  // Socket.IO가 /socket.io/ 요청을 먼저 처리하고 나머지만 여기로 전달
+  if (req.method !== 'POST' || req.url.split('?')[0] !== NOTIFY_PATH) {
+    res.writeHead(404, { 'Content-Type': 'application/json' });
+    res.end(JSON.stringify({ error: 'Not found' }));
+    return;
+  }
+  if (NOTIFY_TOKEN && req.headers['x-notify-token'] !== NOTIFY_TOKEN) {
+    res.writeHead(403, { 'Content-Type': 'application/json' });
+    res.end(JSON.stringify({ error: 'Invalid notify token' }));
+    return;
+  }
+
+  let body = '';
+  req.on('data', (chunk) => {
+    body += chunk;
+    if (body.length > NOTIFY_MAX_BYTES) {
+      res.writeHead(413, { 'Content-Type': 'application/json' });
+      res.end(JSON.stringify({ error: 'Payload too large' }));
+      req.destroy();
+    }
+  });
+  req.on('end', () => {
+    let payload;
+    try {
+      payload = JSON.parse(body);
+    } catch (error) {
+      res.writeHead(400, { 'Content-Type': 'application/json' });
+      res.end(JSON.stringify({ error: 'Invalid JSON' }));
+      return;
+    }
+    // 연결된 모든 클라이언트에 작업 상태 전달 (job.id로 자신의 작업을 구분)
+    io.emit('job_update', {
+      ...payload.job,
+      timestamp: new Date().toISOString()
+    });
+    res.writeHead(204);
+    res.end();
+  });
+}
+
 // HTTP 서버 생성
-const httpServer = createServer();
+const httpServer = createServer(handleHttpRequest);
 
 // Socket.IO 서버 생성 (CORS 허용)
 const io = new Server(httpServer, {